@@ -0,0 +1,299 @@
+"""CAFA submission files: block writer and CSR reader.
+
+Predictions are written from sparse score blocks rather than line by line:
+every block is turned into flat (protein, term, score) arrays, rounded
+scores are formatted through a lookup table and the lines are joined in C,
+so exporting is bound by I/O (and compression), not by the interpreter.
+Files ending with ``.gz`` or ``.zst`` are (de)compressed on the fly.
+"""
+import argparse
+import gzip
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from deepfold.core.evaluation.predictions import (DEFAULT_MIN_SCORE,
+                                                  PredictionReader,
+                                                  ScoreMatrix, is_predictions)
+
+HEADER_KEYS = ('AUTHOR', 'MODEL', 'KEYWORDS', 'ACCURACY', 'END')
+
+
+def open_text(filename, mode='rt'):
+    """Open a text file, gzip or zstd compressed by extension."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode, compresslevel=6, encoding='utf-8')
+    if filename.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading or writing .zst files needs the '
+                              'zstandard package')
+        binary = open(filename, mode.replace('t', '') + 'b')
+        if 'r' in mode:
+            stream = zstandard.ZstdDecompressor().stream_reader(binary,
+                                                                closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(binary,
+                                                              closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+def _score_table(precision):
+    return np.array(['%.*f' % (precision, i / 10**precision)
+                     for i in range(10**precision + 1)],
+                    dtype=object)
+
+
+def _round_steps(scores, precision=2):
+    """Scores in ``[0, 1]`` rounded to integer multiples of
+    ``10**-precision`` exactly as ``'%.*f'`` rounds them.
+
+    ``rint(score * 10**precision)`` breaks ties of the scaled value, while
+    ``'%.2f'`` rounds the exact binary value (``0.005`` -> ``0.01``,
+    ``0.015`` -> ``0.01``); the few scores next to a tie are formatted by
+    Python instead.
+    """
+    scores = np.clip(np.asarray(scores, dtype=np.float64), 0, 1)
+    scaled = scores * 10**precision
+    steps = np.rint(scaled).astype(np.int64)
+    ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in ties:
+        steps[i] = int(('%.*f' % (precision, scores[i])).replace('.', ''))
+    return steps
+
+
+def iter_triples(predictions, block_size=100000):
+    """Flat ``(rows, proteins, terms, scores)`` arrays of every block.
+
+    Args:
+        predictions: ``{protein: {term: score}}``, a ``ScoreMatrix``, a
+            ``PredictionReader`` or an iterable of blocks, each a
+            ``ScoreMatrix`` or a ``(proteins, terms, scores)`` tuple with a
+            dense or sparse ``(len(proteins), len(terms))`` ``scores``.
+
+    ``rows`` numbers the proteins within the block.
+    """
+    if isinstance(predictions, dict):
+        items = list(predictions.items())
+        for start in range(0, len(items), block_size):
+            block = items[start:start + block_size]
+            counts = [len(terms) for _, terms in block]
+            rows = np.repeat(np.arange(len(block)), counts)
+            proteins = np.repeat(
+                np.array([p_id for p_id, _ in block], dtype=object), counts)
+            terms = np.array(
+                [t_id for _, scores in block for t_id in scores],
+                dtype=object)
+            scores = np.array(
+                [s for _, scores in block for s in scores.values()],
+                dtype=np.float64)
+            yield rows, proteins, terms, scores
+        return
+    if isinstance(predictions, ScoreMatrix):
+        blocks = [predictions]
+    elif hasattr(predictions, 'iter_blocks'):
+        blocks = predictions.iter_blocks(block_size)
+    else:
+        blocks = predictions
+    for block in blocks:
+        if isinstance(block, ScoreMatrix):
+            proteins, terms, scores = block.proteins, block.terms, block.scores
+        else:
+            proteins, terms, scores = block
+        scores = sp.csr_matrix(scores)
+        proteins = np.asarray(proteins, dtype=object)
+        terms = np.asarray(terms, dtype=object)
+        rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+        yield (rows, proteins[rows], terms[scores.indices],
+               scores.data.astype(np.float64))
+
+
+def format_lines(proteins, terms, scores, precision=2):
+    """Tab separated lines of flat triples; scores are rounded to
+    ``precision`` decimals (``None`` writes them as they are)."""
+    if precision is None:
+        scores = np.asarray(scores).astype(str).astype(object)
+    else:
+        scores = _score_table(precision)[_round_steps(scores, precision)]
+    if not len(scores):
+        return ''
+    return '\n'.join(map('\t'.join, zip(proteins, terms, scores))) + '\n'
+
+
+def write_triples(out,
+                  predictions,
+                  min_score=DEFAULT_MIN_SCORE,
+                  precision=2,
+                  sort=True,
+                  block_size=100000):
+    """Write the predictions of ``iter_triples`` to an open text file.
+
+    Scores that round below ``min_score`` are skipped (``None`` keeps them
+    all); with ``sort`` the terms of every protein are written from the
+    highest score down.
+
+    Returns:
+        number of lines written
+    """
+    num_lines = 0
+    for rows, proteins, terms, scores in iter_triples(predictions,
+                                                      block_size):
+        if precision is not None:
+            scores = _round_steps(scores, precision) / 10**precision
+        if min_score is not None:
+            keep = scores >= min_score
+            rows, proteins, terms, scores = (rows[keep], proteins[keep],
+                                             terms[keep], scores[keep])
+        if sort:
+            order = np.lexsort((-scores, rows))
+            proteins, terms, scores = (proteins[order], terms[order],
+                                       scores[order])
+        out.write(format_lines(proteins, terms, scores, precision))
+        num_lines += len(scores)
+    return num_lines
+
+
+def write_cafa(predictions,
+               filename,
+               author,
+               model=1,
+               keywords=None,
+               min_score=DEFAULT_MIN_SCORE,
+               sort=True,
+               block_size=100000):
+    """Write a CAFA submission file.
+
+    Args:
+        predictions: anything ``iter_triples`` accepts, e.g. a generator of
+            ``(proteins, terms, scores)`` blocks produced during inference.
+        keywords: list of CAFA method keywords.
+    """
+    with open_text(filename, 'wt') as out:
+        out.write('AUTHOR\t%s\n' % author)
+        out.write('MODEL\t%d\n' % model)
+        if keywords:
+            out.write('KEYWORDS\t%s.\n' % ', '.join(keywords))
+        num_lines = write_triples(out,
+                                  predictions,
+                                  min_score=min_score,
+                                  sort=sort,
+                                  block_size=block_size)
+        out.write('END\n')
+    return num_lines
+
+
+def write_table(predictions,
+                filename,
+                header,
+                min_score=DEFAULT_MIN_SCORE,
+                precision=2,
+                sort=True):
+    """Write predictions (or hits) as a tab separated table with a header
+    line, e.g. ``('Target ID', 'GO Term', 'RI')``."""
+    with open_text(filename, 'wt') as out:
+        out.write('\t'.join(header) + '\n')
+        return write_triples(out,
+                             predictions,
+                             min_score=min_score,
+                             precision=precision,
+                             sort=sort)
+
+
+def read_cafa(filename, terms=None, chunk_size=1 << 20):
+    """Parse a CAFA submission (or prediction table) into a ``ScoreMatrix``.
+
+    Header lines (AUTHOR, MODEL, KEYWORDS, END...) and lines without a
+    numeric score are skipped.
+
+    Args:
+        terms: column ids of the result, other terms are dropped (default:
+            all terms, in order of first appearance).
+    """
+    proteins, term_ids, scores = [], [], []
+    with open_text(filename, 'rt') as f:
+        chunks = pd.read_csv(f,
+                             sep=r'\s+',
+                             header=None,
+                             names=['protein', 'term', 'score'],
+                             usecols=[0, 1, 2],
+                             dtype=str,
+                             on_bad_lines='skip',
+                             chunksize=chunk_size)
+        for chunk in chunks:
+            score = pd.to_numeric(chunk['score'], errors='coerce')
+            keep = score.notna() & ~chunk['protein'].isin(HEADER_KEYS)
+            proteins.append(chunk['protein'][keep].to_numpy(dtype=object))
+            term_ids.append(chunk['term'][keep].to_numpy(dtype=object))
+            scores.append(score[keep].to_numpy(dtype=np.float32))
+    proteins = np.concatenate(proteins) if proteins else np.zeros(0, object)
+    term_ids = np.concatenate(term_ids) if term_ids else np.zeros(0, object)
+    scores = np.concatenate(scores) if scores else np.zeros(0, np.float32)
+
+    rows, protein_ids = pd.factorize(proteins)
+    if terms is None:
+        cols, terms = pd.factorize(term_ids)
+    else:
+        terms = np.asarray(terms, dtype=object)
+        cols = pd.Index(terms).get_indexer(term_ids)
+        keep = cols >= 0
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    # a repeated (protein, term) keeps its highest score; ``tocsr`` would
+    # sum them
+    matrix = _max_duplicates(rows, cols, scores,
+                             (len(protein_ids), len(terms)))
+    return ScoreMatrix(np.asarray(protein_ids, dtype=object),
+                       np.asarray(terms, dtype=object), matrix)
+
+
+def _max_duplicates(rows, cols, scores, shape):
+    order = np.lexsort((-scores, cols, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    return sp.csr_matrix((scores[first], (rows[first], cols[first])),
+                         shape=shape)
+
+
+parser = argparse.ArgumentParser(
+    description='Export predictions to a CAFA submission file')
+parser.add_argument('--predictions',
+                    '-p',
+                    required=True,
+                    help='Predictions directory or ScoreMatrix .npz')
+parser.add_argument('--output-file',
+                    '-o',
+                    required=True,
+                    help='CAFA file, compressed if ending with .gz or .zst')
+parser.add_argument('--author', default='DeepFold')
+parser.add_argument('--model', default=1, type=int)
+parser.add_argument('--keywords',
+                    nargs='*',
+                    default=['machine learning'],
+                    help='CAFA method keywords')
+parser.add_argument('--min-score', default=DEFAULT_MIN_SCORE, type=float)
+
+
+def main(predictions_path, output_file, author, model, keywords, min_score):
+    if is_predictions(predictions_path):
+        predictions = PredictionReader(predictions_path)
+    else:
+        predictions = ScoreMatrix.load(predictions_path)
+    num_lines = write_cafa(predictions,
+                           output_file,
+                           author,
+                           model=model,
+                           keywords=keywords,
+                           min_score=min_score)
+    logging.info('Wrote %d predictions to %s' % (num_lines, output_file))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+    main(args.predictions, args.output_file, args.author, args.model,
+         args.keywords, args.min_score)
@@ -0,0 +1,272 @@
+"""Score-level ensembling of GO predictions.
+
+Any number of ``ScoreMatrix`` predictions (model heads, DIAMOND / k-mer
+homology transfer, embedding kNN...) are aligned on a shared protein x term
+index and blended linearly with one weight vector per GO namespace, the
+DeepGOPlus recipe generalized to more than two sources. The weights are
+grid-searched on the simplex, in a process pool, against the Fmax that the
+evaluation tools report (``runner.evaluate_scores`` at ``THRESHOLDS``).
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from deepfold.core.evaluation.predictions import ScoreMatrix
+from deepfold.core.evaluation.propagation import TruePathPropagator
+from deepfold.core.evaluation.runner import (THRESHOLDS, evaluate_scores,
+                                             summarize)
+from deepfold.data.utils.columnar import load_columns
+from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
+from deepfold.data.utils.homology_search import hits_to_dict, read_hits
+from deepfold.data.utils.information_content import annotation_matrix
+from deepfold.data.utils.ontology import Ontology
+
+logging.basicConfig(level=logging.INFO)
+
+# state of the grid search workers, set by init_worker
+_matrices = None
+_labels = None
+_thresholds = None
+
+
+def align_predictions(predictions, proteins=None, terms=None):
+    """Reindex predictions on a shared protein x term index.
+
+    Args:
+        predictions: list of ``ScoreMatrix``.
+        proteins: row ids (default: those of the first prediction).
+        terms: column ids (default: union of all terms, in order of first
+            appearance).
+
+    Returns:
+        proteins, terms, list of CSR score matrices
+    """
+    if proteins is None:
+        proteins = predictions[0].proteins
+    if terms is None:
+        terms = list(
+            dict.fromkeys(itertools.chain(*[p.terms for p in predictions])))
+    aligned = [p.align(proteins, terms) for p in predictions]
+    return (aligned[0].proteins, aligned[0].terms,
+            [a.scores for a in aligned])
+
+
+def weight_grid(num_sources, step=0.1):
+    """All weight vectors on the simplex with coordinates in ``step``
+    multiples, as a ``(num_vectors, num_sources)`` array."""
+    num_steps = int(round(1.0 / step))
+    grid = [
+        c for c in itertools.product(range(num_steps + 1),
+                                     repeat=num_sources - 1)
+        if sum(c) <= num_steps
+    ]
+    grid = np.array([list(c) + [num_steps - sum(c)] for c in grid],
+                    dtype=np.float64).reshape(-1, num_sources)
+    return grid / num_steps
+
+
+def blend(matrices, weights, term_namespaces=None):
+    """Weighted sum of aligned score matrices.
+
+    Args:
+        matrices: aligned CSR score matrices.
+        weights: one weight per matrix, or ``{namespace: weights}`` applied
+            to the columns of ``term_namespaces`` (other columns get 0).
+        term_namespaces: namespace of every column.
+    """
+    if not isinstance(weights, dict):
+        return sum(w * m for w, m in zip(weights, matrices)).tocsr()
+    term_namespaces = np.asarray(term_namespaces, dtype=object)
+    blended = None
+    for i, matrix in enumerate(matrices):
+        column_weights = np.zeros(matrix.shape[1])
+        for namespace, ns_weights in weights.items():
+            column_weights[term_namespaces == namespace] = ns_weights[i]
+        part = matrix @ sp.diags(column_weights)
+        blended = part if blended is None else blended + part
+    return sp.csr_matrix(blended)
+
+
+def init_worker(matrices, labels, columns, thresholds):
+    global _matrices, _labels, _thresholds
+    _matrices = dict(
+        (ns, [m[:, cols] for m in matrices]) for ns, cols in columns.items())
+    _labels = dict((ns, labels[:, cols]) for ns, cols in columns.items())
+    _thresholds = thresholds
+
+
+def evaluate_weights(args):
+    namespace, weights = args
+    blended = blend(_matrices[namespace], weights)
+    labels = _labels[namespace]
+    # the Fmax does not depend on the IC
+    metrics = evaluate_scores(labels,
+                              blended,
+                              np.zeros(labels.shape[1]),
+                              thresholds=_thresholds)
+    summary, _, _ = summarize(metrics, _thresholds)
+    return namespace, tuple(weights), summary['fmax'], summary['threshold']
+
+
+def grid_search(matrices,
+                labels,
+                term_namespaces,
+                namespaces=None,
+                step=0.1,
+                thresholds=THRESHOLDS,
+                num_workers=None):
+    """Best blending weights of every namespace.
+
+    Args:
+        matrices: aligned CSR score matrices.
+        labels: ``(proteins, terms)`` sparse binary true annotations.
+        term_namespaces: namespace of every column; columns whose namespace
+            is not in ``namespaces`` (e.g. the roots) are not evaluated.
+        step: grid resolution of ``weight_grid``.
+
+    Returns:
+        ``{namespace: weights}`` and a DataFrame with the Fmax of every
+        evaluated (namespace, weights).
+    """
+    term_namespaces = np.asarray(term_namespaces, dtype=object)
+    if namespaces is None:
+        namespaces = [ns for ns in dict.fromkeys(term_namespaces) if ns]
+    columns = dict(
+        (ns, np.flatnonzero(term_namespaces == ns)) for ns in namespaces)
+    columns = dict((ns, cols) for ns, cols in columns.items() if len(cols))
+    namespaces = list(columns)
+    grid = weight_grid(len(matrices), step)
+    tasks = [(ns, weights) for ns in namespaces for weights in grid]
+    initargs = (matrices, sp.csr_matrix(labels), columns,
+                np.asarray(thresholds, dtype=np.float64))
+    if num_workers == 0:
+        init_worker(*initargs)
+        results = [evaluate_weights(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_workers,
+                                  initializer=init_worker,
+                                  initargs=initargs) as pool:
+            results = pool.map(evaluate_weights, tasks)
+    results = pd.DataFrame(
+        results, columns=['namespace', 'weights', 'fmax', 'threshold'])
+    best = results.loc[results.groupby('namespace')['fmax'].idxmax()]
+    best_weights = dict(
+        (ns, np.asarray(w)) for ns, w in zip(best['namespace'], best['weights']))
+    return best_weights, results
+
+
+parser = argparse.ArgumentParser(
+    description='Blend model and homology predictions per GO namespace')
+parser.add_argument('--test-data-file',
+                    '-tsdf',
+                    default='data/test_data.pkl',
+                    help='Data file with proteins and prop_annotations')
+parser.add_argument('--train-data-file',
+                    '-trdf',
+                    default='data/train_data.pkl',
+                    help='Data file with training annotations (for the '
+                    'homology transfer)')
+parser.add_argument('--model-preds-files',
+                    '-mpf',
+                    nargs='*',
+                    default=[],
+                    help='Predictions directories written by the inference '
+                    'tools (<model>_predictions)')
+parser.add_argument('--score-files',
+                    '-sf',
+                    nargs='*',
+                    default=[],
+                    help='Saved ScoreMatrix (.npz) predictions')
+parser.add_argument('--diamond-scores-files',
+                    '-dsf',
+                    nargs='*',
+                    default=[],
+                    help='Homology hits tables (query, target, score)')
+parser.add_argument('--ontology-obo-file',
+                    '-obo',
+                    default='data/go.obo',
+                    help='Ontology file')
+parser.add_argument('--step', default=0.1, type=float, help='Grid step')
+parser.add_argument('--num-workers', '-nw', default=None, type=int)
+parser.add_argument('--output-file',
+                    '-o',
+                    default='data/ensemble_preds.npz',
+                    help='Blended ScoreMatrix')
+
+
+def main(test_data_file,
+         train_data_file,
+         model_preds_files,
+         score_files,
+         diamond_scores_files,
+         go_obo_file,
+         output_file,
+         step=0.1,
+         num_workers=None):
+    go = Ontology(go_obo_file, with_rels=True)
+    test_proteins, test_annots = load_columns(
+        test_data_file, ['proteins', 'prop_annotations'])
+
+    predictions = []
+    for preds_dir in model_preds_files:
+        predictions.append(ScoreMatrix.load(preds_dir))
+    for score_file in score_files:
+        predictions.append(ScoreMatrix.load(score_file))
+    if diamond_scores_files:
+        train_proteins, train_annots = load_columns(
+            train_data_file, ['proteins', 'prop_annotations'])
+        for scores_file in diamond_scores_files:
+            predictions.append(
+                ScoreMatrix.from_homology(test_proteins,
+                                          hits_to_dict(read_hits(scores_file)),
+                                          train_proteins, train_annots))
+    if not predictions:
+        raise ValueError('No predictions to blend')
+
+    proteins, terms, matrices = align_predictions(predictions,
+                                                  proteins=test_proteins)
+    # blend and score true-path propagated sources, like the evaluation
+    # tools
+    propagator = TruePathPropagator(go, terms)
+    matrices = [propagator(matrix) for matrix in matrices]
+    pred_terms = propagator.terms
+    # labels over the predicted and the true terms, true terms that no
+    # source predicts are false negatives
+    terms = list(dict.fromkeys(itertools.chain(pred_terms, *test_annots)))
+    term_index = dict((t_id, i) for i, t_id in enumerate(terms))
+    labels, _, _ = annotation_matrix(test_annots, term_index)
+    for matrix in matrices:
+        matrix.resize((matrix.shape[0], len(terms)))
+    term_namespaces = np.array(
+        [go.get_namespace(t_id) if t_id in go.ont else '' for t_id in terms],
+        dtype=object)
+    # the roots are blended but, as in the evaluation tools, not scored
+    eval_namespaces = term_namespaces.copy()
+    eval_namespaces[np.isin(terms, list(FUNC_DICT.values()))] = ''
+    best_weights, results = grid_search(matrices,
+                                        labels,
+                                        eval_namespaces,
+                                        namespaces=list(NAMESPACES.values()),
+                                        step=step,
+                                        num_workers=num_workers)
+    for namespace, weights in best_weights.items():
+        fmax = results[results['namespace'] == namespace]['fmax'].max()
+        logging.info('%s: weights %s, Fmax %0.3f' %
+                     (namespace, np.round(weights, 3).tolist(), fmax))
+
+    blended = blend(matrices, best_weights, term_namespaces)
+    blended = blended[:, :len(pred_terms)]
+    ScoreMatrix(proteins, pred_terms, blended).save(output_file)
+    logging.info('Saved blended predictions to %s' % output_file)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.test_data_file, args.train_data_file, args.model_preds_files,
+         args.score_files, args.diamond_scores_files, args.ontology_obo_file,
+         args.output_file, args.step, args.num_workers)
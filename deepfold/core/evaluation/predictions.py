@@ -0,0 +1,340 @@
+"""Sparse protein x term score matrices.
+
+A ``ScoreMatrix`` holds the prediction scores of a set of proteins over a
+set of GO terms as a CSR matrix, whatever produced them (model heads,
+homology transfer, embedding kNN), so that predictions can be aligned,
+combined and saved without per-protein dictionaries.
+
+Inference output is stored as a predictions directory, written block by
+block and memory mapped when read::
+
+    meta.json                  {"num_rows": N, "num_terms": T, ...}
+    proteins.bytes, .offsets   protein ids ('str' buffers of columnar.py)
+    terms.bytes, .offsets      term vocabulary
+    indptr, indices, data      CSR rows: int64, int32, float16 scores
+
+Only the ``top_k`` best scores ``>= min_score`` of every protein are kept.
+"""
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from deepfold.data.utils.columnar import StrColumn, write_strings
+from deepfold.data.utils.information_content import annotation_matrix
+
+# CAFA accepts at most 1500 terms per target, scores of 0.00 are not valid
+DEFAULT_TOP_K = 1500
+DEFAULT_MIN_SCORE = 0.01
+
+
+class ScoreMatrix(object):
+    """Scores of ``proteins`` (rows) over ``terms`` (columns).
+
+    Args:
+        proteins: protein ids.
+        terms: term ids.
+        scores: ``(len(proteins), len(terms))`` sparse or dense scores.
+    """
+    def __init__(self, proteins, terms, scores):
+        self.proteins = np.asarray(proteins, dtype=object)
+        self.terms = np.asarray(terms, dtype=object)
+        self.scores = sp.csr_matrix(scores, dtype=np.float32)
+        self.scores.eliminate_zeros()
+        if self.scores.shape != (len(self.proteins), len(self.terms)):
+            raise ValueError(
+                f'Scores of shape {self.scores.shape} do not match '
+                f'{len(self.proteins)} proteins and {len(self.terms)} terms')
+
+    def __len__(self):
+        return len(self.proteins)
+
+    @property
+    def shape(self):
+        return self.scores.shape
+
+    @classmethod
+    def from_dense(cls, proteins, terms, preds, min_score=0.0):
+        """From dense per-protein score vectors; scores below
+        ``min_score`` are dropped."""
+        preds = np.asarray(np.stack(list(preds)), dtype=np.float32)
+        if min_score > 0:
+            preds = np.where(preds >= min_score, preds, 0)
+        return cls(proteins, terms, sp.csr_matrix(preds))
+
+    @classmethod
+    def from_homology(cls, proteins, hits, train_proteins, train_annots):
+        """BlastKNN annotation transfer.
+
+        The score of a term for a query is the similarity-weighted fraction
+        of its hits annotated with the term, i.e. the row-normalized
+        ``(queries, targets)`` hit matrix times the ``(targets, terms)``
+        annotation matrix.
+
+        Args:
+            proteins: query ids (rows of the result).
+            hits: ``{query: {target: score}}`` (``get_diamond_scores``,
+                ``hits_to_dict``).
+            train_proteins, train_annots: target ids and annotation sets.
+        """
+        target_index = dict((p_id, i) for i, p_id in enumerate(train_proteins))
+        rows, cols, data = [], [], []
+        for i, prot_id in enumerate(proteins):
+            for target, score in hits.get(prot_id, {}).items():
+                if target in target_index:
+                    rows.append(i)
+                    cols.append(target_index[target])
+                    data.append(score)
+        similarity = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float64), (rows, cols)),
+            shape=(len(proteins), len(target_index)))
+        total = np.asarray(similarity.sum(axis=1)).ravel()
+        similarity = sp.diags(1.0 / np.where(total > 0, total, 1)) @ similarity
+        annots, terms, _ = annotation_matrix(train_annots)
+        return cls(proteins, terms, similarity @ annots)
+
+    def iter_rows(self):
+        """Yield ``(protein, term ids, scores)`` for every protein."""
+        scores = self.scores
+        for i, protein in enumerate(self.proteins):
+            row = slice(scores.indptr[i], scores.indptr[i + 1])
+            yield protein, self.terms[scores.indices[row]], scores.data[row]
+
+    def align(self, proteins, terms):
+        """Scores reindexed on ``proteins`` x ``terms``; missing rows and
+        columns are zero."""
+        proteins = np.asarray(proteins, dtype=object)
+        terms = np.asarray(terms, dtype=object)
+        row_index = dict((p_id, i) for i, p_id in enumerate(self.proteins))
+        col_index = dict((t_id, i) for i, t_id in enumerate(self.terms))
+        rows = np.array([row_index.get(p_id, -1) for p_id in proteins],
+                        dtype=np.int64)
+        cols = np.array([col_index.get(t_id, -1) for t_id in terms],
+                        dtype=np.int64)
+        # selection matrices: (new rows, old rows) and (old cols, new cols)
+        new_rows = np.flatnonzero(rows >= 0)
+        row_select = sp.csr_matrix(
+            (np.ones(len(new_rows), dtype=np.float32),
+             (new_rows, rows[new_rows])),
+            shape=(len(proteins), len(self.proteins)))
+        new_cols = np.flatnonzero(cols >= 0)
+        col_select = sp.csr_matrix(
+            (np.ones(len(new_cols), dtype=np.float32),
+             (cols[new_cols], new_cols)),
+            shape=(len(self.terms), len(terms)))
+        return ScoreMatrix(proteins, terms,
+                           row_select @ self.scores @ col_select)
+
+    def save(self, filename):
+        """Save as a compressed ``.npz`` archive."""
+        np.savez_compressed(filename,
+                            data=self.scores.data,
+                            indices=self.scores.indices,
+                            indptr=self.scores.indptr,
+                            shape=np.asarray(self.scores.shape),
+                            proteins=self.proteins.astype(str),
+                            terms=self.terms.astype(str))
+
+    @classmethod
+    def load(cls, filename):
+        """Load a ``.npz`` archive or a predictions directory."""
+        if is_predictions(filename):
+            return PredictionReader(filename).to_score_matrix()
+        with np.load(filename) as f:
+            scores = sp.csr_matrix((f['data'], f['indices'], f['indptr']),
+                                   shape=tuple(f['shape']))
+            return cls(f['proteins'].astype(object),
+                       f['terms'].astype(object), scores)
+
+
+def sparsify(preds, top_k=DEFAULT_TOP_K, min_score=DEFAULT_MIN_SCORE):
+    """CSR matrix of the ``top_k`` highest scores ``>= min_score`` of every
+    row of a dense or sparse ``(num_proteins, num_terms)`` score matrix."""
+    if not sp.issparse(preds):
+        preds = np.asarray(preds, dtype=np.float32)
+        if preds.ndim == 1:
+            preds = preds[None, :]
+        if top_k is None or top_k >= preds.shape[1]:
+            return sp.csr_matrix(np.where(preds >= min_score, preds, 0))
+        # the k-th largest score of every row, ties keep the first columns
+        kth = -np.partition(-preds, top_k - 1, axis=1)[:, top_k - 1:top_k]
+        keep = preds >= np.maximum(kth, min_score)
+        keep &= np.cumsum(keep, axis=1) <= top_k
+        return sp.csr_matrix(np.where(keep, preds, 0))
+    preds = sp.csr_matrix(preds, dtype=np.float32)
+    rows = np.repeat(np.arange(preds.shape[0]), np.diff(preds.indptr))
+    keep = preds.data >= min_score
+    if top_k is not None:
+        # rank of every score within its row, highest first
+        order = np.lexsort((-preds.data, rows))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - preds.indptr[rows[order]]
+        keep &= rank < top_k
+    return sp.csr_matrix(
+        (preds.data[keep], (rows[keep], preds.indices[keep])),
+        shape=preds.shape)
+
+
+class PredictionWriter(object):
+    """Stream predictions into a predictions directory.
+
+    Example:
+        with PredictionWriter(path, terms) as writer:
+            for proteins, preds in batches:
+                writer.append(proteins, preds)
+    """
+    def __init__(self,
+                 path,
+                 terms,
+                 top_k=DEFAULT_TOP_K,
+                 min_score=DEFAULT_MIN_SCORE):
+        self.path = path
+        self.terms = list(terms)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.num_rows = 0
+        self.nnz = 0
+        self.string_offset = 0
+        os.makedirs(path, exist_ok=True)
+        write_strings(path, 'terms', self.terms)
+        self._files = dict(
+            (name, open(os.path.join(path, name), 'wb'))
+            for name in ('proteins.bytes', 'proteins.offsets', 'indptr',
+                         'indices', 'data'))
+        self._write('proteins.offsets', np.zeros(1, dtype=np.int64))
+        self._write('indptr', np.zeros(1, dtype=np.int64))
+
+    def _write(self, name, array):
+        self._files[name].write(np.ascontiguousarray(array).tobytes())
+
+    def append(self, proteins, preds):
+        """Append a block of proteins and their dense (or sparse) scores."""
+        scores = sparsify(preds, self.top_k, self.min_score)
+        if scores.shape != (len(proteins), len(self.terms)):
+            raise ValueError(f'Expected scores of shape '
+                             f'{(len(proteins), len(self.terms))}, '
+                             f'got {scores.shape}')
+        scores.sort_indices()
+        encoded = [str(p_id).encode('utf-8') for p_id in proteins]
+        ends = np.cumsum([len(x) for x in encoded], dtype=np.int64)
+        self._write('proteins.bytes',
+                    np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        self._write('proteins.offsets', ends + self.string_offset)
+        if len(ends):
+            self.string_offset += int(ends[-1])
+        self._write('indptr', scores.indptr[1:].astype(np.int64) + self.nnz)
+        self._write('indices', scores.indices.astype(np.int32))
+        self._write('data', scores.data.astype(np.float16))
+        self.nnz += scores.nnz
+        self.num_rows += len(proteins)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = dict()
+        meta = {
+            'num_rows': self.num_rows,
+            'num_terms': len(self.terms),
+            'nnz': self.nnz,
+            'top_k': self.top_k,
+            'min_score': self.min_score
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PredictionReader(object):
+    """Memory-mapped view of a predictions directory.
+
+    ``reader[i]`` returns the term indices and float32 scores of the i-th
+    protein, ``reader.to_score_matrix()`` loads everything.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.proteins = StrColumn(path, 'proteins')
+        self.terms = np.asarray(StrColumn(path, 'terms').tolist(),
+                                dtype=object)
+        self.indptr = self._memmap('indptr', np.int64)
+        self.indices = self._memmap('indices', np.int32)
+        self.data = self._memmap('data', np.float16)
+
+    def _memmap(self, name, dtype):
+        filename = os.path.join(self.path, name)
+        if os.path.getsize(filename) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return self.meta['num_rows']
+
+    def __getitem__(self, idx):
+        row = slice(self.indptr[idx], self.indptr[idx + 1])
+        return (np.asarray(self.indices[row]),
+                np.asarray(self.data[row], dtype=np.float32))
+
+    def iter_rows(self):
+        """Yield ``(protein, term ids, scores)`` for every protein."""
+        for i in range(len(self)):
+            indices, scores = self[i]
+            yield self.proteins[i], self.terms[indices], scores
+
+    def iter_blocks(self, block_size=100000):
+        """Yield ``ScoreMatrix`` blocks of ``block_size`` proteins."""
+        for start in range(0, len(self), block_size):
+            end = min(start + block_size, len(self))
+            lo, hi = self.indptr[start], self.indptr[end]
+            scores = sp.csr_matrix(
+                (np.array(self.data[lo:hi], dtype=np.float32),
+                 np.array(self.indices[lo:hi]),
+                 np.array(self.indptr[start:end + 1]) - lo),
+                shape=(end - start, len(self.terms)))
+            proteins = [self.proteins[i] for i in range(start, end)]
+            yield ScoreMatrix(proteins, self.terms, scores)
+
+    def to_csr(self):
+        # copies, the memory maps are read-only
+        return sp.csr_matrix(
+            (np.array(self.data, dtype=np.float32), np.array(self.indices),
+             np.array(self.indptr)),
+            shape=(len(self), len(self.terms)))
+
+    def to_score_matrix(self):
+        return ScoreMatrix(self.proteins.tolist(), self.terms, self.to_csr())
+
+
+def is_predictions(path):
+    return os.path.isdir(path) and os.path.exists(
+        os.path.join(path, 'indptr'))
+
+
+def save_predictions(path,
+                     proteins,
+                     terms,
+                     preds,
+                     top_k=DEFAULT_TOP_K,
+                     min_score=DEFAULT_MIN_SCORE,
+                     block_size=10000):
+    """Write dense ``(num_proteins, num_terms)`` scores as a predictions
+    directory, ``block_size`` proteins at a time."""
+    proteins = list(proteins)
+    with PredictionWriter(path, terms, top_k, min_score) as writer:
+        for start in range(0, len(proteins), block_size):
+            end = start + block_size
+            writer.append(proteins[start:end], preds[start:end])
+
+
+def load_model_preds(test_df, terms, predictions_path):
+    """CSR scores of the proteins of ``test_df`` over ``terms``, read from
+    the predictions directory of an inference tool."""
+    matrix = PredictionReader(predictions_path).to_score_matrix()
+    return matrix.align(test_df['proteins'].values, terms).scores
+
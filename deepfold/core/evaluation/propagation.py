@@ -0,0 +1,125 @@
+"""True-path rule for predicted scores.
+
+A protein annotated with a term is annotated with all of its ancestors, so
+the score of an ancestor is the max over its descendants. Instead of the
+union of ``get_ancestors`` of every predicted term at every threshold,
+``TruePathPropagator`` propagates the score matrix once: the columns are
+extended with the missing ancestors and ``LabelHierarchy`` raises every
+parent to the max of its children, level by level from the leaves and for
+all proteins at once. A term then passes a threshold iff one of its
+descendants does, so thresholding the propagated matrix is equivalent.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from deepfold.models.layers.hierarchy import LabelHierarchy
+
+
+class TruePathPropagator(object):
+    """Max-over-descendants propagation of ``(proteins, terms)`` scores.
+
+    Args:
+        ontology: ``Ontology`` defining the ancestors.
+        terms: term id of every input column.
+        chunk_size: rows propagated at a time (as a dense block).
+
+    Attributes:
+        terms: term id of every output column: the input ``terms`` in the
+            same order, then their ancestors missing from ``terms``.
+    """
+    def __init__(self, ontology, terms, chunk_size=1024):
+        self.chunk_size = chunk_size
+        terms = np.asarray(terms, dtype=object)
+        self.num_inputs = len(terms)
+        onto_terms, onto_index = ontology.get_term_index()
+        rows = np.array([onto_index.get(t_id, -1) for t_id in terms],
+                        dtype=np.int64)
+        ancestors = ontology.ancestor_matrix()[rows[rows >= 0]]
+        ancestors = np.unique(ancestors.indices)
+        extra = np.setdiff1d(ancestors, rows[rows >= 0])
+        self.terms = np.concatenate([terms, onto_terms[extra]])
+        self.term_index = dict(
+            (t_id, i) for i, t_id in enumerate(self.terms))
+
+        # direct parents are enough: the columns are closed under ancestors
+        edges = [(i, self.term_index[p_id])
+                 for i, t_id in enumerate(self.terms) if t_id in onto_index
+                 for p_id in ontology.get_parents(t_id)
+                 if p_id in self.term_index]
+        self.hierarchy = LabelHierarchy(edges, len(self.terms))
+
+    def columns(self, term_ids):
+        """Output columns of the terms in ``term_ids``, in column order."""
+        return np.flatnonzero(
+            np.fromiter((t_id in term_ids for t_id in self.terms),
+                        dtype=bool,
+                        count=len(self.terms)))
+
+    def __call__(self, scores):
+        """Propagated scores over ``self.terms``.
+
+        Args:
+            scores: dense array or sparse matrix of shape
+                ``(num_proteins, len(terms))``.
+
+        Returns:
+            a dense float32 array for dense input, CSR otherwise.
+        """
+        is_sparse = sp.issparse(scores)
+        if is_sparse:
+            scores = sp.csr_matrix(scores)
+        else:
+            scores = np.asarray(scores, dtype=np.float32)
+        blocks = []
+        for start in range(0, scores.shape[0], self.chunk_size):
+            chunk = scores[start:start + self.chunk_size]
+            dense = np.zeros((chunk.shape[0], len(self.terms)),
+                             dtype=np.float32)
+            dense[:, :self.num_inputs] = (chunk.toarray()
+                                          if is_sparse else chunk)
+            dense = self.hierarchy.propagate(dense, mode='max')
+            blocks.append(sp.csr_matrix(dense) if is_sparse else dense)
+        if is_sparse:
+            if not blocks:
+                return sp.csr_matrix((0, len(self.terms)), dtype=np.float32)
+            return sp.vstack(blocks, format='csr')
+        if not blocks:
+            return np.zeros((0, len(self.terms)), dtype=np.float32)
+        return np.concatenate(blocks)
+
+
+def annotation_sets(scores, terms, threshold, inclusive=False):
+    """Term sets of every row of a CSR score matrix above ``threshold``
+    (``>=`` with ``inclusive``)."""
+    terms = np.asarray(terms, dtype=object)
+    keep = (scores.data >= threshold) if inclusive else (scores.data >
+                                                           threshold)
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    counts = np.bincount(rows[keep], minlength=scores.shape[0])
+    selected = np.split(terms[scores.indices[keep]], np.cumsum(counts)[:-1])
+    return [set(row) for row in selected]
+
+
+def dicts_to_csr(predictions, terms=None):
+    """CSR matrix of a list of ``{term: score}`` dicts.
+
+    Returns:
+        terms (given, or in order of first appearance), CSR scores; terms
+        missing from ``terms`` are dropped.
+    """
+    if terms is None:
+        terms = list(
+            dict.fromkeys(t_id for annots in predictions for t_id in annots))
+    terms = np.asarray(terms, dtype=object)
+    term_index = dict((t_id, i) for i, t_id in enumerate(terms))
+    rows, cols, data = [], [], []
+    for i, annots in enumerate(predictions):
+        for t_id, score in annots.items():
+            if t_id in term_index:
+                rows.append(i)
+                cols.append(term_index[t_id])
+                data.append(score)
+    scores = sp.csr_matrix(
+        (np.asarray(data, dtype=np.float32), (rows, cols)),
+        shape=(len(predictions), len(terms)))
+    return terms, scores
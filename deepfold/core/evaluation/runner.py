@@ -0,0 +1,292 @@
+"""Namespace-partitioned evaluation of GO predictions.
+
+Truth and predictions are CSR matrices over one integer term index. The
+namespace of every column is looked up once into boolean masks, and a
+namespace is evaluated on the column slice of its mask instead of
+refiltering every label set. The (model, namespace) tasks run in a process
+pool; the matrices are saved once as ``.npy`` files that the workers open
+with ``mmap_mode='r'``, so they share the pages instead of each unpickling
+a copy.
+
+Every task computes the protein-centric precision, recall, remaining
+uncertainty and misinformation of ``evaluate_annotations`` at all
+thresholds in one pass over the stored scores, and the results of all tasks
+are gathered in one table.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
+from deepfold.data.utils.information_content import annotation_matrix
+
+logger = logging.getLogger(__name__)
+
+THRESHOLDS = np.arange(0, 101, 10) / 100.0
+# np.trapz was renamed in numpy 2.0 and removed later
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+RESULT_COLUMNS = [
+    'model', 'namespace', 'proteins', 'fmax', 'threshold', 'precision',
+    'recall', 'smin', 'aupr'
+]
+
+# state of the evaluation workers, set by init_worker
+_labels = None
+_predictions = None
+_masks = None
+_ic = None
+_thresholds = None
+_inclusive = None
+
+
+def namespace_masks(ontology, terms, onts=('bp', 'mf', 'cc')):
+    """``{ont: boolean vector over terms}``, the namespace roots and terms
+    missing from the ontology excluded."""
+    namespaces = np.array(
+        [ontology.ont[t_id]['namespace'] if t_id in ontology.ont else ''
+         for t_id in terms],
+        dtype=object)
+    terms = np.asarray(terms, dtype=object)
+    return dict((ont, (namespaces == NAMESPACES[ont]) &
+                 (terms != FUNC_DICT[ont])) for ont in onts)
+
+
+def ic_weights(ontology, terms):
+    """Information content of every term, 0 when unknown (``get_ic``)."""
+    if ontology.ic_vector is None:
+        return np.array([ontology.get_ic(t_id) for t_id in terms],
+                        dtype=np.float64)
+    rows = np.array([ontology.ic_index.get(t_id, -1) for t_id in terms],
+                    dtype=np.int64)
+    ic = np.zeros(len(terms), dtype=np.float64)
+    ic[rows >= 0] = ontology.ic_vector[rows[rows >= 0]]
+    return ic
+
+
+def reindex(scores, terms, term_index):
+    """Move the columns of ``scores`` (over ``terms``) to ``term_index``;
+    terms missing from the index are dropped."""
+    scores = sp.csr_matrix(scores)
+    columns = np.array([term_index.get(t_id, -1) for t_id in terms],
+                       dtype=np.int64)
+    scores = scores[:, np.flatnonzero(columns >= 0)].tocoo()
+    return sp.csr_matrix(
+        (scores.data, (scores.row, columns[columns >= 0][scores.col])),
+        shape=(scores.shape[0], len(term_index)))
+
+
+def save_matrix(path, name, matrix):
+    matrix = sp.csr_matrix(matrix)
+    for part in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(path, '%s.%s.npy' % (name, part)),
+                getattr(matrix, part))
+
+
+def load_matrix(path, name, num_columns):
+    """CSR matrix saved by ``save_matrix``, memory-mapped read-only."""
+    data, indices, indptr = [
+        np.load(os.path.join(path, '%s.%s.npy' % (name, part)),
+                mmap_mode='r') for part in ('data', 'indices', 'indptr')
+    ]
+    return sp.csr_matrix((data, indices, indptr),
+                         shape=(len(indptr) - 1, num_columns),
+                         copy=False)
+
+
+def _sums_above(matrix, thresholds, weights, inclusive):
+    """Per row and threshold, number and summed ``weights`` of the entries
+    above the threshold (``>=`` with ``inclusive``)."""
+    side = 'right' if inclusive else 'left'
+    # compare in the precision of the scores, like ``scores.data > t``
+    bins = np.searchsorted(thresholds.astype(matrix.data.dtype),
+                           matrix.data,
+                           side=side) - 1
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    keep = bins >= 0
+    shape = (matrix.shape[0], len(thresholds))
+    counts = np.zeros(shape, dtype=np.int64)
+    sums = np.zeros(shape, dtype=np.float64)
+    np.add.at(counts, (rows[keep], bins[keep]), 1)
+    np.add.at(sums, (rows[keep], bins[keep]), weights[matrix.indices[keep]])
+    # entries of bin k pass thresholds 0..k
+    counts = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    sums = np.cumsum(sums[:, ::-1], axis=1)[:, ::-1]
+    return counts, sums
+
+
+def evaluate_scores(labels, scores, ic, thresholds=THRESHOLDS,
+                    inclusive=False):
+    """Metrics of ``evaluate_annotations`` at every threshold.
+
+    Args:
+        labels: ``(proteins, terms)`` sparse binary true annotations.
+        scores: ``(proteins, terms)`` CSR scores; a term is predicted when
+            its score is ``> threshold`` (``>=`` with ``inclusive``).
+        ic: information content of every term.
+
+    Returns:
+        dict of per threshold arrays (fscore, precision, recall, ru, mi, s)
+        and the number of proteins with labels.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    labels = sp.csr_matrix(labels)
+    annotated = np.flatnonzero(np.diff(labels.indptr) > 0)
+    labels = labels[annotated]
+    scores = sp.csr_matrix(scores)[annotated]
+
+    num_columns = labels.shape[1]
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    label_rows = np.repeat(np.arange(labels.shape[0]), np.diff(labels.indptr))
+    hit = np.isin(rows * num_columns + scores.indices,
+                  label_rows * num_columns + labels.indices)
+    true_pos = sp.csr_matrix(
+        (scores.data[hit], (rows[hit], scores.indices[hit])),
+        shape=scores.shape)
+
+    num_pred, ic_pred = _sums_above(scores, thresholds, ic, inclusive)
+    num_tp, ic_tp = _sums_above(true_pos, thresholds, ic, inclusive)
+    num_true = np.diff(labels.indptr)[:, None]
+    ic_true = np.asarray(
+        np.add.reduceat(ic[labels.indices], labels.indptr[:-1])
+        if labels.nnz else np.zeros(0))[:, None]
+
+    total = max(len(annotated), 1)
+    recalls = (num_tp / np.maximum(num_true, 1)).sum(axis=0) / total
+    predicted = num_pred > 0
+    precisions = ((num_tp / np.maximum(num_pred, 1)).sum(axis=0) /
+                  np.maximum(predicted.sum(axis=0), 1))
+    mi = (ic_pred - ic_tp).sum(axis=0) / total
+    ru = (ic_true - ic_tp).sum(axis=0) / total
+    denominator = precisions + recalls
+    fscores = np.where(denominator > 0,
+                       2 * precisions * recalls / np.maximum(denominator,
+                                                             1e-12), 0.0)
+    return {
+        'proteins': len(annotated),
+        'fscore': fscores,
+        'precision': precisions,
+        'recall': recalls,
+        'ru': ru,
+        'mi': mi,
+        's': np.sqrt(ru * ru + mi * mi)
+    }
+
+
+def summarize(metrics, thresholds=THRESHOLDS):
+    """Fmax (first best threshold), Smin and AUPR of ``evaluate_scores``.
+
+    Returns:
+        summary dict, precisions and recalls sorted by recall
+    """
+    best = int(np.argmax(metrics['fscore']))
+    sorted_index = np.argsort(metrics['recall'])
+    recalls = metrics['recall'][sorted_index]
+    precisions = metrics['precision'][sorted_index]
+    summary = {
+        'proteins': metrics['proteins'],
+        'fmax': float(metrics['fscore'][best]),
+        'threshold': float(thresholds[best]),
+        'precision': float(metrics['precision'][best]),
+        'recall': float(metrics['recall'][best]),
+        'smin': float(metrics['s'].min()),
+        'aupr': float(_trapezoid(precisions, recalls))
+    }
+    return summary, precisions, recalls
+
+
+def init_worker(input_dir, models, num_columns, masks, ic, thresholds,
+                inclusive):
+    global _labels, _predictions, _masks, _ic, _thresholds, _inclusive
+    _labels = load_matrix(input_dir, 'labels', num_columns)
+    _predictions = dict(
+        (model, load_matrix(input_dir, 'model%d' % i, num_columns))
+        for i, model in enumerate(models))
+    _masks = masks
+    _ic = ic
+    _thresholds = thresholds
+    _inclusive = inclusive
+
+
+def evaluate_task(args):
+    model, ont = args
+    columns = np.flatnonzero(_masks[ont])
+    inclusive = (_inclusive[model]
+                 if isinstance(_inclusive, dict) else _inclusive)
+    metrics = evaluate_scores(_labels[:, columns],
+                              _predictions[model][:, columns],
+                              _ic[columns],
+                              thresholds=_thresholds,
+                              inclusive=inclusive)
+    summary, precisions, recalls = summarize(metrics, _thresholds)
+    summary.update(model=model, namespace=ont)
+    return summary, precisions, recalls
+
+
+def evaluate_all(ontology,
+                 annotations,
+                 predictions,
+                 onts=('bp', 'mf', 'cc'),
+                 thresholds=THRESHOLDS,
+                 inclusive=False,
+                 num_workers=None,
+                 work_dir=None):
+    """Evaluate every model on every namespace.
+
+    Args:
+        ontology: ``Ontology`` with the information content calculated.
+        annotations: true (propagated) annotation set of every protein.
+        predictions: ``{model: (terms, scores)}``, propagated CSR scores
+            with one row per protein of ``annotations``.
+        inclusive: ``>=`` instead of ``>`` thresholds, for all models or as
+            ``{model: bool}``.
+        num_workers: pool size; 0 evaluates in this process.
+        work_dir: where the memory-mapped inputs are written (default: the
+            system temp dir).
+
+    Returns:
+        a DataFrame with one row per (model, namespace), and
+        ``{(model, namespace): (precisions, recalls)}`` sorted by recall.
+    """
+    # one term index over the predicted and the true terms
+    terms = list(
+        dict.fromkeys(
+            itertools.chain(*[model_terms
+                              for model_terms, _ in predictions.values()],
+                            *annotations)))
+    term_index = dict((t_id, i) for i, t_id in enumerate(terms))
+    labels, _, _ = annotation_matrix(annotations, term_index)
+    masks = namespace_masks(ontology, terms, onts)
+    ic = ic_weights(ontology, terms)
+
+    models = list(predictions)
+    tasks = [(model, ont) for model in models for ont in onts]
+    with tempfile.TemporaryDirectory(dir=work_dir) as input_dir:
+        save_matrix(input_dir, 'labels', labels)
+        for i, model in enumerate(models):
+            model_terms, scores = predictions[model]
+            save_matrix(input_dir, 'model%d' % i,
+                        reindex(scores, model_terms, term_index))
+        initargs = (input_dir, models, len(terms), masks, ic,
+                    np.asarray(thresholds, dtype=np.float64), inclusive)
+        if num_workers == 0:
+            init_worker(*initargs)
+            outputs = [evaluate_task(task) for task in tasks]
+        else:
+            with multiprocessing.Pool(num_workers,
+                                      initializer=init_worker,
+                                      initargs=initargs) as pool:
+                outputs = pool.map(evaluate_task, tasks)
+
+    results = pd.DataFrame([summary for summary, _, _ in outputs],
+                           columns=RESULT_COLUMNS)
+    curves = dict(((summary['model'], summary['namespace']),
+                   (precisions, recalls))
+                  for summary, precisions, recalls in outputs)
+    logger.info('\n' + results.to_string(index=False, float_format='%0.3f'))
+    return results, curves
@@ -7,6 +7,8 @@ from sklearn.metrics import (auc, average_precision_score, matthews_corrcoef,
                              roc_curve)
 from sklearn.utils import resample
 
+from deepfold.data.utils.information_content import sum_ic
+
 
 # functions for evaluation
 def compute_roc(labels, preds):
@@ -289,10 +291,6 @@ def evaluate_annotations(go, real_annots, pred_annots):
         tp = set(real_annots[i]).intersection(set(pred_annots[i]))
         fp = pred_annots[i] - tp
         fn = real_annots[i] - tp
-        for go_id in fp:
-            mi += go.get_ic(go_id)
-        for go_id in fn:
-            ru += go.get_ic(go_id)
         fps.append(fp)
         fns.append(fn)
         tpn = len(tp)
@@ -305,6 +303,14 @@ def evaluate_annotations(go, real_annots, pred_annots):
             p_total += 1
             precision = tpn / (1.0 * (tpn + fpn))
             p += precision
+    # remaining uncertainty / misinformation as sparse dot products with the
+    # IC vector
+    if getattr(go, 'ic_vector', None) is not None:
+        mi = float(sum_ic(go, fps).sum())
+        ru = float(sum_ic(go, fns).sum())
+    else:
+        mi = sum(go.get_ic(go_id) for fp in fps for go_id in fp)
+        ru = sum(go.get_ic(go_id) for fn in fns for go_id in fn)
     ru /= total
     mi /= total
     r /= total
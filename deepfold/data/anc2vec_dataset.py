@@ -1,5 +1,6 @@
 import os
 
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
@@ -21,6 +22,10 @@ class GoVocab(object):
     def __len__(self):
         return len(self.terms)
 
+    @property
+    def idx_to_token(self):
+        return self.terms
+
     def to_tokens(self, indices):
         if hasattr(indices, '__len__') and len(indices) > 1:
             return [self.index2term[int(index)] for index in indices]
@@ -64,7 +69,8 @@ class OntoDataset(Dataset):
             'cellular_component': 1,
             'molecular_function': 2
         }
-        self.data = self.build_dataset()
+        self.term_ids, self.ancestor_ids, self.namespace_ids = \
+            self.build_dataset()
 
         # save data
         data_fin = os.path.join(data_dir, 'ds.txt')
@@ -74,10 +80,33 @@ class OntoDataset(Dataset):
             self.save_processed_data(data_fin)
 
     def __len__(self):
-        return len(self.data)
+        return len(self.term_ids)
 
     def __getitem__(self, idx):
-        return self.data[idx]
+        return (int(self.term_ids[idx]), int(self.ancestor_ids[idx]),
+                int(self.namespace_ids[idx]))
+
+    def iter_batches(self, batch_size, shuffle=True, drop_last=False,
+                     seed=None):
+        """Yield batches as the dicts of ``collate_fn``, sliced straight from
+        the index arrays (no per-example Python objects)."""
+        num_examples = len(self)
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(num_examples)
+        else:
+            order = np.arange(num_examples)
+        for start in range(0, num_examples, batch_size):
+            idx = order[start:start + batch_size]
+            if drop_last and len(idx) < batch_size:
+                break
+            yield {
+                'term_ids':
+                torch.from_numpy(self.term_ids[idx].astype(np.int64)),
+                'neighbor_ids':
+                torch.from_numpy(self.ancestor_ids[idx].astype(np.int64)),
+                'labels':
+                torch.from_numpy(self.namespace_ids[idx].astype(np.int64))
+            }
 
     def collate_fn(self, examples):
         term_ids = torch.tensor([ex[0] for ex in examples])
@@ -94,8 +123,7 @@ class OntoDataset(Dataset):
     # def getitem(self, idx):
     #     term = self.all_terms[idx]
     #     namespace = self.ont[term]['namespace']
-    #     ancestors = self.ontparser.get_ancestors(term)
-    #     ancestors = sorted(set([term for anc in ancestors for term in anc]))
+    #     ancestors = sorted(self.ontparser.get_ancestors(term))
 
     #     term_id = self.vocab.to_ids(term)
     #     neighbors_id = self.vocab.to_ids(ancestors)
@@ -120,24 +148,32 @@ class OntoDataset(Dataset):
     #     return encoded_inputs
 
     def build_dataset(self):
-        """Create a train dataset from obo file."""
-        data = []
+        """Create a train dataset from obo file.
+
+        Returns three aligned int32 arrays holding one (term, ancestor,
+        namespace) triple per row.
+        """
+        term_ids = []
+        ancestor_ids = []
+        namespace_ids = []
         # loop over GO terms
         for t in self.all_terms:
             # skip roots
             if t in self.root_terms:
                 continue
             namespace = self.ont[t]['namespace']
-            ancestors = self.ontparser.get_ancestors(t)
-            ancestors = list(set([term for anc in ancestors for term in anc]))
+            ancestors = list(self.ontparser.get_ancestors(t))
 
             term_id = self.vocab.to_ids(t)
-            ancestor_ids = self.vocab.to_ids(ancestors)
-            namespace_id = self.name2code[namespace]
-
-            data.extend([(term_id, ancestor_id, namespace_id)
-                         for ancestor_id in ancestor_ids])
-        return data
+            ancestor_ids.append(
+                np.array(self.vocab.to_ids(ancestors), dtype=np.int32))
+            term_ids.append(np.full(len(ancestors), term_id, dtype=np.int32))
+            namespace_ids.append(
+                np.full(len(ancestors),
+                        self.name2code[namespace],
+                        dtype=np.int32))
+        return (np.concatenate(term_ids), np.concatenate(ancestor_ids),
+                np.concatenate(namespace_ids))
 
     def save_processed_data(self, data_fin):
         # create dataset
@@ -148,9 +184,7 @@ class OntoDataset(Dataset):
                 if t in self.root_terms:
                     continue
                 namespace = self.ont[t]['namespace']
-                ancestors = self.ontparser.get_ancestors(t)
-                ancestors = list(
-                    set([term for anc in ancestors for term in anc]))
+                ancestors = list(self.ontparser.get_ancestors(t))
 
                 datapoint = '{}\t{}\t{}\n'.format(t,
                                                   ','.join(sorted(ancestors)),
@@ -0,0 +1,97 @@
+"""ESM alphabets without loading the ESM weights.
+
+``esm.pretrained.load_model_and_alphabet`` reads the whole checkpoint only
+to get the alphabet. The alphabet is fully determined by the architecture,
+so ``get_alphabet`` builds it with ``esm.Alphabet.from_architecture`` (once
+per process), and ``BatchTokenizer`` encodes a whole batch of sequences
+with a byte lookup table instead of tokenizing residue by residue.
+"""
+import functools
+
+import esm
+import numpy as np
+import torch
+
+
+def get_architecture(model_dir):
+    """Alphabet architecture of a pretrained ESM model name."""
+    name = model_dir.split('/')[-1]
+    if name.startswith('esm_msa'):
+        return 'MSA Transformer'
+    if name.startswith(('esm1b', 'esm1v', 'esm2')):
+        return 'ESM-1b'
+    if name.startswith('esm1'):
+        return 'ESM-1'
+    raise ValueError(f'Unknown ESM model: {model_dir}')
+
+
+@functools.lru_cache(maxsize=None)
+def get_alphabet(model_dir):
+    """``esm.Alphabet`` of ``model_dir``, built without the checkpoint."""
+    return esm.Alphabet.from_architecture(get_architecture(model_dir))
+
+
+class BatchTokenizer(object):
+    """Vectorized drop-in for ``alphabet.get_batch_converter()``.
+
+    Called with a list of ``(label, sequence)`` pairs, returns
+    ``(labels, strs, tokens)`` like the ESM ``BatchConverter``: ``tokens`` is
+    an int64 ``(batch, longest + bos + eos)`` tensor filled with padding.
+    Residues missing from the alphabet map to ``<unk>`` and whitespace is
+    dropped, as ``alphabet.encode`` does; sequences spelling special tokens
+    (``<mask>``...) go through ``alphabet.encode``.
+    """
+    def __init__(self, alphabet, truncation_seq_length=None):
+        if alphabet.use_msa:
+            raise ValueError('Use alphabet.get_batch_converter() for MSAs')
+        self.alphabet = alphabet
+        self.truncation_seq_length = truncation_seq_length
+        self.lut = np.full(256, alphabet.unk_idx, dtype=np.int64)
+        for tok, idx in alphabet.tok_to_idx.items():
+            if len(tok) == 1:
+                self.lut[ord(tok)] = idx
+        # -1 marks whitespace, removed before the lookup results are split
+        for byte in range(256):
+            if chr(byte).isspace():
+                self.lut[byte] = -1
+
+    def encode(self, sequences):
+        """Token ids of every sequence as a list of int64 arrays."""
+        data = ''.join(sequences).encode('latin-1', 'replace')
+        ids = self.lut[np.frombuffer(data, dtype=np.uint8)]
+        rows = np.repeat(np.arange(len(sequences)),
+                         [len(seq) for seq in sequences])
+        keep = ids >= 0
+        ids = ids[keep]
+        ends = np.cumsum(np.bincount(rows[keep], minlength=len(sequences)))
+        encoded = np.split(ids, ends[:-1]) if len(sequences) else []
+        for i, seq in enumerate(sequences):
+            if '<' in seq:
+                encoded[i] = np.asarray(self.alphabet.encode(seq),
+                                        dtype=np.int64)
+        if self.truncation_seq_length is not None:
+            encoded = [ids[:self.truncation_seq_length] for ids in encoded]
+        return encoded
+
+    def __call__(self, raw_batch):
+        labels = [label for label, _ in raw_batch]
+        strs = [seq for _, seq in raw_batch]
+        encoded = self.encode(strs)
+        lengths = np.asarray([len(ids) for ids in encoded], dtype=np.int64)
+        bos = int(self.alphabet.prepend_bos)
+        eos = int(self.alphabet.append_eos)
+        max_len = int(lengths.max()) if len(lengths) else 0
+        tokens = np.full((len(encoded), max_len + bos + eos),
+                         self.alphabet.padding_idx,
+                         dtype=np.int64)
+        if bos:
+            tokens[:, 0] = self.alphabet.cls_idx
+        if len(encoded):
+            rows = np.repeat(np.arange(len(encoded)), lengths)
+            cols = np.arange(lengths.sum()) - np.repeat(
+                np.cumsum(lengths) - lengths, lengths) + bos
+            tokens[rows, cols] = np.concatenate(encoded)
+        if eos:
+            tokens[np.arange(len(encoded)),
+                   lengths + bos] = self.alphabet.eos_idx
+        return labels, strs, torch.from_numpy(tokens)
@@ -1,14 +1,15 @@
-import gc
 import os
 import random
 from typing import Dict
 
-import esm
 import numpy as np
 import pandas as pd
 import torch
 from torch.utils.data import Dataset
 
+from deepfold.data.esm_alphabet import BatchTokenizer, get_alphabet
+from deepfold.data.utils.columnar import (load_annotated_sequences,
+                                          load_columns)
 from deepfold.utils.constant import DEFAULT_ESM_MODEL, ESM_LIST
 
 
@@ -17,12 +18,10 @@ class EmbeddingDataset(Dataset):
                  data_path: str = 'dataset/',
                  file_name: str = 'xxx.pkl'):
         self.file_path = os.path.join(data_path, file_name)
-        self.data_df = self.load_dataset(self.file_path)
-        self.embeddings = list(self.data_df['esm_embeddings'])
-        self.labels = list(self.data_df['labels'])
+        self.embeddings, self.labels = self.load_dataset(self.file_path)
 
     def __len__(self):
-        return len(self.data_df)
+        return len(self.labels)
 
     def __getitem__(self, idx):
         embedding = self.embeddings[idx]
@@ -33,8 +32,7 @@ class EmbeddingDataset(Dataset):
         return encoded_inputs
 
     def load_dataset(self, data_path):
-        df = pd.read_pickle(data_path)
-        return df
+        return load_columns(data_path, ['esm_embeddings', 'labels'])
 
 
 class EsmDataset(Dataset):
@@ -69,10 +67,12 @@ class EsmDataset(Dataset):
 
         self.is_msa = 'msa' in model_dir
 
-        esm_model, self.alphabet = esm.pretrained.load_model_and_alphabet(
-            model_dir)
-        self.batch_converter = self.alphabet.get_batch_converter()
-        self.free_memory(esm_model)
+        # only the vocabulary is needed here, not the model weights
+        self.alphabet = get_alphabet(model_dir)
+        if self.is_msa:
+            self.batch_converter = self.alphabet.get_batch_converter()
+        else:
+            self.batch_converter = BatchTokenizer(self.alphabet)
 
     @property
     def vocab_size(self) -> int:
@@ -109,11 +109,6 @@ class EsmDataset(Dataset):
         """Returns a function which maps tokens to IDs."""
         return lambda x: self.alphabet.tok_to_idx[x]
 
-    def free_memory(self, esm_model):
-        del esm_model
-        gc.collect()
-        print('Delete the esm model, free memory!')
-
     def __len__(self):
         return len(self.labels)
 
@@ -134,15 +129,12 @@ class EsmDataset(Dataset):
         return sequence, length, multilabel
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['terms'].values.flatten()
 
-        seq = list(df['sequences'])
-        try:
-            label = list(df['prop_annotations'])
-        except:
-            label = list(df['annotations'])
+        # older ESM data files only have the unpropagated annotations
+        seq, label = load_annotated_sequences(
+            data_path, label_columns=('prop_annotations', 'annotations'))
         assert len(seq) == len(label)
         return seq, label, terms
 
@@ -1,10 +1,11 @@
 import os
 
 import numpy as np
-import pandas as pd
 import torch
 from torch.utils.data import Dataset
 
+from deepfold.data.utils.columnar import load_columns
+
 
 class GCNDataset(Dataset):
     """ESMDataset."""
@@ -37,8 +38,7 @@ class GCNDataset(Dataset):
         return encoded_inputs
 
     def load_dataset(self, data_path):
-        df = pd.read_pickle(data_path)
-        embeddings = list(df['esm_embeddings'])
-        label = list(df['annotations'])
+        embeddings, label = load_columns(data_path,
+                                         ['esm_embeddings', 'annotations'])
         assert len(embeddings) == len(label)
         return embeddings, label
@@ -5,6 +5,8 @@ import pandas as pd
 import torch
 from torch.utils.data import Dataset
 
+from deepfold.data.utils.columnar import load_columns
+
 NAMESPACES = {
     'cco': 'cellular_component',
     'mfo': 'molecular_function',
@@ -52,15 +54,14 @@ class MultiModalDataset(Dataset):
         return encoded_inputs
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['term'][terms_df['namespace'] ==
                                  self.namespace].values.flatten()
         text_embeddings = terms_df['embeddings'][terms_df['namespace'] ==
                                                  self.namespace].tolist()
 
-        embeddings = list(df['esm_embeddings'])
-        label = list(df['prop_annotations'])
+        embeddings, label = load_columns(
+            data_path, ['esm_embeddings', 'prop_annotations'])
         assert len(embeddings) == len(label)
         assert len(text_embeddings) == len(terms)
         return embeddings, label, terms, text_embeddings
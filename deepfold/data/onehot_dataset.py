@@ -4,6 +4,7 @@ import torch
 from torch.utils.data import Dataset
 
 from .aminoacids import MAXLEN, AminoacidsVocab
+from .utils.columnar import load_dataframe
 
 
 # ------------------------------------------------------------------------------------------
@@ -94,7 +95,8 @@ class OneHotSequences(Dataset):
         return data_index, labels
 
     def load_data(self, data_file, terms_file):
-        data_df = pd.read_pickle(data_file)
+        data_df = load_dataframe(data_file,
+                                 columns=['sequences', 'prop_annotations'])
         terms_df = pd.read_pickle(terms_file)
         terms = terms_df['terms'].values.flatten()
         return data_df, terms
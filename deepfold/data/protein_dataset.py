@@ -10,6 +10,7 @@ from torch.utils.data import Dataset
 from transformers import AutoTokenizer, RobertaTokenizer
 
 from deepfold.data.protein_tokenizer import ProteinTokenizer
+from deepfold.data.utils.columnar import load_annotated_sequences
 
 sys.path.append('../../')
 
@@ -67,12 +68,10 @@ class ProtRobertaDataset(Dataset):
         return sample
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['terms'].values.flatten()
 
-        seq = list(df['sequences'])
-        label = list(df['prop_annotations'])
+        seq, label = load_annotated_sequences(data_path)
         assert len(seq) == len(label)
         return seq, label, terms
 
@@ -99,12 +98,10 @@ class ProtBertDataset(Dataset):
         self.label2id = {label: idx for idx, label in enumerate(self.terms)}
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['terms'].values.flatten()
 
-        seq = list(df['sequences'])
-        label = list(df['prop_annotations'])
+        seq, label = load_annotated_sequences(data_path)
         assert len(seq) == len(label)
         return seq, label, terms
 
@@ -202,12 +199,10 @@ class ProtSeqDataset(Dataset):
         return encoded_inputs
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['terms'].values.flatten()
 
-        prot_seqs = list(df['sequences'])
-        anno_terms = list(df['prop_annotations'])
+        prot_seqs, anno_terms = load_annotated_sequences(data_path)
         assert len(prot_seqs) == len(anno_terms)
         return prot_seqs, anno_terms, terms
 
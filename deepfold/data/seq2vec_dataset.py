@@ -7,6 +7,8 @@ import torch
 from allennlp.modules.elmo import batch_to_ids
 from torch.utils.data import Dataset
 
+from deepfold.data.utils.columnar import load_annotated_sequences
+
 
 class Seq2VecDataset(Dataset):
     """Seq2vec Dataset."""
@@ -50,12 +52,10 @@ class Seq2VecDataset(Dataset):
         return sequence, multilabel
 
     def load_dataset(self, data_path, term_path):
-        df = pd.read_pickle(data_path)
         terms_df = pd.read_pickle(term_path)
         terms = terms_df['terms'].values.flatten()
 
-        seq = list(df['sequences'])
-        label = list(df['prop_annotations'])
+        seq, label = load_annotated_sequences(data_path)
         assert len(seq) == len(label)
         return seq, label, terms
 
@@ -0,0 +1,422 @@
+"""Columnar, memory-mappable dataset format.
+
+A dataset is a directory with a ``meta.json`` and one raw little-endian
+binary file per buffer::
+
+    meta.json                  {"num_rows": N, "columns": {name: type}}
+    <name>.bytes, .offsets     'str': utf-8 bytes and int64 offsets (N + 1)
+    <name>.indices, .indptr    'str_list': CSR (int32 / int64) over a vocab
+    <name>.vocab.bytes, ...    'str_list': the vocab, stored as a 'str'
+    <name>.data                numeric types ('int64', 'float32', 'bool', ...),
+                               rows may be fixed-size vectors (embeddings)
+
+Buffers are written block by block while streaming and are read back with
+``np.memmap``, so opening a dataset costs nothing and forked DataLoader
+workers share the pages.
+"""
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+STR = 'str'
+STR_LIST = 'str_list'
+
+
+def _buffer_path(path, name, suffix):
+    return os.path.join(path, '%s.%s' % (name, suffix))
+
+
+def _memmap(filename, dtype):
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+
+def _row_index(idx, num_rows):
+    """``idx`` as a non-negative row index, like list indexing."""
+    if idx < 0:
+        idx += num_rows
+    if not 0 <= idx < num_rows:
+        raise IndexError('row index out of range')
+    return idx
+
+
+def write_strings(path, name, values):
+    """Write ``values`` as the buffers of a 'str' column."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    with open(_buffer_path(path, name, 'bytes'), 'wb') as f:
+        f.write(b''.join(encoded))
+    with open(_buffer_path(path, name, 'offsets'), 'wb') as f:
+        f.write(offsets.tobytes())
+
+
+class ColumnarWriter(object):
+    """Stream rows into a columnar dataset directory.
+
+    Args:
+        path: output directory, created if needed.
+        schema: ``{column: type}``, type is 'str', 'str_list' or a numpy
+            dtype name.
+        vocabs: optional ``{column: list of str}`` fixing the term index of
+            'str_list' columns; unknown values are then skipped. By default
+            the vocab grows in order of first appearance.
+
+    Example:
+        with ColumnarWriter(path, {'proteins': 'str'}) as writer:
+            writer.append({'proteins': ['P12345']})
+    """
+    def __init__(self, path, schema, vocabs=None):
+        self.path = path
+        self.schema = dict(schema)
+        self.num_rows = 0
+        self.shapes = dict()
+        os.makedirs(path, exist_ok=True)
+
+        self._files = dict()
+        self._offsets = dict()
+        self._vocabs = dict()
+        self._fixed_vocab = set()
+        for name, kind in self.schema.items():
+            if kind == STR:
+                self._open(name, 'bytes', 'offsets')
+                self._offsets[name] = 0
+                self._write(name, 'offsets', np.zeros(1, dtype=np.int64))
+            elif kind == STR_LIST:
+                self._open(name, 'indices', 'indptr')
+                self._offsets[name] = 0
+                self._write(name, 'indptr', np.zeros(1, dtype=np.int64))
+                vocab = (vocabs or {}).get(name)
+                if vocab is not None:
+                    self._fixed_vocab.add(name)
+                    vocab = list(vocab)
+                else:
+                    vocab = []
+                self._vocabs[name] = dict(
+                    (term, i) for i, term in enumerate(vocab))
+            else:
+                np.dtype(kind)
+                self._open(name, 'data')
+
+    def _open(self, name, *suffixes):
+        for suffix in suffixes:
+            self._files[(name, suffix)] = open(
+                _buffer_path(self.path, name, suffix), 'wb')
+
+    def _write(self, name, suffix, array):
+        self._files[(name, suffix)].write(
+            np.ascontiguousarray(array).tobytes())
+
+    def append(self, columns):
+        """Append a block of rows given as ``{column: list of values}``."""
+        lengths = set(len(columns[name]) for name in self.schema)
+        if len(lengths) != 1:
+            raise ValueError('All columns of a block must have the same '
+                             'number of rows, got %s' % sorted(lengths))
+        for name, kind in self.schema.items():
+            values = columns[name]
+            if kind == STR:
+                encoded = [value.encode('utf-8') for value in values]
+                ends = np.cumsum([len(x) for x in encoded], dtype=np.int64)
+                self._write(name, 'bytes',
+                            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+                self._write(name, 'offsets', ends + self._offsets[name])
+                if len(ends):
+                    self._offsets[name] += int(ends[-1])
+            elif kind == STR_LIST:
+                vocab = self._vocabs[name]
+                fixed = name in self._fixed_vocab
+                indices = []
+                ends = []
+                for row in values:
+                    for term in row:
+                        idx = vocab.get(term)
+                        if idx is None:
+                            if fixed:
+                                continue
+                            idx = vocab[term] = len(vocab)
+                        indices.append(idx)
+                    ends.append(len(indices))
+                self._write(name, 'indices',
+                            np.asarray(indices, dtype=np.int32))
+                self._write(name, 'indptr',
+                            np.asarray(ends, dtype=np.int64) +
+                            self._offsets[name])
+                self._offsets[name] += len(indices)
+            else:
+                values = np.asarray(values, dtype=kind)
+                shape = list(values.shape[1:])
+                if self.shapes.setdefault(name, shape) != shape:
+                    raise ValueError('Column %s has rows of shape %s, got %s' %
+                                     (name, self.shapes[name], shape))
+                self._write(name, 'data', values)
+        self.num_rows += lengths.pop()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = dict()
+        for name, vocab in self._vocabs.items():
+            write_strings(self.path, name + '.vocab',
+                          sorted(vocab, key=vocab.get))
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'num_rows': self.num_rows,
+            'columns': self.schema,
+            'shapes': self.shapes
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StrColumn(object):
+    """Lazy view of a 'str' column."""
+    def __init__(self, path, name):
+        self.data = _memmap(_buffer_path(path, name, 'bytes'), np.uint8)
+        self.offsets = _memmap(_buffer_path(path, name, 'offsets'), np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_bytes(self, idx):
+        idx = _row_index(idx, len(self))
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        return self.get_bytes(idx).tobytes().decode('utf-8')
+
+    def lengths(self):
+        """Length in bytes of every value (== residues for sequences)."""
+        return np.diff(self.offsets)
+
+    def tolist(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [
+            data[start:end].decode('utf-8')
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+
+class StrListColumn(object):
+    """Lazy view of a 'str_list' column stored as CSR over ``vocab``."""
+    def __init__(self, path, name):
+        self.indices = _memmap(_buffer_path(path, name, 'indices'), np.int32)
+        self.indptr = _memmap(_buffer_path(path, name, 'indptr'), np.int64)
+        self.vocab = StrColumn(path, name + '.vocab').tolist()
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def get_indices(self, idx):
+        idx = _row_index(idx, len(self))
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]]
+
+    def __getitem__(self, idx):
+        return [self.vocab[i] for i in self.get_indices(idx)]
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+    def to_csr(self, term_index=None):
+        """``scipy.sparse.csr_matrix`` of shape ``(num_rows, num_terms)``.
+
+        With ``term_index`` (``{term: column}``) the vocab is remapped onto
+        that index and terms outside of it are dropped.
+        """
+        indices = np.asarray(self.indices, dtype=np.int64)
+        indptr = np.asarray(self.indptr)
+        num_terms = len(self.vocab)
+        if term_index is not None:
+            remap = np.array([term_index.get(term, -1) for term in self.vocab],
+                             dtype=np.int64)
+            indices = remap[indices]
+            keep = indices >= 0
+            rows = np.repeat(np.arange(len(self)), np.diff(indptr))
+            counts = np.bincount(rows[keep], minlength=len(self))
+            indptr = np.concatenate([[0], np.cumsum(counts)])
+            indices = indices[keep]
+            num_terms = len(term_index)
+        data = np.ones(len(indices), dtype=np.float32)
+        return sp.csr_matrix((data, indices, indptr),
+                             shape=(len(self), num_terms))
+
+
+class ColumnarReader(object):
+    """Open a columnar dataset directory; columns are memory mapped lazily.
+
+    ``reader['sequences'][i]`` decodes a single value, ``reader[name]`` is a
+    ``StrColumn``, ``StrListColumn`` or a read-only numpy memmap.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_rows = meta['num_rows']
+        self.schema = meta['columns']
+        self.shapes = meta.get('shapes', {})
+        self._columns = dict()
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def columns(self):
+        return list(self.schema)
+
+    def __contains__(self, name):
+        return name in self.schema
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            kind = self.schema[name]
+            if kind == STR:
+                column = StrColumn(self.path, name)
+            elif kind == STR_LIST:
+                column = StrListColumn(self.path, name)
+            else:
+                column = _memmap(_buffer_path(self.path, name, 'data'),
+                                 np.dtype(kind))
+                column = column.reshape([-1] + self.shapes.get(name, []))
+            self._columns[name] = column
+        return self._columns[name]
+
+    def to_dataframe(self, columns=None):
+        """Materialize (some of) the columns as a pandas DataFrame."""
+        data = dict()
+        for name in columns or self.columns:
+            column = self[name]
+            if isinstance(column, np.ndarray):
+                column = np.asarray(column)
+                data[name] = list(column) if column.ndim > 1 else column
+            else:
+                data[name] = column.tolist()
+        return pd.DataFrame(data)
+
+
+def is_columnar(path):
+    return os.path.isdir(path) and os.path.exists(
+        os.path.join(path, 'meta.json'))
+
+
+def infer_schema(df):
+    """Column types of a DataFrame, from its first row.
+
+    Strings map to 'str', lists/sets/tuples of strings to 'str_list',
+    numbers and numeric arrays to their dtype. Other columns are skipped.
+    """
+    schema = dict()
+    for name in df.columns:
+        if len(df) == 0:
+            continue
+        value = df[name].iloc[0]
+        if isinstance(value, str):
+            schema[name] = STR
+        elif isinstance(value, (list, set, tuple, frozenset)) and all(
+                isinstance(x, str) for x in value):
+            schema[name] = STR_LIST
+        else:
+            array = np.asarray(value)
+            if array.dtype.kind in 'biuf':
+                dtype = array.dtype
+                if dtype == np.float64 and array.ndim > 0:
+                    # embeddings
+                    dtype = np.dtype(np.float32)
+                schema[name] = dtype.name
+    return schema
+
+
+def convert_dataframe(df, path, schema=None, block_size=10000):
+    """Write a DataFrame (e.g. an unpickled ``train_data.pkl``) as a
+    columnar dataset directory."""
+    if schema is None:
+        schema = infer_schema(df)
+    with ColumnarWriter(path, schema) as writer:
+        for start in range(0, len(df), block_size):
+            block = df.iloc[start:start + block_size]
+            writer.append(
+                dict((name, list(block[name])) for name in schema))
+    return schema
+
+
+def load_columns(data_path, columns):
+    """Columns of a dataset file, each indexable like a list.
+
+    Columnar directories are opened lazily (memory mapped), pickled
+    DataFrames are loaded and converted to lists as before.
+    """
+    if is_columnar(data_path):
+        data = ColumnarReader(data_path)
+        return [data[name] for name in columns]
+    df = pd.read_pickle(data_path)
+    return [list(df[name]) for name in columns]
+
+
+def _label_column(columns, label_columns):
+    for name in label_columns:
+        if name in columns:
+            if name != label_columns[0]:
+                logger.warning('No %s column, using %s as labels' %
+                               (label_columns[0], name))
+            return name
+    raise KeyError(label_columns[0])
+
+
+def load_annotated_sequences(data_path, label_columns=('prop_annotations', )):
+    """Sequences and GO labels (the first of ``label_columns`` present) of
+    a pickled or columnar dataset, KeyError when none is."""
+    if is_columnar(data_path):
+        data = ColumnarReader(data_path)
+        return [data['sequences'], data[_label_column(data, label_columns)]]
+    # unpickle once, the label column is picked from the same frame
+    df = pd.read_pickle(data_path)
+    label_column = _label_column(df.columns, label_columns)
+    return [list(df['sequences']), list(df[label_column])]
+
+
+def load_dataframe(data_path, columns=None):
+    """Read a pickled DataFrame or materialize a columnar dataset."""
+    if is_columnar(data_path):
+        return ColumnarReader(data_path).to_dataframe(columns)
+    df = pd.read_pickle(data_path)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+parser = argparse.ArgumentParser(
+    description='Convert pickled DataFrames to the columnar format')
+parser.add_argument('data_files',
+                    nargs='+',
+                    help='*.pkl files, each one is written to a directory of '
+                    'the same name without the suffix')
+parser.add_argument('--block-size', default=10000, type=int)
+
+
+def main(data_files, block_size=10000):
+    for data_file in data_files:
+        out_path = os.path.splitext(data_file)[0]
+        schema = convert_dataframe(pd.read_pickle(data_file),
+                                   out_path,
+                                   block_size=block_size)
+        print('%s -> %s %s' % (data_file, out_path, schema))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.data_files, args.block_size)
@@ -1,12 +1,18 @@
 #!/usr/bin/env python
 
 import logging
-from collections import Counter
 
 import click as ck
 import numpy as np
 import pandas as pd
 
+from deepfold.data.utils.columnar import (is_columnar, load_columns,
+                                          load_dataframe)
+from deepfold.data.utils.homology_split import (assign_clusters,
+                                                lsh_clusters,
+                                                sketch_sequences)
+from deepfold.data.utils.information_content import annotation_matrix
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -35,22 +41,58 @@ logging.basicConfig(level=logging.INFO)
            '-mc',
            default=50,
            help='Minimum number of annotated proteins')
+@ck.option('--test-size',
+           '-ts',
+           default=0.05,
+           help='Fraction of proteins in the test split')
+@ck.option('--split-method',
+           '-sm',
+           type=ck.Choice(['homology', 'random']),
+           default='homology',
+           help='Assign MinHash clusters of similar sequences to splits, '
+           'or shuffle proteins')
+@ck.option('--split-index-file',
+           '-sif',
+           default='data/split_index.npz',
+           help='Result file with train/test row indices and cluster ids')
+@ck.option('--save-data/--no-save-data',
+           default=True,
+           help='Also save the train/test DataFrames')
+@ck.option('--kmer-size', '-k', default=4, help='MinHash k-mer size')
+@ck.option('--num-perm', '-np', default=120, help='MinHash signature size')
+@ck.option('--bands',
+           '-b',
+           default=40,
+           help='LSH bands, more bands link less similar sequences')
+@ck.option('--num-workers',
+           '-nw',
+           default=None,
+           type=int,
+           help='Sketching processes (default: all cores)')
+@ck.option('--seed', default=0, help='Random seed')
 def main(go_file, data_file, out_terms_file, train_data_file, test_data_file,
-         min_count):
-
-    df = pd.read_pickle(data_file)
-    print('DATA FILE', len(df))
+         min_count, test_size, split_method, split_index_file, save_data,
+         kmer_size, num_perm, bands, num_workers, seed):
+
+    df = None
+    if save_data and not is_columnar(data_file):
+        # the split rows are saved too, unpickle the file only once
+        df = pd.read_pickle(data_file)
+        sequences = list(df['sequences'])
+        prop_annotations = list(df['prop_annotations'])
+    else:
+        sequences, prop_annotations = load_columns(
+            data_file, ['sequences', 'prop_annotations'])
+    n = len(sequences)
+    print('DATA FILE', n)
 
     logging.info('Processing annotations')
-
-    cnt = Counter()
-    for i, row in df.iterrows():
-        for term in row['prop_annotations']:
-            cnt[term] += 1
+    labels, all_terms, _ = annotation_matrix(prop_annotations)
+    cnt = np.asarray(labels.sum(axis=0)).ravel()
 
     # Filter terms with annotations more than min_count
     res = {}
-    for key, val in cnt.items():
+    for key, val in zip(all_terms, cnt):
         if val >= min_count:
             ont = key.split(':')[0]
             if ont not in res:
@@ -67,20 +109,41 @@ def main(go_file, data_file, out_terms_file, train_data_file, test_data_file,
     terms_df = pd.DataFrame({'terms': terms})
     terms_df.to_pickle(out_terms_file)
 
-    n = len(df)
     # Split train/valid
-    index = np.arange(n)
-    train_n = int(n * 0.95)
-    np.random.seed(seed=0)
-    np.random.shuffle(index)
-    train_df = df.iloc[index[:train_n]]
-    test_df = df.iloc[index[train_n:]]
-
-    print('Number of train proteins', len(train_df))
-    train_df.to_pickle(train_data_file)
-
-    print('Number of test proteins', len(test_df))
-    test_df.to_pickle(test_data_file)
+    if split_method == 'homology':
+        logging.info('Sketching sequences')
+        signatures = sketch_sequences(sequences,
+                                      k=kmer_size,
+                                      num_perm=num_perm,
+                                      seed=seed + 1,
+                                      num_workers=num_workers)
+        clusters = lsh_clusters(signatures, bands=bands)
+        logging.info(f'Number of clusters {clusters.max() + 1}')
+        is_test = assign_clusters(clusters, labels, test_size, seed=seed)
+        index = np.arange(n)
+        train_index = index[~is_test]
+        test_index = index[is_test]
+    else:
+        clusters = np.arange(n)
+        index = np.arange(n)
+        train_n = int(n * (1 - test_size))
+        np.random.seed(seed=seed)
+        np.random.shuffle(index)
+        train_index = index[:train_n]
+        test_index = index[train_n:]
+
+    np.savez(split_index_file,
+             train=train_index,
+             test=test_index,
+             clusters=clusters)
+    print('Number of train proteins', len(train_index))
+    print('Number of test proteins', len(test_index))
+
+    if save_data:
+        if df is None:
+            df = load_dataframe(data_file)
+        df.iloc[train_index].to_pickle(train_data_file)
+        df.iloc[test_index].to_pickle(test_data_file)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,7 @@
 import numpy as np
 
+from deepfold.data.utils.fasta import read_fasta  # noqa: F401
+
 BIOLOGICAL_PROCESS = 'GO:0008150'
 MOLECULAR_FUNCTION = 'GO:0003674'
 CELLULAR_COMPONENT = 'GO:0005575'
@@ -35,27 +37,6 @@ def is_exp_code(code):
     return code in EXP_CODES
 
 
-def read_fasta(filename):
-    seqs = list()
-    info = list()
-    seq = ''
-    inf = ''
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('>'):
-                if seq != '':
-                    seqs.append(seq)
-                    info.append(inf)
-                    seq = ''
-                inf = line[1:]
-            else:
-                seq += line
-        seqs.append(seq)
-        info.append(inf)
-    return info, seqs
-
-
 class DataGenerator(object):
     def __init__(self, batch_size, is_sparse=False):
         self.batch_size = batch_size
@@ -0,0 +1,275 @@
+"""Bulk embedding store, in HDF5 or NPZ.
+
+All embeddings of a set live in one contiguous 2-D dataset instead of one
+HDF5 dataset per protein, whose metadata dominates both writing and
+reading large sets::
+
+    embeddings   (N, dim), chunked by rows and optionally compressed
+    ids          (N,) utf-8 protein ids
+    attrs        {'format': 'deepfold-embeddings', 'version': 1}
+
+``EmbeddingWriter`` appends rows block by block (also to an existing
+store), ``EmbeddingStore`` hashes the ids once and then reads any protein,
+or a batch of them, by row. The per-protein layout written by
+bio_embeddings (one dataset / npz key per id) is still readable.
+"""
+import argparse
+import logging
+import os
+
+import h5py
+import numpy as np
+
+FORMAT = 'deepfold-embeddings'
+FORMAT_VERSION = 1
+EMBEDDINGS = 'embeddings'
+IDS = 'ids'
+H5_SUFFIXES = ('.h5', '.hdf5')
+
+
+def _check_path(path):
+    if not path.endswith(H5_SUFFIXES + ('.npz', )):
+        raise ValueError('Embedding files must end with .h5, .hdf5 or .npz, '
+                         'got %s' % path)
+
+
+class EmbeddingWriter(object):
+    """Stream embeddings into a bulk store.
+
+    Args:
+        path: ``.h5`` / ``.hdf5`` or ``.npz`` file.
+        mode: 'w' to create, 'a' to append to an existing bulk store.
+        dtype: storage dtype (default: that of the first embedding).
+        compression: HDF5 filter of the embeddings, e.g. 'gzip' or 'lzf'
+            (any value compresses NPZ files).
+        chunk_rows: rows per HDF5 chunk.
+        block_size: rows buffered in memory between two writes.
+
+    NPZ files cannot grow in place: their blocks are kept in memory and
+    written on ``close``, so only HDF5 stores are streamed to disk.
+
+    Example:
+        with EmbeddingWriter('train_emb.h5') as writer:
+            writer.add('P12345', embedding)
+    """
+    def __init__(self,
+                 path,
+                 mode='w',
+                 dtype=None,
+                 compression=None,
+                 chunk_rows=1024,
+                 block_size=4096):
+        _check_path(path)
+        self.path = path
+        self.dtype = dtype
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.block_size = block_size
+        self.num_rows = 0
+        self.dim = None
+        self._ids = []
+        self._rows = []
+        self._file = None
+        self._embeddings = None
+        self._id_data = None
+        self._npz_blocks = []
+        if path.endswith('.npz'):
+            if mode == 'a' and os.path.exists(path):
+                with EmbeddingStore(path) as store:
+                    ids, embeddings = store.to_array()
+                self._npz_blocks.append((list(ids), embeddings))
+                self.num_rows = len(ids)
+                self.dim = embeddings.shape[1]
+                self.dtype = self.dtype or embeddings.dtype
+            return
+        self._file = h5py.File(path, mode)
+        if EMBEDDINGS in self._file:
+            if self._file.attrs.get('format') != FORMAT:
+                raise ValueError('%s is not a bulk embedding store' % path)
+            self._embeddings = self._file[EMBEDDINGS]
+            self._id_data = self._file[IDS]
+            self.num_rows, self.dim = self._embeddings.shape
+            self.dtype = self._embeddings.dtype
+
+    def _create(self):
+        self._file.attrs['format'] = FORMAT
+        self._file.attrs['version'] = FORMAT_VERSION
+        self._embeddings = self._file.create_dataset(
+            EMBEDDINGS,
+            shape=(0, self.dim),
+            maxshape=(None, self.dim),
+            dtype=self.dtype,
+            chunks=(self.chunk_rows, self.dim),
+            compression=self.compression)
+        self._id_data = self._file.create_dataset(
+            IDS,
+            shape=(0, ),
+            maxshape=(None, ),
+            dtype=h5py.string_dtype('utf-8'),
+            chunks=(self.chunk_rows * 16, ))
+
+    def add(self, sequence_id, embedding):
+        embedding = np.asarray(embedding)
+        if embedding.ndim != 1:
+            raise ValueError('Embeddings must be pooled 1-D vectors, %s has '
+                             'shape %s' % (sequence_id, embedding.shape))
+        if self.dim is None:
+            self.dim = len(embedding)
+            self.dtype = self.dtype or embedding.dtype
+        elif len(embedding) != self.dim:
+            raise ValueError('Embedding of %s has size %d, expected %d' %
+                             (sequence_id, len(embedding), self.dim))
+        self._ids.append(sequence_id)
+        self._rows.append(embedding)
+        if len(self._ids) >= self.block_size:
+            self.flush()
+
+    def append(self, ids, embeddings):
+        """Add a ``(len(ids), dim)`` block of embeddings."""
+        for sequence_id, embedding in zip(ids, embeddings):
+            self.add(sequence_id, embedding)
+
+    def flush(self):
+        if not self._ids:
+            return
+        block = np.stack(self._rows).astype(self.dtype, copy=False)
+        if self._file is None:
+            self._npz_blocks.append((self._ids, block))
+        else:
+            if self._embeddings is None:
+                self._create()
+            start, end = self.num_rows, self.num_rows + len(block)
+            self._embeddings.resize(end, axis=0)
+            self._embeddings[start:end] = block
+            self._id_data.resize(end, axis=0)
+            self._id_data[start:end] = np.array(self._ids, dtype=object)
+        self.num_rows += len(block)
+        self._ids = []
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        if self._file is None:
+            ids = [i for block_ids, _ in self._npz_blocks for i in block_ids]
+            embeddings = (np.concatenate(
+                [block for _, block in self._npz_blocks])
+                          if self._npz_blocks else np.zeros((0, 0)))
+            save = np.savez_compressed if self.compression else np.savez
+            save(self.path, **{
+                IDS: np.array(ids, dtype=str),
+                EMBEDDINGS: embeddings
+            })
+            self._npz_blocks = []
+        elif self._file.id.valid:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EmbeddingStore(object):
+    """Read embeddings by protein id from a bulk or per-protein file.
+
+    ``store[protein]`` returns one embedding, ``store.get(proteins)`` a
+    ``(len(proteins), dim)`` array, ``store.to_dict()`` everything.
+    """
+    def __init__(self, path):
+        _check_path(path)
+        self.path = path
+        self.bulk = False
+        self._file = None
+        self._embeddings = None
+        if path.endswith('.npz'):
+            self._file = np.load(path)
+            if set(self._file.files) == {IDS, EMBEDDINGS}:
+                self.bulk = True
+                self.ids = self._file[IDS].astype(object)
+                self._embeddings = self._file[EMBEDDINGS]
+            else:
+                self.ids = np.array(self._file.files, dtype=object)
+        else:
+            self._file = h5py.File(path, 'r')
+            if self._file.attrs.get('format') == FORMAT:
+                self.bulk = True
+                self.ids = np.array(self._file[IDS].asstr()[:], dtype=object)
+                self._embeddings = self._file[EMBEDDINGS]
+            else:
+                self.ids = np.array(list(self._file.keys()), dtype=object)
+        self.index = dict((sequence_id, i)
+                          for i, sequence_id in enumerate(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, sequence_id):
+        return sequence_id in self.index
+
+    def __getitem__(self, sequence_id):
+        if self.bulk:
+            return np.asarray(self._embeddings[self.index[sequence_id]])
+        return np.array(self._file[sequence_id])
+
+    def get(self, ids):
+        """Embeddings of ``ids`` as a 2-D array, in the order given."""
+        if not self.bulk:
+            return np.stack([self[sequence_id] for sequence_id in ids])
+        rows = np.array([self.index[sequence_id] for sequence_id in ids],
+                        dtype=np.int64)
+        # HDF5 reads rows in increasing order, each only once
+        unique, inverse = np.unique(rows, return_inverse=True)
+        return np.asarray(self._embeddings[unique])[inverse]
+
+    def to_array(self):
+        """All ids and a ``(len(self), dim)`` array of their embeddings."""
+        if self.bulk:
+            return self.ids, np.asarray(self._embeddings[:])
+        return self.ids, self.get(self.ids)
+
+    def to_dict(self):
+        if not self.bulk:
+            return dict(
+                (sequence_id, self[sequence_id]) for sequence_id in self.ids)
+        ids, embeddings = self.to_array()
+        return dict(zip(ids, embeddings))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(input_file, output_file, compression=None, block_size=4096):
+    """Rewrite a per-protein (or bulk) embedding file as a bulk store."""
+    with EmbeddingStore(input_file) as store, EmbeddingWriter(
+            output_file, compression=compression,
+            block_size=block_size) as writer:
+        for start in range(0, len(store), block_size):
+            ids = store.ids[start:start + block_size]
+            writer.append(ids, store.get(ids))
+    return writer.num_rows
+
+
+parser = argparse.ArgumentParser(
+    description='Convert per-protein embedding files to a bulk store')
+parser.add_argument('--input-file', '-i', required=True)
+parser.add_argument('--output-file', '-o', required=True)
+parser.add_argument('--compression',
+                    default=None,
+                    choices=['gzip', 'lzf'],
+                    help='HDF5 compression of the embeddings')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+    num_rows = convert(args.input_file, args.output_file, args.compression)
+    logging.info('Wrote %d embeddings to %s' % (num_rows, args.output_file))
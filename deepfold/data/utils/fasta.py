@@ -0,0 +1,230 @@
+"""FASTA reading: streaming parser, ``.fai`` index and length-sorted batches.
+
+``iter_fasta`` streams (header, sequence) records from plain or gzipped
+files in large binary chunks. ``FastaFile`` keeps a samtools-compatible
+``.fai`` index next to a plain FASTA file, giving O(1) access to any record
+by id or position without loading the file, and ``iter_batches`` groups
+records by length for padding-efficient model inference.
+"""
+import gzip
+import os
+
+import numpy as np
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _parse_record(record):
+    header, _, body = record.partition(b'\n')
+    sequence = body.replace(b'\n', b'').replace(b'\r', b'').replace(b' ', b'')
+    return header.strip().decode('utf-8'), sequence.decode('ascii')
+
+
+def iter_fasta(filename, chunk_size=1 << 24):
+    """Yield ``(header, sequence)`` for every record of a FASTA file.
+
+    ``header`` is the description line without ``>``. The file is read in
+    ``chunk_size`` byte chunks and each sequence is joined once, so memory
+    stays bounded by the chunk and the longest record.
+    """
+    with _open(filename) as f:
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = rest + chunk
+            end = data.rfind(b'\n>')
+            if end < 0:
+                rest = data
+                continue
+            records = data[:end].split(b'\n>')
+            rest = data[end + 1:]
+            for record in records:
+                record = record.lstrip(b'>')
+                if record.strip():
+                    yield _parse_record(record)
+        if rest.strip():
+            yield _parse_record(rest.lstrip(b'>'))
+
+
+def parse_fasta(text):
+    """``(header, sequence)`` records of in-memory FASTA text."""
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    records = (b'\n' + text.strip()).split(b'\n>')
+    return [_parse_record(record) for record in records if record.strip()]
+
+
+def read_fasta(filename):
+    """Headers and sequences of a FASTA file as two lists."""
+    info = list()
+    seqs = list()
+    for header, sequence in iter_fasta(filename):
+        info.append(header)
+        seqs.append(sequence)
+    return info, seqs
+
+
+def build_fasta_index(filename):
+    """Scan a plain FASTA file and return its ``.fai`` columns.
+
+    Returns:
+        ids, lengths, offsets (of the first residue), line_bases,
+        line_widths
+    """
+    ids = []
+    lengths = []
+    offsets = []
+    line_bases = []
+    line_widths = []
+    with open(filename, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.startswith(b'>'):
+                ids.append(line[1:].split(None, 1)[0].decode('utf-8')
+                           if line[1:].strip() else '')
+                lengths.append(0)
+                offsets.append(offset + len(line))
+                line_bases.append(0)
+                line_widths.append(0)
+            elif ids:
+                bases = len(line.rstrip(b'\r\n'))
+                if line_bases[-1] == 0:
+                    line_bases[-1] = bases
+                    line_widths[-1] = len(line)
+                lengths[-1] += bases
+            offset += len(line)
+    return (ids, np.asarray(lengths, dtype=np.int64),
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(line_bases, dtype=np.int64),
+            np.asarray(line_widths, dtype=np.int64))
+
+
+class FastaFile(object):
+    """Random access to the records of a plain FASTA file.
+
+    The ``.fai`` index (``<filename>.fai``) is loaded if it is newer than the
+    FASTA file and built and saved otherwise.
+
+    Example:
+        fasta = FastaFile('proteome.fasta')
+        sequence = fasta['P12345']
+        for batch in fasta.iter_batches(max_tokens=8192):
+            ids = [record_id for record_id, _ in batch]
+    """
+    def __init__(self, filename, index_file=None):
+        if filename.endswith('.gz'):
+            raise ValueError('Random access needs an uncompressed FASTA file, '
+                             'use iter_fasta to stream gzipped files.')
+        self.filename = filename
+        self.index_file = index_file or filename + '.fai'
+        if (os.path.exists(self.index_file) and os.path.getmtime(
+                self.index_file) >= os.path.getmtime(filename)):
+            self._load_index()
+        else:
+            (self.ids, self.lengths, self.offsets, self.line_bases,
+             self.line_widths) = build_fasta_index(filename)
+            self._save_index()
+        self.id_to_index = dict(
+            (record_id, i) for i, record_id in enumerate(self.ids))
+        self._file = None
+
+    def _save_index(self):
+        with open(self.index_file, 'w') as f:
+            for row in zip(self.ids, self.lengths, self.offsets,
+                           self.line_bases, self.line_widths):
+                f.write('%s\t%d\t%d\t%d\t%d\n' % row)
+
+    def _load_index(self):
+        ids = []
+        columns = []
+        with open(self.index_file) as f:
+            for line in f:
+                items = line.rstrip('\n').split('\t')
+                ids.append(items[0])
+                columns.append([int(x) for x in items[1:5]])
+        columns = np.asarray(columns, dtype=np.int64).reshape(-1, 4)
+        self.ids = ids
+        self.lengths, self.offsets, self.line_bases, self.line_widths = (
+            columns.T.copy())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, record_id):
+        return record_id in self.id_to_index
+
+    def __getstate__(self):
+        # file handles are opened lazily in every (forked) process
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    def get(self, idx):
+        """Sequence of the ``idx``-th record."""
+        if self._file is None:
+            self._file = open(self.filename, 'rb')
+        length = int(self.lengths[idx])
+        if length == 0:
+            return ''
+        bases = int(self.line_bases[idx])
+        newline = int(self.line_widths[idx]) - bases
+        size = length + (length - 1) // bases * newline
+        self._file.seek(int(self.offsets[idx]))
+        data = self._file.read(size)
+        sequence = data.replace(b'\n', b'').replace(b'\r', b'')
+        if len(sequence) != length:
+            # irregular line widths, read line by line up to the next record
+            self._file.seek(int(self.offsets[idx]))
+            lines = []
+            for line in self._file:
+                if line.startswith(b'>'):
+                    break
+                lines.append(line.rstrip(b'\r\n'))
+            sequence = b''.join(lines)
+        return sequence.decode('ascii')
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.id_to_index[key]
+        return self.get(key)
+
+    def length_sorted_batches(self, batch_size=None, max_tokens=None):
+        """Record indices grouped into batches of similar length.
+
+        Batches hold at most ``batch_size`` records and at most
+        ``max_tokens`` residues counted with padding (``longest * size``).
+        """
+        if batch_size is None and max_tokens is None:
+            raise ValueError('Set batch_size and/or max_tokens')
+        order = np.argsort(-self.lengths, kind='stable')
+        batches = []
+        batch = []
+        for idx in order:
+            longest = int(self.lengths[batch[0]]) if batch else int(
+                self.lengths[idx])
+            full = batch_size is not None and len(batch) >= batch_size
+            if max_tokens is not None and batch:
+                full = full or longest * (len(batch) + 1) > max_tokens
+            if full:
+                batches.append(batch)
+                batch = []
+            batch.append(int(idx))
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def iter_batches(self, batch_size=None, max_tokens=None):
+        """Yield lists of ``(id, sequence)``, longest records first."""
+        for batch in self.length_sorted_batches(batch_size, max_tokens):
+            yield [(self.ids[idx], self.get(idx)) for idx in batch]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,400 @@
+"""In-process k-mer homology search (DIAMOND replacement for BlastKNN).
+
+Target sequences are indexed as a sparse ``(num_kmers, num_targets)``
+inverted index. Queries are scored in batches by their number of shared
+(spaced) k-mers with a single sparse product, the best candidates are kept
+and optionally rescored with a banded Smith-Waterman alignment in a process
+pool. The result is the ``(query, target, score)`` table that
+``diamond blastp --outfmt 6 qseqid sseqid bitscore`` produces.
+"""
+import argparse
+import logging
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from deepfold.data.utils.columnar import load_columns
+from deepfold.data.utils.homology_split import _AA_LUT, AMINO_ACIDS
+
+logging.basicConfig(level=logging.INFO)
+
+# BLOSUM62 in its usual residue order
+_BLOSUM62_ORDER = 'ARNDCQEGHILKMFPSTWYV'
+_BLOSUM62_ROWS = """
+ 4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0
+-1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3
+-2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3
+-2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3
+ 0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1
+-1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2
+-1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2
+ 0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3
+-2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3
+-1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3
+-1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1
+-1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2
+-1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1
+-2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1
+-1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2
+ 1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2
+ 0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0
+-3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3
+-2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1
+ 0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4
+"""
+
+# indexed by the residue codes of _AA_LUT, 0 (non-standard residue) is
+# scored like X
+SCORE_MATRIX = np.full((len(AMINO_ACIDS) + 1, len(AMINO_ACIDS) + 1),
+                       -1,
+                       dtype=np.int32)
+_order = [_BLOSUM62_ORDER.index(aa) for aa in AMINO_ACIDS]
+SCORE_MATRIX[1:, 1:] = np.array(_BLOSUM62_ROWS.split(), dtype=np.int32).reshape(
+    len(AMINO_ACIDS), -1)[np.ix_(_order, _order)]
+
+# alignment scores of unrelated sequences rarely exceed this (BLOSUM62,
+# gap 6), used like DIAMOND's e-value cutoff
+MIN_ALIGNMENT_SCORE = 60
+
+# entries of the query x index product scored at once, about 16 bytes each
+# while scipy builds it
+MAX_PRODUCTS = 1 << 24
+
+# target sequences of the rescoring workers, set by init_worker
+_targets = None
+
+
+def residue_codes(sequence):
+    return _AA_LUT[np.frombuffer(sequence.encode('ascii', 'replace'),
+                                 dtype=np.uint8)].astype(np.int64)
+
+
+def seed_kmers(codes, pattern):
+    """Code of the spaced k-mer starting at every position.
+
+    ``pattern`` is a string of '1' (residue used) and '0' (ignored), e.g.
+    '1111' for contiguous 4-mers or '11011' for a spaced seed. K-mers
+    overlapping a non-standard residue are dropped.
+
+    Returns:
+        codes, positions
+    """
+    offsets = [j for j, c in enumerate(pattern) if c == '1']
+    num = len(codes) - len(pattern) + 1
+    if num <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    kmers = np.zeros(num, dtype=np.int64)
+    valid = np.ones(num, dtype=bool)
+    for j in offsets:
+        part = codes[j:j + num]
+        kmers = kmers * len(AMINO_ACIDS) + np.maximum(part - 1, 0)
+        valid &= part > 0
+    positions = np.flatnonzero(valid)
+    return kmers[positions], positions
+
+
+def kmer_matrix(sequences, pattern):
+    """Binary ``(num_sequences, 20 ** k)`` CSR matrix of k-mer sets."""
+    num_kmers = len(AMINO_ACIDS)**pattern.count('1')
+    indices = []
+    indptr = np.zeros(len(sequences) + 1, dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        kmers = np.unique(seed_kmers(residue_codes(sequence), pattern)[0])
+        indices.append(kmers)
+        indptr[i + 1] = indptr[i] + len(kmers)
+    indices = np.concatenate(indices) if indices else np.zeros(0, np.int64)
+    return sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, indptr),
+        shape=(len(sequences), num_kmers))
+
+
+def best_diagonal(query, target, pattern):
+    """Most frequent ``target_pos - query_pos`` over shared k-mers."""
+    q_kmers, q_pos = seed_kmers(query, pattern)
+    t_kmers, t_pos = seed_kmers(target, pattern)
+    order = np.argsort(t_kmers, kind='stable')
+    t_kmers = t_kmers[order]
+    t_pos = t_pos[order]
+    idx = np.searchsorted(t_kmers, q_kmers)
+    idx = np.minimum(idx, max(len(t_kmers) - 1, 0))
+    hit = (t_kmers[idx] == q_kmers) if len(t_kmers) else np.zeros(0, bool)
+    if not hit.any():
+        return len(target) - len(query)
+    diagonals = t_pos[idx[hit]] - q_pos[hit] + len(query)
+    return int(np.bincount(diagonals).argmax()) - len(query)
+
+
+def banded_smith_waterman(query, targets, diagonals, band=32, gap=6):
+    """Local alignment scores of ``query`` against several targets.
+
+    Each alignment is restricted to the cells ``|j - i - diagonal| <= band``
+    of its target. ``query`` and ``targets`` are residue codes, scored with
+    BLOSUM62 and a linear ``gap`` penalty. Rows are computed for all targets
+    at once in band coordinates ``o = j - i - diagonal``; the in-row gap
+    recursion ``H[o] = max(T[o], H[o - 1] - gap)`` is a running maximum of
+    ``T[o] + gap * o``.
+
+    Returns:
+        ``(num_targets,)`` int64 scores.
+    """
+    num_targets = len(targets)
+    lengths = np.asarray([len(t) for t in targets], dtype=np.int64)
+    padded = np.zeros((num_targets, int(lengths.max(initial=0)) + 1),
+                      dtype=np.int64)
+    for c, target in enumerate(targets):
+        padded[c, :len(target)] = target
+    diagonals = np.asarray(diagonals, dtype=np.int64)[:, None]
+    offsets = np.arange(-band, band + 1)
+    ramp = gap * offsets
+    rows = np.arange(num_targets)[:, None]
+    prev = np.zeros((num_targets, 2 * band + 2), dtype=np.int64)
+    best = np.zeros(num_targets, dtype=np.int64)
+    for i in range(1, len(query) + 1):
+        cols = i + diagonals + offsets
+        valid = (cols >= 1) & (cols <= lengths[:, None])
+        residues = padded[rows, np.clip(cols - 1, 0, padded.shape[1] - 1)]
+        t = np.maximum(prev[:, :-1] + SCORE_MATRIX[query[i - 1], residues],
+                       prev[:, 1:] - gap)
+        t = np.where(valid, np.maximum(t, 0), 0)
+        cur = np.maximum.accumulate(t + ramp, axis=1) - ramp
+        cur = np.where(valid, cur, 0)
+        prev[:, :-1] = cur
+        best = np.maximum(best, cur.max(axis=1))
+    return best
+
+
+def init_worker(targets):
+    global _targets
+    _targets = targets
+
+
+def rescore_hits(args):
+    query, candidates, pattern, band, gap = args
+    query = residue_codes(query)
+    targets = [residue_codes(_targets[idx]) for idx in candidates]
+    diagonals = [best_diagonal(query, target, pattern) for target in targets]
+    scores = banded_smith_waterman(query, targets, diagonals, band, gap)
+    return scores.astype(np.float32)
+
+
+class KmerIndex(object):
+    """Inverted k-mer index over target sequences.
+
+    Args:
+        sequences: target sequences.
+        ids: target ids (default: positions).
+        pattern: seed pattern, see ``seed_kmers``.
+        max_frequency: k-mers found in more than this fraction of the
+            targets (low complexity regions, repeats) are not indexed.
+
+    Example:
+        index = KmerIndex(train_df['sequences'], train_df['proteins'])
+        hits = index.search(test_df['sequences'], test_df['proteins'])
+    """
+    def __init__(self,
+                 sequences,
+                 ids=None,
+                 pattern='1111',
+                 max_frequency=0.05):
+        self.sequences = list(sequences)
+        self.ids = list(ids) if ids is not None else list(
+            range(len(self.sequences)))
+        self.pattern = pattern
+        # (num_kmers, num_targets), the rows are the postings lists
+        index = kmer_matrix(self.sequences, pattern).T.tocsr()
+        frequency = np.diff(index.indptr)
+        max_count = max(1, int(max_frequency * len(self.sequences)))
+        index.data[np.repeat(frequency > max_count, frequency)] = 0
+        index.eliminate_zeros()
+        self.index = index
+
+    def candidates(self,
+                   queries,
+                   max_hits=25,
+                   min_shared=2,
+                   max_products=MAX_PRODUCTS):
+        """Targets sharing most k-mers with every query.
+
+        The queries are scored in chunks whose product with the index has
+        at most ``max_products`` entries (summed postings lengths of their
+        k-mers), a query with more is scored alone.
+
+        Returns:
+            one ``(target_indices, shared_counts)`` pair per query, best
+            first.
+        """
+        query_kmers = kmer_matrix(queries, self.pattern)
+        postings = np.diff(self.index.indptr)
+        work = np.bincount(np.repeat(np.arange(query_kmers.shape[0]),
+                                     np.diff(query_kmers.indptr)),
+                           weights=postings[query_kmers.indices],
+                           minlength=query_kmers.shape[0])
+        cum_work = np.concatenate([[0], np.cumsum(work)])
+        results = []
+        start = 0
+        while start < query_kmers.shape[0]:
+            end = max(
+                start + 1,
+                np.searchsorted(cum_work, cum_work[start] + max_products,
+                                side='right') - 1)
+            counts = (query_kmers[start:end] @ self.index).tocsr()
+            for i in range(counts.shape[0]):
+                row = slice(counts.indptr[i], counts.indptr[i + 1])
+                targets = counts.indices[row]
+                shared = counts.data[row]
+                keep = shared >= min_shared
+                targets, shared = targets[keep], shared[keep]
+                if len(targets) > max_hits:
+                    top = np.argpartition(-shared, max_hits - 1)[:max_hits]
+                    targets, shared = targets[top], shared[top]
+                order = np.lexsort((targets, -shared))
+                results.append((targets[order], shared[order]))
+            start = end
+        return results
+
+    def search(self,
+               queries,
+               query_ids=None,
+               max_hits=25,
+               min_shared=2,
+               rescore=True,
+               num_candidates=None,
+               band=32,
+               gap=6,
+               min_score=None,
+               batch_size=1024,
+               max_products=MAX_PRODUCTS,
+               num_workers=None):
+        """Search all queries against the index.
+
+        With ``rescore`` the best ``num_candidates`` (default
+        ``2 * max_hits``) k-mer candidates of every query are aligned with
+        ``banded_smith_waterman`` in ``num_workers`` processes (0 runs
+        in-process) and ranked by alignment score, otherwise the score is
+        the number of shared k-mers. Hits scoring below ``min_score``
+        (default ``MIN_ALIGNMENT_SCORE`` with ``rescore``, else
+        ``min_shared``) are dropped. The k-mer scoring of a ``batch_size``
+        batch holds at most ``max_products`` shared-k-mer entries at once
+        (see ``candidates``), whatever the number of targets.
+
+        Returns:
+            DataFrame with 'query', 'target' and 'score' columns.
+        """
+        queries = list(queries)
+        query_ids = list(query_ids) if query_ids is not None else list(
+            range(len(queries)))
+        num_candidates = num_candidates or (2 * max_hits
+                                            if rescore else max_hits)
+        candidates = []
+        for start in range(0, len(queries), batch_size):
+            candidates.extend(
+                self.candidates(queries[start:start + batch_size],
+                                num_candidates, min_shared, max_products))
+            logging.info('K-mer search: %d / %d queries' %
+                         (min(start + batch_size, len(queries)),
+                          len(queries)))
+
+        if min_score is None:
+            min_score = MIN_ALIGNMENT_SCORE if rescore else min_shared
+        if rescore:
+            tasks = [(query, targets, self.pattern, band, gap)
+                     for query, (targets, _) in zip(queries, candidates)]
+            if num_workers == 0:
+                init_worker(self.sequences)
+                scores = [rescore_hits(task) for task in tasks]
+            else:
+                with multiprocessing.Pool(num_workers,
+                                          initializer=init_worker,
+                                          initargs=(self.sequences, )) as pool:
+                    scores = pool.map(rescore_hits, tasks, chunksize=64)
+            candidates = [(targets, score)
+                          for (targets, _), score in zip(candidates, scores)]
+
+        rows = []
+        for query_id, (targets, scores) in zip(query_ids, candidates):
+            order = np.argsort(-scores, kind='stable')[:max_hits]
+            for j in order:
+                if scores[j] >= min_score:
+                    rows.append(
+                        (query_id, self.ids[targets[j]], float(scores[j])))
+        return pd.DataFrame(rows, columns=['query', 'target', 'score'])
+
+
+def hits_to_dict(hits):
+    """``{query: {target: score}}``, as ``get_diamond_scores`` returns."""
+    scores = {}
+    for query, target, score in hits.itertuples(index=False):
+        scores.setdefault(query, {})[target] = score
+    return scores
+
+
+def write_hits(hits, filename):
+    """Write hits in DIAMOND's tabular format (qseqid sseqid bitscore)."""
+    hits.to_csv(filename, sep='\t', header=False, index=False)
+
+
+def read_hits(filename):
+    """Read a ``write_hits`` / DIAMOND ``qseqid sseqid bitscore`` table."""
+    return pd.read_csv(filename,
+                       sep=r'\s+',
+                       header=None,
+                       usecols=[0, 1, 2],
+                       names=['query', 'target', 'score'],
+                       dtype={
+                           'query': str,
+                           'target': str
+                       })
+
+
+parser = argparse.ArgumentParser(
+    description='Search test sequences against training sequences')
+parser.add_argument('--train-data-file',
+                    '-trdf',
+                    default='data/train_data.pkl',
+                    help='Data file with training proteins and sequences')
+parser.add_argument('--test-data-file',
+                    '-tsdf',
+                    default='data/test_data.pkl',
+                    help='Data file with query proteins and sequences')
+parser.add_argument('--output-file',
+                    '-o',
+                    default='data/test_diamond.res',
+                    help='Hits table (query, target, score)')
+parser.add_argument('--pattern',
+                    default='1111',
+                    help='Seed pattern, e.g. 1111 or 11011')
+parser.add_argument('--max-hits', default=25, type=int)
+parser.add_argument('--no-rescore',
+                    action='store_true',
+                    help='Score by shared k-mers, skip the alignment')
+parser.add_argument('--num-workers', '-nw', default=None, type=int)
+
+
+def main(train_data_file,
+         test_data_file,
+         output_file,
+         pattern='1111',
+         max_hits=25,
+         rescore=True,
+         num_workers=None):
+    train_ids, train_seqs = load_columns(train_data_file,
+                                         ['proteins', 'sequences'])
+    test_ids, test_seqs = load_columns(test_data_file,
+                                       ['proteins', 'sequences'])
+    logging.info('Indexing %d target sequences' % len(train_seqs))
+    index = KmerIndex(train_seqs, train_ids, pattern=pattern)
+    hits = index.search(test_seqs,
+                        test_ids,
+                        max_hits=max_hits,
+                        rescore=rescore,
+                        num_workers=num_workers)
+    write_hits(hits, output_file)
+    logging.info('Saved %d hits to %s' % (len(hits), output_file))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.train_data_file, args.test_data_file, args.output_file,
+         args.pattern, args.max_hits, not args.no_rescore, args.num_workers)
@@ -0,0 +1,197 @@
+"""Homology-aware train/test splits.
+
+Sequences are sketched with k-mer MinHash, sketches are bucketed with
+LSH banding and sequences sharing a bucket are joined into clusters
+(connected components). Whole clusters are then assigned to splits while
+keeping the per-term train/test ratio close to the target.
+"""
+import multiprocessing
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+# 0 for anything that is not a standard residue
+_AA_LUT = np.zeros(256, dtype=np.uint64)
+for _i, _aa in enumerate(AMINO_ACIDS):
+    _AA_LUT[ord(_aa)] = _i + 1
+    _AA_LUT[ord(_aa.lower())] = _i + 1
+
+_HASH_SHIFT = np.uint64(32)
+_SHORT_TAG = np.uint64(1) << np.uint64(63)
+
+
+def hash_params(num_perm, seed=1):
+    """Odd multipliers and offsets of ``num_perm`` multiply-shift hashes."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2**62, size=num_perm, dtype=np.int64)
+    b = rng.randint(0, 2**62, size=num_perm, dtype=np.int64)
+    return (a.astype(np.uint64) | np.uint64(1)), b.astype(np.uint64)
+
+
+def kmer_codes(sequence, k):
+    """Integer code (5 bits per residue) of every k-mer of ``sequence``."""
+    codes = _AA_LUT[np.frombuffer(sequence.encode('ascii', 'replace'),
+                                  dtype=np.uint8)]
+    if len(codes) < k:
+        # no k-mer: the whole sequence and its length make the only code,
+        # with the top bit set so that it never equals a real k-mer
+        code = np.uint64(0)
+        for residue in codes:
+            code = (code << np.uint64(5)) | residue
+        code |= (np.uint64(len(codes)) << np.uint64(56)) | _SHORT_TAG
+        return np.array([code], dtype=np.uint64)
+    kmers = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        kmers <<= np.uint64(5)
+        kmers |= codes[j:len(codes) - k + 1 + j]
+    return np.unique(kmers)
+
+
+def minhash(sequence, k, a, b):
+    """``(num_perm,)`` MinHash signature of the k-mer set of a sequence."""
+    kmers = kmer_codes(sequence, k)
+    with np.errstate(over='ignore'):
+        hashes = (kmers[:, None] * a[None, :] + b[None, :]) >> _HASH_SHIFT
+    return hashes.min(axis=0).astype(np.uint32)
+
+
+def _sketch_chunk(args):
+    sequences, k, num_perm, seed = args
+    a, b = hash_params(num_perm, seed)
+    out = np.empty((len(sequences), num_perm), dtype=np.uint32)
+    for i, sequence in enumerate(sequences):
+        out[i] = minhash(sequence, k, a, b)
+    return out
+
+
+def sketch_sequences(sequences,
+                     k=4,
+                     num_perm=120,
+                     seed=1,
+                     num_workers=None,
+                     chunk_size=2048):
+    """MinHash signatures of all sequences, ``(num_seqs, num_perm)`` uint32.
+
+    Chunks of sequences are sketched in a process pool (``num_workers=0``
+    runs in-process).
+    """
+    chunks = [([sequences[j] for j in range(i, min(i + chunk_size,
+                                                    len(sequences)))],
+               k, num_perm, seed)
+              for i in range(0, len(sequences), chunk_size)]
+    if num_workers == 0:
+        blocks = [_sketch_chunk(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            blocks = pool.map(_sketch_chunk, chunks)
+    if not blocks:
+        return np.zeros((0, num_perm), dtype=np.uint32)
+    return np.concatenate(blocks)
+
+
+def lsh_clusters(signatures, bands=40):
+    """Cluster id of every sequence.
+
+    Signatures are cut in ``bands`` bands; sequences with an identical band
+    are linked and clusters are the connected components. Two sequences of
+    k-mer Jaccard similarity ``s`` are linked with probability
+    ``1 - (1 - s**r)**bands``, ``r = num_perm // bands``. With the default
+    4-mers, 120 hashes and 40 bands, pairs around 80% identity are linked
+    about half of the time (and their families almost surely), unrelated
+    pairs with probability ~1e-7.
+    """
+    num_seqs, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of '
+                         f'bands ({bands})')
+    rows = num_perm // bands
+    src = []
+    dst = []
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) *
+                                                rows])
+        keys = block.view(np.dtype((np.void, block.dtype.itemsize * rows)))
+        _, first, inverse = np.unique(keys.ravel(),
+                                      return_index=True,
+                                      return_inverse=True)
+        src.append(np.arange(num_seqs))
+        dst.append(first[inverse.ravel()])
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    graph = sp.csr_matrix((np.ones(len(src), dtype=np.int8), (src, dst)),
+                          shape=(num_seqs, num_seqs))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def assign_clusters(clusters, labels, test_size=0.05, seed=0):
+    """Assign whole clusters to train (False) or test (True).
+
+    Clusters are visited from the one holding the rarest term to the most
+    common ones (random order within ties) and go to the split whose
+    per-term deficit w.r.t. ``test_size`` they reduce most, weighting every
+    term by its inverse frequency; a size term keeps the test fraction on
+    target.
+
+    Args:
+        clusters: ``(num_seqs,)`` cluster ids.
+        labels: ``(num_seqs, num_terms)`` sparse binary label matrix.
+
+    Returns:
+        ``(num_seqs,)`` boolean test mask.
+    """
+    num_clusters = clusters.max() + 1 if len(clusters) else 0
+    membership = sp.csr_matrix(
+        (np.ones(len(clusters), dtype=np.float64),
+         (clusters, np.arange(len(clusters)))),
+        shape=(num_clusters, len(clusters)))
+    cluster_labels = (membership @ sp.csr_matrix(labels)).tocsr()
+    sizes = np.asarray(membership.sum(axis=1)).ravel()
+    totals = np.asarray(cluster_labels.sum(axis=0)).ravel()
+    weights = 1.0 / np.maximum(totals, 1)
+
+    # rarest term of every cluster, clusters without labels last
+    rarest = np.full(num_clusters, np.inf)
+    nonempty = np.diff(cluster_labels.indptr) > 0
+    if nonempty.any():
+        rarest[nonempty] = np.minimum.reduceat(
+            totals[cluster_labels.indices],
+            cluster_labels.indptr[:-1][nonempty])
+    rng = np.random.RandomState(seed)
+    order = np.lexsort((rng.permutation(num_clusters), rarest))
+
+    want_test = totals * test_size
+    want_train = totals - want_test
+    have_test = np.zeros_like(totals)
+    have_train = np.zeros_like(totals)
+    test_target = sizes.sum() * test_size
+    test_seqs = 0.0
+    train_seqs = 0.0
+    is_test = np.zeros(num_clusters, dtype=bool)
+    indptr, indices, data = (cluster_labels.indptr, cluster_labels.indices,
+                             cluster_labels.data)
+    for c in order:
+        idx = indices[indptr[c]:indptr[c + 1]]
+        cnt = data[indptr[c]:indptr[c + 1]]
+        w = weights[idx]
+        gain_test = (w * np.minimum(cnt, np.maximum(
+            want_test[idx] - have_test[idx], 0))).sum()
+        gain_train = (w * np.minimum(cnt, np.maximum(
+            want_train[idx] - have_train[idx], 0))).sum()
+        test_room = test_target - test_seqs
+        train_room = sizes.sum() - test_target - train_seqs
+        if gain_test == gain_train:
+            to_test = test_room / max(test_target, 1) > train_room / max(
+                sizes.sum() - test_target, 1)
+        else:
+            to_test = gain_test > gain_train and test_room >= sizes[c] / 2
+        if to_test:
+            is_test[c] = True
+            have_test[idx] += cnt
+            test_seqs += sizes[c]
+        else:
+            have_train[idx] += cnt
+            train_seqs += sizes[c]
+    return is_test[clusters]
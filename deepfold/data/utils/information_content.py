@@ -0,0 +1,141 @@
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+
+from deepfold.utils.file_utils import hash_file
+
+# (annotations hash, ontology version) -> (terms, ic vector)
+_IC_CACHE = dict()
+
+
+def annotation_matrix(annots, term_index=None):
+    """Binary ``(num_proteins, num_terms)`` CSR matrix of annotation sets.
+
+    Args:
+        annots: iterable of term id collections, one per protein.
+        term_index: ``{term_id: column}``. When None it is built from the
+            annotations, in order of first appearance; otherwise terms that
+            are not in the index are skipped.
+
+    Returns:
+        matrix, terms, term_index
+    """
+    grow = term_index is None
+    if grow:
+        term_index = dict()
+    indices = []
+    indptr = [0]
+    for annot in annots:
+        for term_id in annot:
+            col = term_index.get(term_id)
+            if col is None:
+                if not grow:
+                    continue
+                col = term_index[term_id] = len(term_index)
+            indices.append(col)
+        indptr.append(len(indices))
+    indices = np.asarray(indices, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.float64)
+    matrix = sp.csr_matrix((data, indices, np.asarray(indptr)),
+                           shape=(len(indptr) - 1, len(term_index)))
+    # duplicated terms of a protein count once, like in a set
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    terms = [None] * len(term_index)
+    for term_id, col in term_index.items():
+        terms[col] = term_id
+    return matrix, terms, term_index
+
+
+def parent_matrix(ontology, terms, term_index):
+    """CSR matrix whose row ``i`` holds the ``is_a`` parents of ``terms[i]``.
+
+    Parents missing from ``term_index`` get the extra column
+    ``len(terms)``, i.e. a zero annotation count.
+    """
+    rows = []
+    cols = []
+    missing = len(terms)
+    for i, term_id in enumerate(terms):
+        for parent_id in ontology.get_parents(term_id):
+            rows.append(i)
+            cols.append(term_index.get(parent_id, missing))
+    data = np.ones(len(rows), dtype=np.float64)
+    return sp.csr_matrix((data, (rows, cols)),
+                         shape=(len(terms), len(terms) + 1))
+
+
+def compute_ic(counts, parents):
+    """``log2(min(parent counts) / count)`` for every term, 0 for roots.
+
+    Args:
+        counts: ``(num_terms,)`` annotation counts.
+        parents: ``(num_terms, num_terms + 1)`` CSR parent matrix.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    padded = np.append(counts, 0.0)
+    min_n = counts.copy()
+    nnz = np.diff(parents.indptr)
+    has_parents = nnz > 0
+    if has_parents.any():
+        parent_counts = padded[parents.indices]
+        min_n[has_parents] = np.minimum.reduceat(
+            parent_counts, parents.indptr[:-1][has_parents])
+    if (min_n == 0).any():
+        raise ValueError('Annotations are not propagated: a term is '
+                         'annotated while one of its parents is not.')
+    return np.log2(min_n / counts)
+
+
+def hash_annotations(matrix, terms):
+    md5 = hashlib.md5()
+    md5.update(np.ascontiguousarray(matrix.indptr).tobytes())
+    md5.update(np.ascontiguousarray(matrix.indices).tobytes())
+    md5.update('\n'.join(terms).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def ontology_version(ontology):
+    """Content hash of the obo file an ontology was parsed from."""
+    version = getattr(ontology, '_version', None)
+    if version is None:
+        version = (hash_file(ontology.filename),
+                   getattr(ontology, 'include_alt_ids', None))
+        ontology._version = version
+    return version
+
+
+def calculate_ic(ontology, annots, use_cache=True):
+    """Information content of every annotated term.
+
+    Term counts are column sums of the sparse annotation matrix and the
+    parent minimum is a segmented reduction over the CSR parent matrix.
+    Results are cached per (annotations, ontology version).
+
+    Returns:
+        terms: list of term ids.
+        ic: ``(num_terms,)`` float array aligned with ``terms``.
+    """
+    matrix, terms, term_index = annotation_matrix(annots)
+    key = None
+    if use_cache:
+        key = (hash_annotations(matrix, terms), ontology_version(ontology))
+        if key in _IC_CACHE:
+            return _IC_CACHE[key]
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    ic = compute_ic(counts, parent_matrix(ontology, terms, term_index))
+    if key is not None:
+        _IC_CACHE[key] = (terms, ic)
+    return terms, ic
+
+
+def sum_ic(ontology, annots):
+    """Per-protein sum of the IC of ``annots`` as a sparse dot product.
+
+    Terms without an information content count as 0, like ``get_ic``.
+    """
+    if ontology.ic_vector is None:
+        raise Exception('Not yet calculated')
+    matrix, _, _ = annotation_matrix(annots, ontology.ic_index)
+    return matrix.dot(ontology.ic_vector)
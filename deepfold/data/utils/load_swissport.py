@@ -1,10 +1,12 @@
 import argparse
 import gzip
 import logging
+import multiprocessing
 import sys
 
 import pandas as pd
 
+from deepfold.data.utils.columnar import ColumnarWriter
 from deepfold.data.utils.data_utils import is_cafa_target, is_exp_code
 from deepfold.data.utils.ontology import Ontology
 
@@ -12,6 +14,102 @@ sys.path.append('../../../')
 
 logging.basicConfig(level=logging.INFO)
 
+RECORD_END = '\n//\n'
+
+SCHEMA = {
+    'proteins': 'str',
+    'accessions': 'str',
+    'sequences': 'str',
+    'annotations': 'str_list',
+    'interpros': 'str_list',
+    'orgs': 'str',
+    'exp_annotations': 'str_list',
+    'prop_annotations': 'str_list',
+    'cafa_target': 'bool'
+}
+
+# ancestor closure of every GO term, set in each worker by init_worker
+_ancestors = None
+
+
+def open_swissprot(swissprot_file):
+    if swissprot_file.endswith('.gz'):
+        return gzip.open(swissprot_file, 'rt')
+    return open(swissprot_file, 'r')
+
+
+def iter_record_blocks(swissprot_file, block_size=1 << 22):
+    """Split the (decompressed) flat file into blocks of whole records.
+
+    Each block holds roughly ``block_size`` characters and ends right after
+    a ``//`` record terminator, so blocks can be parsed independently.
+    """
+    with open_swissprot(swissprot_file) as f:
+        rest = ''
+        while True:
+            chunk = f.read(block_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind(RECORD_END)
+            if end < 0:
+                rest = chunk
+                continue
+            end += len(RECORD_END)
+            yield chunk[:end]
+            rest = chunk[end:]
+        if rest.strip():
+            yield rest
+
+
+def parse_record(record):
+    """Parse one SwissProt entry given as text.
+
+    Returns:
+        prot_id, prot_ac, seq, annots ('GO:xxxxxxx|CODE'), ipros, org
+    """
+    prot_id = ''
+    prot_ac = ''
+    seq = ''
+    org = ''
+    annots = list()
+    ipros = list()
+    lines = record.split('\n')
+    for i, line in enumerate(lines):
+        items = line.strip().split('   ')
+        if items[0] == 'ID' and len(items) > 1:
+            prot_id = items[1]
+        elif items[0] == 'AC' and len(items) > 1:
+            prot_ac = items[1]
+        elif items[0] == 'OX' and len(items) > 1:
+            if items[1].startswith('NCBI_TaxID='):
+                org = items[1][11:]
+                end = org.find(' ')
+                org = org[:end]
+            else:
+                org = ''
+        elif items[0] == 'DR' and len(items) > 1:
+            items = items[1].split('; ')
+            if items[0] == 'GO':
+                go_id = items[1]
+                code = items[3].split(':')[0]
+                annots.append(go_id + '|' + code)
+            if items[0] == 'InterPro':
+                ipro_id = items[1]
+                ipros.append(ipro_id)
+        elif items[0] == 'SQ':
+            seq = ''.join(
+                sq.strip().replace(' ', '') for sq in lines[i + 1:]
+                if sq.strip() != '//')
+            break
+    return prot_id, prot_ac, seq, annots, ipros, org
+
+
+def iter_records(block):
+    for record in block.split(RECORD_END):
+        if record.strip() and record.strip() != '//':
+            yield record
+
 
 def load_swissport(swissprot_file):
     proteins = list()
@@ -20,63 +118,52 @@ def load_swissport(swissprot_file):
     annotations = list()
     interpros = list()
     orgs = list()
-    with gzip.open(swissprot_file, 'rt') as f:
-        prot_id = ''
-        prot_ac = ''
-        seq = ''
-        org = ''
-        annots = list()
-        ipros = list()
-        for line in f:
-            items = line.strip().split('   ')
-            if items[0] == 'ID' and len(items) > 1:
-                if prot_id != '':
-                    proteins.append(prot_id)
-                    accessions.append(prot_ac)
-                    sequences.append(seq)
-                    annotations.append(annots)
-                    interpros.append(ipros)
-                    orgs.append(org)
-                prot_id = items[1]
-                annots = list()
-                ipros = list()
-                seq = ''
-            elif items[0] == 'AC' and len(items) > 1:
-                prot_ac = items[1]
-            elif items[0] == 'OX' and len(items) > 1:
-                if items[1].startswith('NCBI_TaxID='):
-                    org = items[1][11:]
-                    end = org.find(' ')
-                    org = org[:end]
-                else:
-                    org = ''
-            elif items[0] == 'DR' and len(items) > 1:
-                items = items[1].split('; ')
-                if items[0] == 'GO':
-                    go_id = items[1]
-                    code = items[3].split(':')[0]
-                    annots.append(go_id + '|' + code)
-                if items[0] == 'InterPro':
-                    ipro_id = items[1]
-                    ipros.append(ipro_id)
-            elif items[0] == 'SQ':
-                seq = next(f).strip().replace(' ', '')
-                while True:
-                    sq = next(f).strip().replace(' ', '')
-                    if sq == '//':
-                        break
-                    else:
-                        seq += sq
-
-        proteins.append(prot_id)
-        accessions.append(prot_ac)
-        sequences.append(seq)
-        annotations.append(annots)
-        interpros.append(ipros)
-        orgs.append(org)
+    for block in iter_record_blocks(swissprot_file):
+        for record in iter_records(block):
+            prot_id, prot_ac, seq, annots, ipros, org = parse_record(record)
+            proteins.append(prot_id)
+            accessions.append(prot_ac)
+            sequences.append(seq)
+            annotations.append(annots)
+            interpros.append(ipros)
+            orgs.append(org)
     return proteins, accessions, sequences, annotations, interpros, orgs
 
 
+def init_worker(ancestors):
+    global _ancestors
+    _ancestors = ancestors
+
+
+def parse_block(block):
+    """Parse a block of records, keep proteins with experimental annotations
+    and propagate them with the precomputed ancestor closure."""
+    columns = dict((name, []) for name in SCHEMA)
+    for record in iter_records(block):
+        prot_id, prot_ac, seq, annots, ipros, org = parse_record(record)
+        exp_annots = []
+        for annot in annots:
+            go_id, code = annot.split('|')
+            if is_exp_code(code):
+                exp_annots.append(go_id)
+        # Ignore proteins without experimental annotations
+        if len(exp_annots) == 0:
+            continue
+        annot_set = set()
+        for go_id in exp_annots:
+            annot_set |= _ancestors.get(go_id, frozenset())
+        columns['proteins'].append(prot_id)
+        columns['accessions'].append(prot_ac)
+        columns['sequences'].append(seq)
+        columns['annotations'].append(annots)
+        columns['interpros'].append(ipros)
+        columns['orgs'].append(org)
+        columns['exp_annotations'].append(exp_annots)
+        columns['prop_annotations'].append(list(annot_set))
+        columns['cafa_target'].append(is_cafa_target(org))
+    return columns
+
+
 parser = argparse.ArgumentParser(
     description='Protein function Classification Model Train config')
 parser.add_argument('--go-file',
@@ -92,64 +179,57 @@ parser.add_argument(
     '--out-file',
     '-o',
     default='data/swissprot.pkl',
-    help='Result file with a list of proteins, sequences and annotations')
-
-
-def main(go_file, swissprot_file, out_file):
+    help='Result file with a list of proteins, sequences and annotations. '
+    'A path not ending with .pkl is written as a columnar dataset directory')
+parser.add_argument('--num-workers',
+                    '-nw',
+                    default=None,
+                    type=int,
+                    help='Number of parser processes (default: all cores)')
+parser.add_argument('--block-size',
+                    '-bs',
+                    default=1 << 22,
+                    type=int,
+                    help='Characters of the flat file parsed per task')
+
+
+def main(go_file,
+         swissprot_file,
+         out_file,
+         num_workers=None,
+         block_size=1 << 22):
     go = Ontology(go_file, with_rels=True)
-
-    proteins, accessions, sequences, annotations, interpros, orgs = load_swissport(
-        swissprot_file)
-    df = pd.DataFrame({
-        'proteins': proteins,
-        'accessions': accessions,
-        'sequences': sequences,
-        'annotations': annotations,
-        'interpros': interpros,
-        'orgs': orgs
-    })
-
-    logging.info('Filtering proteins with experimental annotations')
-    index = []
-    annotations = []
-    for i, row in enumerate(df.itertuples()):
-        annots = []
-        for annot in row.annotations:
-            go_id, code = annot.split('|')
-            if is_exp_code(code):
-                annots.append(go_id)
-        # Ignore proteins without experimental annotations
-        if len(annots) == 0:
-            continue
-        index.append(i)
-        annotations.append(annots)
-    df = df.iloc[index]
-    df = df.reset_index()
-    df['exp_annotations'] = annotations
-
-    prop_annotations = []
-    for i, row in df.iterrows():
-        # Propagate annotations
-        annot_set = set()
-        annots = row['exp_annotations']
-        for go_id in annots:
-            annot_set |= go.get_anchestors(go_id)
-        annots = list(annot_set)
-        prop_annotations.append(annots)
-    df['prop_annotations'] = prop_annotations
-
-    cafa_target = []
-    for i, row in enumerate(df.itertuples()):
-        if is_cafa_target(row.orgs):
-            cafa_target.append(True)
-        else:
-            cafa_target.append(False)
-    df['cafa_target'] = cafa_target
-
-    df.to_pickle(out_file)
-    logging.info('Successfully saved %d proteins' % (len(df), ))
+    ancestors = dict(
+        (go_id, frozenset(go.get_ancestors(go_id))) for go_id in go.ont)
+
+    if out_file.endswith('.pkl'):
+        columns = dict((name, []) for name in SCHEMA)
+        writer = None
+    else:
+        writer = ColumnarWriter(out_file, SCHEMA)
+
+    logging.info('Parsing proteins with experimental annotations')
+    num_proteins = 0
+    with multiprocessing.Pool(num_workers,
+                              initializer=init_worker,
+                              initargs=(ancestors, )) as pool:
+        blocks = iter_record_blocks(swissprot_file, block_size)
+        for block_columns in pool.imap(parse_block, blocks):
+            num_proteins += len(block_columns['proteins'])
+            if writer is not None:
+                writer.append(block_columns)
+            else:
+                for name, values in block_columns.items():
+                    columns[name].extend(values)
+
+    if writer is not None:
+        writer.close()
+    else:
+        pd.DataFrame(columns).to_pickle(out_file)
+    logging.info('Successfully saved %d proteins' % (num_proteins, ))
 
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args.go_file, args.swissprot_file, args.out_file)
+    main(args.go_file, args.swissprot_file, args.out_file, args.num_workers,
+         args.block_size)
@@ -1,5 +1,6 @@
-import math
-from collections import Counter, deque
+from collections import deque
+
+from deepfold.data.utils import information_content
 
 # root terms
 BIOLOGICAL_PROCESS = 'GO:0008150'
@@ -23,6 +24,10 @@ namespace2go = {
     'molecular_function': MOLECULAR_FUNCTION,
     'biological_process': BIOLOGICAL_PROCESS
 }
+# relations followed upwards by get_ancestors (has_part points downwards)
+ANCESTOR_RELATIONS = ('is_a', 'part_of', 'regulates', 'negatively_regulates',
+                      'positively_regulates', 'occurs_in', 'ends_during',
+                      'happens_during')
 
 
 class OntologyParser(object):
@@ -52,10 +57,15 @@ class OntologyParser(object):
                  remove_obs=True,
                  include_alt_ids=True):
         """if with_rels=False only consider is_a as relationship."""
+        self.filename = filename
         self.remove_obs = remove_obs
         self.include_alt_ids = include_alt_ids
         self.leaves = []
         self.ont = self._parse_obo(filename, with_rels)
+        self._ancestors = dict()
+        self.ic = None
+        self.ic_index = None
+        self.ic_vector = None
 
     def _parse_obo(self, filename, with_rels):
         ont = dict()
@@ -146,18 +156,10 @@ class OntologyParser(object):
         return None
 
     def calculate_ic(self, annots):
-        cnt = Counter()
-        for x in annots:
-            cnt.update(x)
-        self.ic = {}
-        for go_id, n in cnt.items():
-            parents = self.get_parents(go_id)
-            if len(parents) == 0:
-                min_n = n
-            else:
-                min_n = min([cnt[x] for x in parents])
-
-            self.ic[go_id] = math.log(min_n / n, 2)
+        terms, ic = information_content.calculate_ic(self, annots)
+        self.ic_index = dict((go_id, i) for i, go_id in enumerate(terms))
+        self.ic_vector = ic
+        self.ic = dict(zip(terms, ic.tolist()))
 
     def get_ic(self, go_id):
         if self.ic is None:
@@ -181,24 +183,65 @@ class OntologyParser(object):
                         q.append(parent_id)
         return term_set
 
-    def get_ancestors(self, term_id):
+    def get_relation_parents(self, term_id):
+        """Direct parents of ``term_id`` over all ``ANCESTOR_RELATIONS``."""
         if term_id not in self.ont:
             return set()
+        obj = self.ont[term_id]
+        return set(parent_id for rel in ANCESTOR_RELATIONS
+                   for parent_id in obj[rel] if parent_id in self.ont)
+
+    def get_ancestors(self, term_id):
+        """Return ``term_id`` and all of its ancestors over the multi-relation
+        DAG, i.e. every term lying on some root-to-term path.
 
-        parents = set(self.ont[term_id]['is_a']) | \
-            set(self.ont[term_id]['part_of']) | \
-            set(self.ont[term_id]['regulates']) | \
-            set(self.ont[term_id]['negatively_regulates']) | \
-            set(self.ont[term_id]['positively_regulates']) | \
-            set(self.ont[term_id]['occurs_in']) | \
-            set(self.ont[term_id]['ends_during']) | \
-            set(self.ont[term_id]['happens_during'])
+        Closures are computed once, parents before children, and memoized,
+        so the cost is one set union per edge over the whole ontology
+        instead of enumerating an exponential number of paths.
+        """
+        if term_id not in self.ont:
+            return frozenset()
+        ancestors = self._ancestors
+        in_progress = set()
+        stack = [term_id]
+        while stack:
+            node = stack[-1]
+            if node in ancestors:
+                stack.pop()
+                continue
+            parents = self.get_relation_parents(node)
+            pending = [p for p in parents if p not in ancestors]
+            if pending:
+                if node in in_progress:
+                    raise ValueError(
+                        f'Cycle in the ontology relations at {node}')
+                in_progress.add(node)
+                stack.extend(pending)
+                continue
+            closure = set([node])
+            for parent_id in parents:
+                closure |= ancestors[parent_id]
+            ancestors[node] = frozenset(closure)
+            in_progress.discard(node)
+            stack.pop()
+        return ancestors[term_id]
+
+    def iter_ancestor_paths(self, term_id):
+        """Lazily yield every root-to-term path as a list of term ids.
+
+        The number of paths can grow exponentially with the depth of the
+        term, prefer ``get_ancestors`` unless the paths themselves are
+        needed.
+        """
+        if term_id not in self.ont:
+            return
+        parents = self.get_relation_parents(term_id)
         if len(parents) < 1:
-            return [[term_id]]
-        branches = []
+            yield [term_id]
+            return
         for parent_id in parents:
-            branches += [b + [term_id] for b in self.get_ancestors(parent_id)]
-        return branches
+            for path in self.iter_ancestor_paths(parent_id):
+                yield path + [term_id]
 
     def get_parents(self, term_id):
         if term_id not in self.ont:
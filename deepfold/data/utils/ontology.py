@@ -1,10 +1,12 @@
-import math
 import os
 import pickle
-from collections import Counter, deque
+from collections import deque
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+
+from deepfold.data.utils import information_content
 
 
 # Gene Ontology based on .obo File
@@ -14,9 +16,16 @@ class Ontology(object):
                  with_rels=False,
                  include_alt_id=False):
         super().__init__()
+        self.filename = filename
+        self.include_alt_ids = include_alt_id
         self.ont, self.format_version, self.data_version = self.load(
             filename, with_rels, include_alt_id)
         self.ic = None
+        self.ic_index = None
+        self.ic_vector = None
+        self._terms = None
+        self._term_index = None
+        self._ancestor_matrix = None
 
     # ------------------------------------
     def load(self, filename, with_rels, include_alt_id):
@@ -107,18 +116,10 @@ class Ontology(object):
         return None
 
     def calculate_ic(self, annots):
-        cnt = Counter()
-        for x in annots:
-            cnt.update(x)
-        self.ic = {}
-        for go_id, n in cnt.items():
-            parents = self.get_parents(go_id)
-            if len(parents) == 0:
-                min_n = n
-            else:
-                min_n = min([cnt[x] for x in parents])
-
-            self.ic[go_id] = math.log(min_n / n, 2)
+        terms, ic = information_content.calculate_ic(self, annots)
+        self.ic_index = dict((go_id, i) for i, go_id in enumerate(terms))
+        self.ic_vector = ic
+        self.ic = dict(zip(terms, ic.tolist()))
 
     def get_ic(self, go_id):
         if self.ic is None:
@@ -143,6 +144,70 @@ class Ontology(object):
         # terms_set.remove(term_id)
         return term_set
 
+    def get_term_index(self):
+        """Integer index over every term id of the ontology.
+
+        Returns:
+            terms: numpy object array, ``terms[i]`` is the i-th term id.
+            term_index: ``{term_id: i}``.
+        """
+        if self._terms is None:
+            self._terms = np.array(list(self.ont), dtype=object)
+            self._term_index = dict(
+                (term_id, i) for i, term_id in enumerate(self._terms))
+        return self._terms, self._term_index
+
+    def ancestor_matrix(self):
+        """Sparse ``(num_terms, num_terms)`` closure of ``get_ancestors``.
+
+        Row ``i`` holds ``terms[i]`` and all of its ``is_a`` ancestors, so
+        propagating a binary ``(proteins, terms)`` annotation matrix is
+        ``annots @ ancestor_matrix()``. Built once, parents first.
+        """
+        if self._ancestor_matrix is not None:
+            return self._ancestor_matrix
+        terms, term_index = self.get_term_index()
+        closure = dict()
+        for term_id in terms:
+            stack = [term_id]
+            visiting = set()
+            while stack:
+                t_id = stack[-1]
+                if t_id in closure:
+                    stack.pop()
+                    continue
+                parents = [
+                    p_id for p_id in self.get_parents(t_id)
+                    if p_id not in closure
+                ]
+                if parents:
+                    if t_id in visiting:
+                        raise ValueError(f'Cycle in is_a through {t_id}')
+                    visiting.add(t_id)
+                    stack.extend(parents)
+                    continue
+                stack.pop()
+                ancestors = {term_index[t_id]}
+                for p_id in self.get_parents(t_id):
+                    ancestors |= closure[p_id]
+                closure[t_id] = ancestors
+        rows = np.repeat(np.arange(len(terms)),
+                         [len(closure[term_id]) for term_id in terms])
+        cols = np.fromiter(
+            (i for term_id in terms for i in closure[term_id]),
+            dtype=np.int64,
+            count=len(rows))
+        self._ancestor_matrix = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(terms), len(terms)))
+        return self._ancestor_matrix
+
+    def get_namespace_array(self):
+        """Namespace of every term, aligned with ``get_term_index``."""
+        terms, _ = self.get_term_index()
+        return np.array([self.ont[term_id]['namespace'] for term_id in terms],
+                        dtype=object)
+
     # adjustment
     def get_parents(self, term_id):
         if term_id not in self.ont:
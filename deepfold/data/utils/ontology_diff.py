@@ -0,0 +1,568 @@
+import argparse
+import logging
+import math
+import os
+import pickle
+import sys
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+from deepfold.data.utils.onto_parser import (ANCESTOR_RELATIONS, FUNC_DICT,
+                                             NAMESPACES, OntologyParser)
+from deepfold.utils.file_utils import hash_file
+from deepfold.utils.make_edges import (
+    calculate_information_contents_of_GO_terms, count_descendant_annotations,
+    find_all_ancestors, get_all_go_cnt, get_release_dir, get_release_sources,
+    invert_children, make_edges, read_go_children, statistic_terms,
+    store_counts_for_GO_terms)
+
+sys.path.append('../../../')
+
+logging.basicConfig(level=logging.INFO)
+
+
+def load_release(obo_file):
+    """Parse a GO release keeping obsolete terms and alt_ids apart."""
+    return OntologyParser(obo_file,
+                          with_rels=True,
+                          remove_obs=False,
+                          include_alt_ids=False)
+
+
+def isa_descendants(term_ids, children):
+    """``term_ids`` and all of their descendants in a children mapping."""
+    descendants = set()
+    queue = deque(term_ids)
+    while queue:
+        term_id = queue.popleft()
+        if term_id in descendants:
+            continue
+        descendants.add(term_id)
+        queue.extend(children.get(term_id, ()))
+    return descendants
+
+
+def read_release_graph(obo_file):
+    """``is_a`` children, parents and alt_ids of a release as
+    ``make_edges.read_go_children`` reads them: the alt_ids of a term are
+    children of its parents too."""
+    children, alt_id = read_go_children(obo_file)
+    return children, invert_children(children), alt_id
+
+
+def term_ic(term_roots, go_cnt, desc_counts):
+    """IC of every ``{term_id: root}`` with the formula of
+    ``make_edges.calculate_information_contents_of_GO_terms``."""
+    def freq(term_id):
+        return go_cnt.get(term_id, 0) + desc_counts.get(term_id, 0)
+
+    return dict((term_id, -math.log((freq(term_id) + 1) / (freq(root) + 1)))
+                for term_id, root in term_roots.items())
+
+
+def namespace_edges(obo_file, counts):
+    """``{namespace: [(child, parent), ...]}`` of ``make_edges`` between the
+    annotated terms."""
+    return dict((namespace, make_edges(obo_file, namespace, False,
+                                       counts.keys()))
+                for namespace in ('bpo', 'mfo', 'cco'))
+
+
+def edge_weights(edges, counts, children, ic):
+    """``{(child, parent): weight}`` of ``make_edges.get_all_go_cnt``."""
+    weights = get_all_go_cnt(edges, counts, children, ic)
+    return dict(((child, parent), weight)
+                for child, parent, weight in weights)
+
+
+class ReleaseArtifacts(object):
+    """Derived artifacts of a GO release and an annotation file, saved in
+    ``make_edges.get_release_dir``, where ``get_go_ic`` (and so
+    ``build_graph``) reads the edge weights.
+
+    Attributes:
+        sources: ``make_edges.get_release_sources`` of the obo and
+            annotation files.
+        ancestors: ``{term_id: frozenset}`` closure of every live term over
+            ``ANCESTOR_RELATIONS``.
+        counts: annotation count of every term (``statistic_terms``).
+        desc_counts: summed counts of every term and its ``is_a``
+            descendants, alt_ids included, as in ``make_edges``.
+        ic: ``calculate_information_contents_of_GO_terms``.
+        edges: ``{namespace: {(child, parent): weight}}`` of ``get_go_ic``.
+        embeddings: optional GO text embeddings, a DataFrame in the format
+            of ``extract_ontotextual_embeddings``.
+    """
+    FILES = ('sources', 'ancestors', 'counts', 'desc_counts', 'ic', 'edges')
+
+    def __init__(self, sources, ancestors, counts, desc_counts, ic, edges,
+                 embeddings=None):
+        self.sources = sources
+        self.ancestors = ancestors
+        self.counts = counts
+        self.desc_counts = desc_counts
+        self.ic = ic
+        self.edges = edges
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, obo_file, train_data_file, ontparser=None):
+        """Compute every artifact of a release from scratch."""
+        if ontparser is None:
+            ontparser = load_release(obo_file)
+        counts = statistic_terms(train_data_file)
+        live = OntologyDiff.live_terms(ontparser)
+        ancestors = dict(
+            (term_id, ontparser.get_ancestors(term_id)) for term_id in live)
+        children, parents, alt_id = read_release_graph(obo_file)
+        desc_counts = dict(
+            count_descendant_annotations(
+                store_counts_for_GO_terms(counts, alt_id), parents))
+        ic = dict(
+            calculate_information_contents_of_GO_terms(
+                counts, children, alt_id))
+        edges = dict(
+            (namespace, edge_weights(ns_edges, counts, children, ic))
+            for namespace, ns_edges in namespace_edges(obo_file,
+                                                       counts).items())
+        return cls(get_release_sources(obo_file, train_data_file), ancestors,
+                   counts, desc_counts, ic, edges)
+
+    @staticmethod
+    def exists(path):
+        return all(
+            os.path.exists(os.path.join(path, name + '.pkl'))
+            for name in ReleaseArtifacts.FILES)
+
+    @classmethod
+    def load(cls, path):
+        artifacts = dict()
+        for name in cls.FILES:
+            with open(os.path.join(path, name + '.pkl'), 'rb') as f:
+                artifacts[name] = pickle.load(f)
+        embeddings_file = os.path.join(path, 'term_embeddings.pkl')
+        if os.path.exists(embeddings_file):
+            artifacts['embeddings'] = pd.read_pickle(embeddings_file)
+        return cls(**artifacts)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        # sources last: get_go_ic trusts a directory once they are written
+        for name in self.FILES[1:] + self.FILES[:1]:
+            with open(os.path.join(path, name + '.pkl'), 'wb') as f:
+                pickle.dump(getattr(self, name), f)
+        if self.embeddings is not None:
+            self.embeddings.to_pickle(
+                os.path.join(path, 'term_embeddings.pkl'))
+
+
+def get_edges(ontparser):
+    """``(child, relation, parent)`` triples between terms of the release."""
+    return set((term_id, rel, parent_id)
+               for term_id, obj in ontparser.ont.items()
+               for rel in ANCESTOR_RELATIONS for parent_id in obj[rel]
+               if parent_id in ontparser.ont)
+
+
+class OntologyDiff(object):
+    """Differences between two GO releases.
+
+    Attributes:
+        added: live terms of the new release that are not live in the old.
+        removed: live terms of the old release that are gone from the new
+            one without being obsoleted or merged.
+        obsoleted: live terms of the old release marked obsolete in the new.
+        merged: ``{old_id: new_id}`` for old live terms that became an
+            ``alt_id`` of another live term.
+        added_edges, removed_edges: ``(child, relation, parent)`` triples.
+        changed_text: common terms whose name or definition changed.
+    """
+    def __init__(self, old_obo_file, new_obo_file):
+        self.old_obo_file = old_obo_file
+        self.new_obo_file = new_obo_file
+        self.old = load_release(old_obo_file)
+        self.new = load_release(new_obo_file)
+
+        old_live = self.live_terms(self.old)
+        new_live = self.live_terms(self.new)
+        new_alt = dict()
+        for term_id in new_live:
+            for alt_id in self.new.ont[term_id]['alt_ids']:
+                new_alt[alt_id] = term_id
+
+        self.added = new_live - old_live
+        self.merged = dict((term_id, new_alt[term_id])
+                           for term_id in old_live - new_live
+                           if term_id in new_alt)
+        self.obsoleted = set(
+            term_id for term_id in old_live - new_live
+            if term_id in self.new.ont and term_id not in self.merged)
+        self.removed = old_live - new_live - self.obsoleted - set(
+            self.merged)
+
+        old_edges = get_edges(self.old)
+        new_edges = get_edges(self.new)
+        self.added_edges = new_edges - old_edges
+        self.removed_edges = old_edges - new_edges
+
+        self.changed_text = set(
+            term_id for term_id in old_live & new_live
+            if (self.old.ont[term_id].get('name'),
+                self.old.ont[term_id].get('def')) != (
+                    self.new.ont[term_id].get('name'),
+                    self.new.ont[term_id].get('def')))
+
+    @staticmethod
+    def live_terms(ontparser):
+        return set(term_id for term_id, obj in ontparser.ont.items()
+                   if not obj['is_obsolete'])
+
+    def summary(self):
+        return {
+            'added': len(self.added),
+            'removed': len(self.removed),
+            'obsoleted': len(self.obsoleted),
+            'merged': len(self.merged),
+            'added_edges': len(self.added_edges),
+            'removed_edges': len(self.removed_edges),
+            'changed_text': len(self.changed_text)
+        }
+
+    def map_term(self, term_id):
+        """Id of an old-release term in the new release, None if dropped."""
+        if term_id in self.merged:
+            return self.merged[term_id]
+        if term_id in self.new.ont and not self.new.ont[term_id][
+                'is_obsolete']:
+            return term_id
+        return None
+
+    def affected_terms(self):
+        """New-release terms whose ancestor closure may differ from the old
+        release: added terms, children of added or removed edges, and all of
+        their descendants."""
+        children = defaultdict(set)
+        for term_id in self.new.ont:
+            for parent_id in self.new.get_relation_parents(term_id):
+                children[parent_id].add(term_id)
+
+        seeds = set(self.added)
+        seeds |= set(child for child, _, _ in self.added_edges)
+        seeds |= set(child for child, _, _ in self.removed_edges)
+        affected = set()
+        queue = deque(term_id for term_id in seeds if term_id in self.new.ont)
+        while queue:
+            term_id = queue.popleft()
+            if term_id in affected:
+                continue
+            affected.add(term_id)
+            queue.extend(children[term_id])
+        return affected
+
+    def update_ancestors(self, old_ancestors):
+        """Ancestor closures of the new release, reusing old ones.
+
+        Args:
+            old_ancestors: ``{term_id: ancestors}`` of the old release, e.g.
+                ``ReleaseArtifacts.ancestors``.
+
+        Returns:
+            ``{term_id: frozenset}`` for every live term of the new release.
+        """
+        affected = self.affected_terms()
+        for term_id, ancestors in old_ancestors.items():
+            if term_id in self.new.ont and term_id not in affected:
+                self.new._ancestors[term_id] = frozenset(ancestors)
+        return dict((term_id, self.new.get_ancestors(term_id))
+                    for term_id in self.live_terms(self.new))
+
+    def update_artifacts(self, old, train_data_file):
+        """Artifacts of the new release, recomputing only what changed.
+
+        Closures are recomputed for ``affected_terms()``. Descendant counts
+        are corrected for the terms whose count or ``is_a`` closure changed
+        in the ``make_edges`` graph: their old contribution is removed from
+        their old ancestors and the new one added to their new ancestors.
+        ICs are recomputed for the terms whose frequency or closure changed,
+        or for every term when a root frequency changed. Edge weights are
+        recomputed for the edges touching a term whose count or IC changed,
+        or whose parent lost, gained or reordered children.
+
+        Args:
+            old: ``ReleaseArtifacts`` of the old release.
+            train_data_file: annotations counted for the new release.
+
+        Returns:
+            ``ReleaseArtifacts`` of the new release and the number of
+            recomputed rows of every artifact.
+        """
+        affected = self.affected_terms()
+        new_live = self.live_terms(self.new)
+        ancestors = self.update_ancestors(old.ancestors)
+        counts = statistic_terms(train_data_file)
+
+        old_children, old_parents, old_alt_id = read_release_graph(
+            self.old_obo_file)
+        children, parents, alt_id = read_release_graph(self.new_obo_file)
+        old_go_cnt = store_counts_for_GO_terms(old.counts, old_alt_id)
+        go_cnt = store_counts_for_GO_terms(counts, alt_id)
+        changed_counts = set(
+            term_id for term_id in set(old_go_cnt) | set(go_cnt)
+            if old_go_cnt.get(term_id, 0) != go_cnt.get(term_id, 0))
+        # closures change below the terms whose parents changed
+        relinked = set(
+            term_id for term_id in set(old_parents) | set(parents)
+            if old_parents.get(term_id) != parents.get(term_id))
+        moved = isa_descendants(relinked, old_children) | isa_descendants(
+            relinked, children)
+
+        desc_counts = dict(old.desc_counts)
+        touched = set()
+        old_memo, memo = dict(), dict()
+        for term_id in (moved | changed_counts) & (set(old_go_cnt)
+                                                   | set(go_cnt)):
+            for ancestor in find_all_ancestors(term_id, old_parents,
+                                               old_memo):
+                desc_counts[ancestor] = desc_counts.get(
+                    ancestor, 0) - old_go_cnt.get(term_id, 0)
+                touched.add(ancestor)
+            for ancestor in find_all_ancestors(term_id, parents, memo):
+                desc_counts[ancestor] = desc_counts.get(
+                    ancestor, 0) + go_cnt.get(term_id, 0)
+                touched.add(ancestor)
+        desc_counts = dict((term_id, cnt)
+                           for term_id, cnt in desc_counts.items() if cnt)
+
+        changed_freq = changed_counts | set(
+            term_id for term_id in touched
+            if old.desc_counts.get(term_id, 0) != desc_counts.get(term_id, 0))
+        roots = set(FUNC_DICT[ont] for ont in NAMESPACES)
+        if roots & changed_freq:
+            # every IC of a namespace is relative to its root frequency
+            ic = dict(
+                calculate_information_contents_of_GO_terms(
+                    counts, children, alt_id))
+            stale_ic = set(ic)
+        else:
+            term_roots = dict()
+            for term_id in moved | changed_freq:
+                term_id_roots = roots & find_all_ancestors(
+                    term_id, parents, memo)
+                if term_id_roots:
+                    term_roots[term_id] = term_id_roots.pop()
+            ic = dict((term_id, value) for term_id, value in old.ic.items()
+                      if term_id not in moved)
+            ic.update(term_ic(term_roots, go_cnt, desc_counts))
+            stale_ic = set(term_roots)
+
+        changed_ic = set(term_id
+                         for term_id in stale_ic | (set(old.ic) - set(ic))
+                         if old.ic.get(term_id) != ic.get(term_id))
+        # a parent weight sums the IC of all of its children, in order
+        stale_parents = set(
+            parent_id
+            for parent_id in set(old_children) | set(children)
+            if old_children.get(parent_id) != children.get(parent_id))
+        for term_id in changed_ic:
+            stale_parents |= parents.get(term_id, set())
+        changed_raw_counts = set(
+            term_id for term_id in set(old.counts) | set(counts)
+            if old.counts.get(term_id, 0) != counts.get(term_id, 0))
+        stale_terms = changed_ic | changed_raw_counts
+        edges, num_stale_edges = dict(), 0
+        for namespace, ns_edges in namespace_edges(self.new_obo_file,
+                                                   counts).items():
+            old_weights = old.edges.get(namespace, dict())
+            weights, stale_edges = dict(), []
+            for edge in ns_edges:
+                child, parent = edge
+                if (edge in old_weights and child not in stale_terms
+                        and parent not in stale_terms
+                        and parent not in stale_parents):
+                    weights[edge] = old_weights[edge]
+                else:
+                    stale_edges.append(edge)
+            weights.update(edge_weights(stale_edges, counts, children, ic))
+            edges[namespace] = weights
+            num_stale_edges += len(stale_edges)
+
+        artifacts = ReleaseArtifacts(
+            get_release_sources(self.new_obo_file, train_data_file),
+            ancestors, counts, desc_counts, ic, edges)
+        if old.embeddings is not None:
+            artifacts.embeddings = self.update_embeddings(old.embeddings)
+        recomputed = {
+            'ancestors': len(affected & new_live),
+            'desc_counts': len(touched),
+            'ic': len(stale_ic),
+            'edges': num_stale_edges
+        }
+        if artifacts.embeddings is not None:
+            recomputed['embeddings'] = len(new_live) - len(
+                artifacts.embeddings)
+        return artifacts, recomputed
+
+    def update_embeddings(self, embeddings):
+        """Carry GO text embeddings over to the new release.
+
+        Only the rows of live terms whose text did not change are kept, the
+        missing ones are computed by ``extract_ontotextual_embeddings`` with
+        this table as ``--previous_embedding_file``.
+        """
+        # rows of merged ids embed the text of the old term, drop them
+        embeddings = embeddings[[
+            self.map_term(term_id) == term_id
+            for term_id in embeddings['term']
+        ]]
+        new_terms, rows, stale = self.update_rows(
+            list(embeddings['term']),
+            np.stack(embeddings['embeddings'].apply(np.asarray).values),
+            reuse_changed_text=False)
+        keep = ~stale
+        new_terms = [term_id for term_id, k in zip(new_terms, keep) if k]
+        objs = [self.new.ont[term_id] for term_id in new_terms]
+        return pd.DataFrame({
+            'term': new_terms,
+            'name': [obj.get('name') for obj in objs],
+            'namespace': [obj.get('namespace') for obj in objs],
+            'deftext': [obj.get('def') for obj in objs],
+            'embeddings': list(rows[keep])
+        })
+
+    def update_terms(self, old_terms):
+        """Carry a label index (e.g. ``terms.pkl``) over to the new release.
+
+        Surviving terms keep their relative order, merged terms are renamed
+        and de-duplicated, dropped terms are removed.
+
+        Returns:
+            new_terms: list of term ids.
+            index_map: int64 array, ``index_map[i]`` is the new index of
+                ``old_terms[i]`` or -1 when the term was dropped. Rows of
+                label-indexed artifacts (classifier weights, embeddings) can
+                be reused with it.
+        """
+        new_terms = []
+        new_index = dict()
+        index_map = np.full(len(old_terms), -1, dtype=np.int64)
+        for i, term_id in enumerate(old_terms):
+            new_id = self.map_term(term_id)
+            if new_id is None:
+                continue
+            if new_id not in new_index:
+                new_index[new_id] = len(new_terms)
+                new_terms.append(new_id)
+            index_map[i] = new_index[new_id]
+        return new_terms, index_map
+
+    def update_rows(self, old_terms, rows, reuse_changed_text=True):
+        """Reuse the rows of a term-indexed matrix for the new release.
+
+        Returns the new term list, the carried over rows and a boolean mask
+        of the rows that still have to be recomputed (terms whose text
+        changed when ``reuse_changed_text`` is False).
+        """
+        new_terms, index_map = self.update_terms(old_terms)
+        rows = np.asarray(rows)
+        new_rows = np.zeros((len(new_terms), ) + rows.shape[1:],
+                            dtype=rows.dtype)
+        # the first old row wins when several old terms were merged
+        targets, first = np.unique(index_map, return_index=True)
+        keep = targets >= 0
+        new_rows[targets[keep]] = rows[first[keep]]
+        stale = np.zeros(len(new_terms), dtype=bool)
+        if not reuse_changed_text:
+            stale = np.array([term_id in self.changed_text
+                              for term_id in new_terms],
+                             dtype=bool)
+        return new_terms, new_rows, stale
+
+
+parser = argparse.ArgumentParser(
+    description='Diff two GO releases and carry derived artifacts over')
+parser.add_argument('--old-go-file',
+                    '-ogf',
+                    default='data/go_old.obo',
+                    help='Previous Gene Ontology file in OBO Format')
+parser.add_argument('--new-go-file',
+                    '-ngf',
+                    default='data/go.obo',
+                    help='New Gene Ontology file in OBO Format')
+parser.add_argument('--train-data-file',
+                    '-trdf',
+                    default=None,
+                    help='Data file with the annotations counted for the IC '
+                    'table and the adjacency, e.g. bpo/bpo_train_data.pkl. '
+                    'The artifacts of the new release are written next to '
+                    'its obo file, where get_go_ic reads the edge weights')
+parser.add_argument('--embedding-file',
+                    '-ef',
+                    default=None,
+                    help='GO text embeddings of the previous release, when '
+                    'they are not part of its artifacts yet')
+parser.add_argument('--terms-file',
+                    '-tf',
+                    default=None,
+                    help='terms.pkl of the previous release')
+parser.add_argument('--out-terms-file',
+                    '-otf',
+                    default=None,
+                    help='terms.pkl for the new release, the old -> new '
+                    'index map is saved next to it as .index_map.npy')
+
+
+def main(old_go_file,
+         new_go_file,
+         terms_file=None,
+         out_terms_file=None,
+         train_data_file=None,
+         embedding_file=None):
+    diff = OntologyDiff(old_go_file, new_go_file)
+    for key, val in diff.summary().items():
+        logging.info('%s: %d' % (key, val))
+    logging.info('Terms with a possibly changed ancestor closure: %d' %
+                 len(diff.affected_terms()))
+
+    if train_data_file is not None:
+        old_dir = get_release_dir(old_go_file, train_data_file)
+        old = None
+        if ReleaseArtifacts.exists(old_dir):
+            old = ReleaseArtifacts.load(old_dir)
+            if old.sources['go_file'] != hash_file(old_go_file):
+                logging.info('%s was computed from another obo file' %
+                             old_dir)
+                old = None
+        if old is None:
+            logging.info('Building the artifacts of %s in %s' %
+                         (old_go_file, old_dir))
+            old = ReleaseArtifacts.build(old_go_file, train_data_file,
+                                         diff.old)
+            old.save(old_dir)
+        if embedding_file is not None:
+            old.embeddings = pd.read_pickle(embedding_file)
+        new, recomputed = diff.update_artifacts(old, train_data_file)
+        new_dir = get_release_dir(new_go_file, train_data_file)
+        new.save(new_dir)
+        for key, val in recomputed.items():
+            logging.info('Recomputed %s rows: %d' % (key, val))
+        logging.info('Saved the artifacts of the new release to %s' %
+                     new_dir)
+
+    if terms_file is not None and out_terms_file is not None:
+        terms_df = pd.read_pickle(terms_file)
+        new_terms, index_map = diff.update_terms(list(terms_df['terms']))
+        pd.DataFrame({'terms': new_terms}).to_pickle(out_terms_file)
+        index_map_file = os.path.splitext(out_terms_file)[0] + \
+            '.index_map.npy'
+        np.save(index_map_file, index_map)
+        logging.info('Kept %d of %d terms, saved to %s and %s' %
+                     (len(new_terms), len(index_map), out_terms_file,
+                      index_map_file))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.old_go_file, args.new_go_file, args.terms_file,
+         args.out_terms_file, args.train_data_file, args.embedding_file)
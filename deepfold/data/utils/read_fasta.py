@@ -1,5 +1,6 @@
 import pandas as pd
-from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+from deepfold.data.utils.fasta import iter_fasta
 
 
 def read_fasta(file_path):
@@ -11,25 +12,24 @@ def read_fasta(file_path):
     _is_train_ : Indicates whether the record be used for training or test. Will be used to seperate the dataset for traning and validation.
     """
 
-    with open(file_path) as fasta_file:  # Will close handle cleanly
-        records = []
-        for title, sequence in SimpleFastaParser(fasta_file):
-            record = []
-            title_splits = title.split(None)
-            record.append(title_splits[0])  # First word is ID
-            sequence = ' '.join(sequence)
-            record.append(sequence)
-            record.append(len(sequence))
-            location_splits = title_splits[1].split('-')
-            record.append(location_splits[0])  # Second word is Location
-            record.append(location_splits[1])  # Second word is Membrane
-
-            if (len(title_splits) > 2):
-                record.append(0)
-            else:
-                record.append(1)
-
-            records.append(record)
+    records = []
+    for title, sequence in iter_fasta(file_path):
+        record = []
+        title_splits = title.split(None)
+        record.append(title_splits[0])  # First word is ID
+        sequence = ' '.join(sequence)
+        record.append(sequence)
+        record.append(len(sequence))
+        location_splits = title_splits[1].split('-')
+        record.append(location_splits[0])  # Second word is Location
+        record.append(location_splits[1])  # Second word is Membrane
+
+        if (len(title_splits) > 2):
+            record.append(0)
+        else:
+            record.append(1)
+
+        records.append(record)
     columns = [
         'id', 'sequence', 'sequence_length', 'location', 'membrane', 'is_train'
     ]
@@ -3,6 +3,8 @@ from collections import defaultdict
 
 import numpy
 
+from deepfold.core.evaluation.cafa import open_text, write_triples
+
 from .embedding_lookup import EmbeddingLookup
 
 
@@ -229,10 +231,5 @@ class FunctionPrediction(object):
         :param out_file: output file
         :return:
         """
-        with open(out_file, 'w') as out:
-            for p in predictions.keys():
-                prediction = predictions[p]
-                for pred in prediction.keys():
-                    ri = prediction[pred]
-                    out.write('{}\t{}\t'.format(p, pred))
-                    out.write('{:0.2f}\n'.format(float(ri)))
+        with open_text(out_file, 'wt') as out:
+            write_triples(out, predictions, min_score=None, sort=False)
@@ -15,8 +15,20 @@ class Word2vecLoss(nn.Module):
 
 
 class GoEmbedder(nn.Module):
-    def __init__(self, vocab_size, embed_size, dropout=0.0) -> None:
+    """Anc2vec-style GO term embedder.
+
+    With ``num_negatives`` set, the term and neighbor heads are trained with
+    a sampled softmax over ``num_negatives`` uniformly drawn terms shared by
+    the batch instead of a full ``vocab_size``-wide softmax. Evaluation
+    always uses the full softmax.
+    """
+    def __init__(self,
+                 vocab_size,
+                 embed_size,
+                 dropout=0.0,
+                 num_negatives=None) -> None:
         super().__init__()
+        self.num_negatives = num_negatives
 
         self.embedding = nn.Embedding(vocab_size, embed_size)
         self.fc1 = nn.Linear(embed_size, vocab_size)
@@ -51,21 +63,42 @@ class GoEmbedder(nn.Module):
         """forward."""
         embed = self.embedding(term_ids)
         hidden = self.activate(embed)
-        out1 = self.fc1(hidden)
-        out2 = self.fc2(hidden)
         out3 = self.fc3(hidden)
-        # term
-        log_probs_term = F.log_softmax(out1, dim=1)
-        # neighbor
-        log_probs_neighbor = F.log_softmax(out2, dim=1)
+        if self.num_negatives and self.training:
+            loss_term = self.sampled_nll_loss(hidden, self.fc1, term_ids)
+            loss_neighbor = self.sampled_nll_loss(hidden, self.fc2,
+                                                  neighbor_ids)
+        else:
+            out1 = self.fc1(hidden)
+            out2 = self.fc2(hidden)
+            # term
+            log_probs_term = F.log_softmax(out1, dim=1)
+            # neighbor
+            log_probs_neighbor = F.log_softmax(out2, dim=1)
 
-        # loss
-        loss_term = self.nll_loss(log_probs_term, term_ids)
-        loss_neighbor = self.nll_loss(log_probs_neighbor, neighbor_ids)
+            # loss
+            loss_term = self.nll_loss(log_probs_term, term_ids)
+            loss_neighbor = self.nll_loss(log_probs_neighbor, neighbor_ids)
         # three sub module
         loss_namespace = F.cross_entropy(out3, labels)
         return loss_term, loss_neighbor, loss_namespace
 
+    def sampled_nll_loss(self, hidden, fc, targets):
+        """Sampled softmax estimate of ``nll_loss(log_softmax(fc(hidden)))``.
+
+        Negatives that happen to equal the target of a row are masked out.
+        """
+        negatives = torch.randint(0,
+                                  fc.out_features, (self.num_negatives, ),
+                                  device=hidden.device)
+        true_logits = (hidden * fc.weight[targets]).sum(-1) + fc.bias[targets]
+        neg_logits = F.linear(hidden, fc.weight[negatives], fc.bias[negatives])
+        neg_logits = neg_logits.masked_fill(
+            negatives.unsqueeze(0) == targets.unsqueeze(1), float('-inf'))
+        logits = torch.cat([true_logits.unsqueeze(1), neg_logits], dim=1)
+        zeros = torch.zeros_like(targets)
+        return F.cross_entropy(logits, zeros)
+
     def init_weights(self):
         for name, param in self.named_parameters():
             if 'embedding' not in name:
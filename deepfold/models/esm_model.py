@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 from torch.nn import BCEWithLogitsLoss
 
+from deepfold.models.layers.hierarchy import LabelHierarchy
 from deepfold.models.layers.transformer_represention import (
     AttentionPooling, AttentionPooling2, CNNPooler, LSTMPooling,
     SelfAttentionPooling, WeightedLayerPooling)
@@ -51,6 +52,7 @@ class MLPWithHierarchicalRegularization(nn.Module):
                  dropout_ratio=0.1):
         super().__init__()
         self.edges = edges
+        self.hierarchy = LabelHierarchy(edges, num_labels)
         self.hidden_size = input_size * 2
         self.num_labels = num_labels
         self.fc1 = nn.Linear(input_size, self.hidden_size)
@@ -77,20 +79,8 @@ class MLPWithHierarchicalRegularization(nn.Module):
         return outputs
 
     def hierarchical_loss(self, preds):
-        ind_fa = torch.LongTensor(self.edges.transpose()[0])
-        ind_child = torch.LongTensor(self.edges.transpose()[1])
-        ind_fa = ind_fa.to(preds.device)
-        ind_child = ind_child.to(preds.device)
-        r1_fa = torch.gather(preds,
-                             dim=1,
-                             index=ind_fa.unsqueeze(0).repeat(
-                                 (preds.shape[0], 1)))
-        r1_child = torch.gather(preds,
-                                dim=1,
-                                index=ind_child.unsqueeze(0).repeat(
-                                    (preds.shape[0], 1)))
-        loss = torch.relu(r1_fa - r1_child).mean()
-        return loss
+        # edges are (child, parent) pairs, penalize child > parent
+        return self.hierarchy.violation_loss(preds)
 
 
 class MLPLayer(nn.Module):
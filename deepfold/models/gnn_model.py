@@ -4,15 +4,37 @@ import torch.nn.functional as F
 
 
 class Embedder(nn.Module):
+    """Project multi-hot node features to ``hidden_dimension``.
+
+    Sparse COO inputs are reduced with ``F.embedding_bag`` over the non-zero
+    columns of each row, so the dense ``N x N`` feature matrix is never
+    materialized. The parameters are shared with the dense path.
+    """
     def __init__(self, go_size, hidden_dimension):
         super().__init__()
         self.embed = nn.Linear(go_size, hidden_dimension)
 
     def forward(self, x):
-        node_feature = self.embed(x)
+        if x.is_sparse:
+            node_feature = self.sparse_embed(x)
+        else:
+            node_feature = self.embed(x)
         node_feature = F.normalize(node_feature)
         return node_feature
 
+    def sparse_embed(self, x):
+        x = x.coalesce()
+        rows, cols = x.indices()
+        counts = torch.bincount(rows, minlength=x.shape[0])
+        offsets = torch.zeros_like(counts)
+        offsets[1:] = torch.cumsum(counts, dim=0)[:-1]
+        output = F.embedding_bag(cols,
+                                 self.embed.weight.t(),
+                                 offsets,
+                                 mode='sum',
+                                 per_sample_weights=x.values())
+        return output + self.embed.bias
+
 
 class GraphConvolution(nn.Module):
     """Simple GCN layer, similar to https://arxiv.org/abs/1609.02907."""
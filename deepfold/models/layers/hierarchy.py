@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def longest_path_levels(src, dst, num_nodes):
+    """Level of every node in a DAG given as ``src -> dst`` index arrays.
+
+    Nodes without incoming edges are on level 0 and every edge goes from a
+    lower to a strictly higher level (longest-path layering).
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    indegree = np.bincount(dst, minlength=num_nodes)
+    levels = np.full(num_nodes, -1, dtype=np.int64)
+    frontier = indegree == 0
+    level = 0
+    while frontier.any():
+        levels[frontier] = level
+        indegree = indegree - np.bincount(dst[frontier[src]],
+                                          minlength=num_nodes)
+        frontier = (indegree == 0) & (levels < 0)
+        level += 1
+    if (levels < 0).any():
+        raise ValueError('The label hierarchy contains a cycle.')
+    return levels
+
+
+def _sort_edges_by_level(child, parent, levels):
+    order = np.argsort(levels, kind='stable')
+    splits = np.searchsorted(levels[order],
+                             np.arange(levels.max() + 2 if len(levels) else 1))
+    return child[order], parent[order], splits.tolist()
+
+
+class LabelHierarchy(nn.Module):
+    """Child -> parent edges of a label hierarchy (e.g. GO ``is_a``).
+
+    ``edges`` holds ``(child, parent)`` label indices, as produced by
+    ``make_edges``. The indices are registered once as (non persistent)
+    buffers so they follow the module across devices without being
+    rebuilt on every step.
+
+    Args:
+        edges: array-like of shape ``(num_edges, 2)``.
+        num_labels: number of labels (nodes) in the hierarchy.
+    """
+    def __init__(self, edges, num_labels):
+        super().__init__()
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        child, parent = edges[:, 0], edges[:, 1]
+        self.num_labels = num_labels
+
+        self.register_buffer('edge_index',
+                             torch.from_numpy(np.concatenate([child,
+                                                              parent])),
+                             persistent=False)
+
+        # max-propagation: update parents bottom-up, grouped by the height of
+        # the parent so that all of its children are final
+        height = longest_path_levels(child, parent, num_labels)
+        c, p, self.max_splits = _sort_edges_by_level(child, parent,
+                                                     height[parent])
+        self.register_buffer('max_child', torch.from_numpy(c),
+                             persistent=False)
+        self.register_buffer('max_parent', torch.from_numpy(p),
+                             persistent=False)
+
+        # min-propagation: update children top-down, grouped by the depth of
+        # the child so that all of its parents are final
+        depth = longest_path_levels(parent, child, num_labels)
+        c, p, self.min_splits = _sort_edges_by_level(child, parent,
+                                                     depth[child])
+        self.register_buffer('min_child', torch.from_numpy(c),
+                             persistent=False)
+        self.register_buffer('min_parent', torch.from_numpy(p),
+                             persistent=False)
+
+    def violation_loss(self, preds):
+        """Mean of ``relu(child - parent)`` over the batch and all edges."""
+        pairs = preds.index_select(1, self.edge_index)
+        pairs = pairs.view(preds.shape[0], 2, -1)
+        return torch.relu(pairs[:, 0] - pairs[:, 1]).mean()
+
+    def forward(self, preds):
+        return self.violation_loss(preds)
+
+    @torch.no_grad()
+    def propagate(self, scores, mode='max', chunk_size=65536):
+        """Enforce the true-path rule (child <= parent) on ``scores``.
+
+        ``mode='max'`` raises every term to the max over its descendants,
+        ``mode='min'`` lowers every term to the min over its ancestors. Rows
+        are processed ``chunk_size`` at a time; numpy inputs are returned as
+        numpy arrays.
+
+        Args:
+            scores: ``(num_samples, num_labels)`` tensor or ndarray.
+        """
+        if mode == 'max':
+            child, parent, splits = (self.max_child, self.max_parent,
+                                     self.max_splits)
+        elif mode == 'min':
+            child, parent, splits = (self.min_child, self.min_parent,
+                                     self.min_splits)
+        else:
+            raise ValueError(f"mode must be 'max' or 'min', got '{mode}'")
+
+        is_numpy = isinstance(scores, np.ndarray)
+        if is_numpy:
+            scores = torch.from_numpy(scores)
+        scores = scores.clone()
+        child = child.to(scores.device)
+        parent = parent.to(scores.device)
+
+        for start in range(0, scores.shape[0], chunk_size):
+            chunk = scores[start:start + chunk_size]
+            for lo, hi in zip(splits[:-1], splits[1:]):
+                if lo == hi:
+                    continue
+                c, p = child[lo:hi], parent[lo:hi]
+                if mode == 'max':
+                    chunk.scatter_reduce_(1,
+                                          p.unsqueeze(0).expand(
+                                              chunk.shape[0], -1),
+                                          chunk.index_select(1, c),
+                                          reduce='amax')
+                else:
+                    chunk.scatter_reduce_(1,
+                                          c.unsqueeze(0).expand(
+                                              chunk.shape[0], -1),
+                                          chunk.index_select(1, p),
+                                          reduce='amin')
+
+        if is_numpy:
+            return scores.numpy()
+        return scores
@@ -3,6 +3,8 @@ import typing
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import (PackedSequence, pack_padded_sequence,
+                                pad_packed_sequence)
 
 from .utils.modeling_utils import (PairwiseContactPredictionHead,
                                    ProteinConfig, ProteinModel,
@@ -48,7 +50,10 @@ class ProteinLSTMLayer(nn.Module):
         self.lstm = nn.LSTM(input_size, hidden_size, batch_first=True)
 
     def forward(self, inputs):
-        inputs = self.dropout(inputs)
+        if isinstance(inputs, PackedSequence):
+            inputs = inputs._replace(data=self.dropout(inputs.data))
+        else:
+            inputs = self.dropout(inputs)
         self.lstm.flatten_parameters()
         return self.lstm(inputs)
 
@@ -90,22 +95,43 @@ class ProteinLSTMEncoder(nn.Module):
         self.output_hidden_states = config.output_hidden_states
 
     def forward(self, inputs, input_mask=None):
+        """Run both directions over packed sequences.
+
+        Padding timesteps are skipped, so the pooled states are the LSTM
+        states at the last real residue of every sequence and the cost
+        scales with the real sequence lengths.
+        """
+        batch_size, total_length = inputs.shape[:2]
+        if input_mask is None:
+            lengths = torch.full((batch_size, ),
+                                 total_length,
+                                 dtype=torch.long,
+                                 device=inputs.device)
+        else:
+            lengths = input_mask.sum(1).long().clamp(min=1)
+
         all_forward_pooled = ()
         all_reverse_pooled = ()
         all_hidden_states = (inputs, )
-        forward_output = inputs
+        forward_output = self.pack(inputs, lengths)
         for layer in self.forward_lstm:
             forward_output, forward_pooled = layer(forward_output)
             all_forward_pooled = all_forward_pooled + (forward_pooled[0], )
-            all_hidden_states = all_hidden_states + (forward_output, )
+            if self.output_hidden_states:
+                all_hidden_states = all_hidden_states + (self.unpack(
+                    forward_output, total_length), )
 
-        reversed_sequence = self.reverse_sequence(inputs, input_mask)
-        reverse_output = reversed_sequence
+        reversed_sequence = self.reverse_sequence(inputs, lengths)
+        reverse_output = self.pack(reversed_sequence, lengths)
         for layer in self.reverse_lstm:
             reverse_output, reverse_pooled = layer(reverse_output)
             all_reverse_pooled = all_reverse_pooled + (reverse_pooled[0], )
-            all_hidden_states = all_hidden_states + (reverse_output, )
-        reverse_output = self.reverse_sequence(reverse_output, input_mask)
+            if self.output_hidden_states:
+                all_hidden_states = all_hidden_states + (self.unpack(
+                    reverse_output, total_length), )
+        forward_output = self.unpack(forward_output, total_length)
+        reverse_output = self.reverse_sequence(
+            self.unpack(reverse_output, total_length), lengths)
 
         output = torch.cat((forward_output, reverse_output), dim=2)
         pooled = all_forward_pooled + all_reverse_pooled
@@ -116,22 +142,29 @@ class ProteinLSTMEncoder(nn.Module):
 
         return outputs  # sequence_embedding, pooled_embedding, (hidden_states)
 
-    def reverse_sequence(self, sequence, input_mask):
-        if input_mask is None:
-            idx = torch.arange(sequence.size(1) - 1, -1, -1)
-            reversed_sequence = sequence.index_select(1,
-                                                      idx,
-                                                      device=sequence.device)
-        else:
-            sequence_lengths = input_mask.sum(1)
-            reversed_sequence = []
-            for seq, seqlen in zip(sequence, sequence_lengths):
-                idx = torch.arange(seqlen - 1, -1, -1, device=seq.device)
-                seq = seq.index_select(0, idx)
-                seq = F.pad(seq, [0, 0, 0, sequence.size(1) - seqlen])
-                reversed_sequence.append(seq)
-            reversed_sequence = torch.stack(reversed_sequence, 0)
-        return reversed_sequence
+    @staticmethod
+    def pack(sequence, lengths):
+        return pack_padded_sequence(sequence,
+                                    lengths.cpu(),
+                                    batch_first=True,
+                                    enforce_sorted=False)
+
+    @staticmethod
+    def unpack(packed_sequence, total_length):
+        sequence, _ = pad_packed_sequence(packed_sequence,
+                                          batch_first=True,
+                                          total_length=total_length)
+        return sequence
+
+    def reverse_sequence(self, sequence, lengths):
+        """Reverse the first ``lengths[i]`` steps of every sequence with a
+        single gather; padding steps are left in place."""
+        steps = torch.arange(sequence.size(1),
+                             device=sequence.device).unsqueeze(0)
+        lengths = lengths.to(sequence.device).unsqueeze(1)
+        idx = torch.where(steps < lengths, lengths - 1 - steps, steps)
+        idx = idx.unsqueeze(-1).expand_as(sequence)
+        return sequence.gather(1, idx)
 
 
 class ProteinLSTMAbstractModel(ProteinModel):
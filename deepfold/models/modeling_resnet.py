@@ -3,6 +3,7 @@ import typing
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from ..utils.registry import registry
 from .utils.modeling_utils import (MLMHead, PairwiseContactPredictionHead,
@@ -45,6 +46,26 @@ class MaskedConv1d(nn.Conv1d):
             x = x * input_mask
         return super().forward(x)
 
+    def forward_channels_last(self, x, input_mask=None):
+        """Same convolution on ``(batch, length, channels)`` inputs, computed
+        as a single im2col matmul so no transposes are needed."""
+        assert self.stride == (1, ) and self.groups == 1
+        if input_mask is not None:
+            x = x * input_mask
+        kernel_size = self.kernel_size[0]
+        dilation = self.dilation[0]
+        padding = self.padding[0]
+        span = dilation * (kernel_size - 1) + 1
+        x = F.pad(x, [0, 0, padding, padding])
+        # (batch, length, in_channels, kernel_size)
+        columns = x.unfold(1, span, 1)[..., ::dilation]
+        columns = columns.reshape(columns.size(0), columns.size(1), -1)
+        weight = self.weight.reshape(self.out_channels, -1)
+        out = torch.matmul(columns, weight.t())
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
 
 class ProteinResNetLayerNorm(nn.Module):
     def __init__(self, config):
@@ -54,6 +75,9 @@ class ProteinResNetLayerNorm(nn.Module):
     def forward(self, x):
         return self.norm(x.transpose(1, 2)).transpose(1, 2)
 
+    def forward_channels_last(self, x):
+        return self.norm(x)
+
 
 class ProteinResNetBlock(nn.Module):
     def __init__(self, config):
@@ -89,6 +113,21 @@ class ProteinResNetBlock(nn.Module):
 
         return out
 
+    def forward_channels_last(self, x, input_mask=None):
+        identity = x
+
+        out = self.conv1.forward_channels_last(x, input_mask)
+        out = self.layernorm1.forward_channels_last(out)
+        out = self.activation_fn(out)
+
+        out = self.conv2.forward_channels_last(out, input_mask)
+        out = self.layernorm2.forward_channels_last(out)
+
+        out += identity
+        out = self.activation_fn(out)
+
+        return out
+
 
 class ProteinResNetEmbeddings(nn.Module):
     """Construct the embeddings from word, position and token_type
@@ -105,20 +144,25 @@ class ProteinResNetEmbeddings(nn.Module):
 
         self.layer_norm = nn.LayerNorm(embed_dim, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        self._position_table = None
+
+    def forward(self, input_ids, seq_length=None, start=0):
+        """Embed ``input_ids``.
 
-    def forward(self, input_ids):
+        Positions count down to 0 at the end of the sequence. When
+        ``input_ids`` is a window ``[start, start + input_ids.size(1))`` of a
+        longer sequence, ``seq_length`` is the length of that sequence.
+        """
         words_embeddings = self.word_embeddings(input_ids)
 
-        seq_length = input_ids.size(1)
-        position_ids = torch.arange(seq_length - 1,
-                                    -1,
-                                    -1.0,
-                                    dtype=words_embeddings.dtype,
-                                    device=words_embeddings.device)
-        sinusoidal_input = torch.ger(position_ids, self.inverse_frequency)
-        position_embeddings = torch.cat(
-            [sinusoidal_input.sin(),
-             sinusoidal_input.cos()], -1)
+        if seq_length is None:
+            seq_length = input_ids.size(1)
+        position_embeddings = self.position_embeddings(
+            seq_length,
+            dtype=words_embeddings.dtype,
+            device=words_embeddings.device,
+            start=start,
+            end=start + input_ids.size(1))
         position_embeddings = position_embeddings.unsqueeze(0)
 
         embeddings = words_embeddings + position_embeddings
@@ -126,6 +170,37 @@ class ProteinResNetEmbeddings(nn.Module):
         embeddings = self.dropout(embeddings)
         return embeddings
 
+    def position_embeddings(self,
+                            seq_length,
+                            dtype,
+                            device,
+                            start=0,
+                            end=None):
+        """Sinusoidal embeddings of positions ``seq_length - 1 - start`` down
+        to ``seq_length - end``.
+
+        The table is stored in descending position order and cached per
+        dtype/device, so every call is a slice of it; it is only rebuilt when
+        a longer sequence arrives.
+        """
+        if end is None:
+            end = seq_length
+        table = self._position_table
+        if (table is None or table.size(0) < seq_length
+                or table.dtype != dtype or table.device != device):
+            position_ids = torch.arange(seq_length - 1,
+                                        -1,
+                                        -1.0,
+                                        dtype=dtype,
+                                        device=device)
+            sinusoidal_input = torch.ger(position_ids, self.inverse_frequency)
+            table = torch.cat(
+                [sinusoidal_input.sin(),
+                 sinusoidal_input.cos()], -1)
+            self._position_table = table
+        offset = table.size(0) - seq_length
+        return table[offset + start:offset + end]
+
 
 class ProteinResNetPooler(nn.Module):
     def __init__(self, config):
@@ -172,6 +247,22 @@ class ResNetEncoder(nn.Module):
 
         return outputs
 
+    def forward_channels_last(self, hidden_states, input_mask=None):
+        for layer_module in self.layer:
+            hidden_states = layer_module.forward_channels_last(
+                hidden_states, input_mask)
+        return hidden_states
+
+    @property
+    def receptive_radius(self):
+        """Number of neighbouring residues on each side that can influence
+        the output at a position."""
+        radius = 0
+        for layer_module in self.layer:
+            for conv in (layer_module.conv1, layer_module.conv2):
+                radius += conv.dilation[0] * (conv.kernel_size[0] - 1) // 2
+        return radius
+
 
 class ProteinResNetAbstractModel(ProteinModel):
     """An abstract class to handle weights initialization and a simple
@@ -240,6 +331,59 @@ class ProteinResNetModel(ProteinResNetAbstractModel):
         ) + encoder_outputs[1:]
         return outputs  # sequence_output, pooled_output, (hidden_states)
 
+    @torch.no_grad()
+    def inference(self, input_ids, input_mask=None, chunk_size=None,
+                  overlap=None):
+        """Fast inference path returning ``(sequence_output, )``.
+
+        Trailing columns that are padding for every sequence are pruned and
+        the encoder runs channels-last, without the per-block transposes.
+        With ``chunk_size``, long inputs are encoded in windows of
+        ``chunk_size`` residues with ``overlap`` residues of context on each
+        side, and only the window centres are stitched together. The default
+        overlap is the receptive radius of the encoder, so the sequence
+        output at real residues equals the one of ``forward``. Padding
+        positions are not encoded and come back as zeros; no pooled output
+        is returned since the pooler of ``forward`` also sums the padding
+        positions.
+        """
+        batch_size, total_length = input_ids.shape
+        if input_mask is not None and torch.any(input_mask != 1):
+            length = int(input_mask.sum(1).max())
+            extended_input_mask = input_mask[:, :length].unsqueeze(2).to(
+                dtype=next(self.parameters()).dtype)
+        else:
+            length = total_length
+            extended_input_mask = None
+
+        if overlap is None:
+            overlap = self.encoder.receptive_radius
+        if chunk_size is None or chunk_size >= length:
+            chunk_size = length
+
+        sequence_output = None
+        for start in range(0, length, chunk_size):
+            end = min(start + chunk_size, length)
+            lo = max(start - overlap, 0)
+            hi = min(end + overlap, length)
+            embedding_output = self.embeddings(input_ids[:, lo:hi],
+                                               seq_length=total_length,
+                                               start=lo)
+            window_mask = None
+            if extended_input_mask is not None:
+                window_mask = extended_input_mask[:, lo:hi]
+            window_output = self.encoder.forward_channels_last(
+                embedding_output, window_mask)
+            if sequence_output is None:
+                sequence_output = window_output.new_zeros(
+                    batch_size, total_length, window_output.size(2))
+            sequence_output[:, start:end] = window_output[:, start - lo:end -
+                                                          lo]
+
+        if extended_input_mask is not None:
+            sequence_output[:, :length] *= extended_input_mask
+        return (sequence_output, )
+
 
 @registry.register_task_model('masked_language_modeling', 'resnet')
 class ProteinResNetForMaskedLM(ProteinResNetAbstractModel):
@@ -3,6 +3,8 @@ import time
 import numpy as np
 import torch
 
+from deepfold.data.esm_alphabet import BatchTokenizer
+
 
 def extract_esm_embedds(model, data_loader, pool_mode, logger, device='cuda'):
     embeddings = []
@@ -98,7 +100,7 @@ def extract_sentence_embedds(model,
                              pool_mode,
                              logger,
                              device='cuda'):
-    embeddings = torch.Tensor()
+    embeddings = []
     steps = len(data_loader)
     with torch.no_grad():
         end = time.time()
@@ -116,7 +118,7 @@ def extract_sentence_embedds(model,
                 mean_embedding = last_hidden_state[:, 0, :]
                 batch_embeddings = torch.squeeze(mean_embedding, 1)
 
-            embeddings = torch.cat((embeddings, batch_embeddings), dim=0)
+            embeddings.append(batch_embeddings)
             batch_time = time.time() - end
             total_time = time.time() - start
             end = time.time()
@@ -128,5 +130,138 @@ def extract_sentence_embedds(model,
                             steps + 1,
                             batch_time=batch_time,
                             total_time=total_time))
-    embeddings = embeddings.numpy()
+    embeddings = torch.cat(embeddings, dim=0).numpy()
+    return embeddings
+
+
+def extract_text_embeddings(model,
+                            tokenizer,
+                            texts,
+                            pool_mode='mean',
+                            batch_size=64,
+                            max_length=512,
+                            cache=None,
+                            logger=None,
+                            device='cuda'):
+    """Embed ``texts`` with a transformers ``model``.
+
+    Unique texts are tokenized in one batched call, sorted by length and
+    padded only to the longest text of each batch. ``mean`` pooling averages
+    the last hidden state over real tokens, ``cls`` keeps the first token.
+    Texts found in ``cache`` (a text -> embedding dict, e.g. from a previous
+    GO release embedded with the same model) are not recomputed.
+
+    Returns a ``(len(texts), hidden_size)`` float32 array in input order.
+    """
+    cache = {} if cache is None else cache
+    unique_texts = [
+        text for text in dict.fromkeys(texts) if text not in cache
+    ]
+    if logger is not None:
+        logger.info('Embedding %d unique texts, %d reused from cache' %
+                    (len(unique_texts), len(set(texts)) - len(unique_texts)))
+
+    new_embeddings = {}
+    if unique_texts:
+        encodings = tokenizer(unique_texts,
+                              truncation=True,
+                              max_length=max_length)
+        lengths = np.array([len(ids) for ids in encodings['input_ids']])
+        order = np.argsort(-lengths, kind='stable')
+        outputs = None
+        steps = (len(unique_texts) + batch_size - 1) // batch_size
+        with torch.no_grad():
+            start = time.time()
+            for batch_idx, offset in enumerate(
+                    range(0, len(unique_texts), batch_size)):
+                idx = order[offset:offset + batch_size]
+                features = [{key: val[i]
+                             for key, val in encodings.items()} for i in idx]
+                batch = tokenizer.pad(features,
+                                      padding='longest',
+                                      return_tensors='pt')
+                model_inputs = {
+                    key: val.to(device)
+                    for key, val in batch.items()
+                }
+                model_outputs = model(**model_inputs,
+                                      output_hidden_states=True)
+                last_hidden_state = model_outputs.hidden_states[-1]
+                if 'mean' in pool_mode:
+                    mask = model_inputs['attention_mask'].unsqueeze(-1).to(
+                        last_hidden_state.dtype)
+                    batch_embeddings = (last_hidden_state * mask).sum(
+                        1) / mask.sum(1).clamp(min=1)
+                # keep class token only
+                if 'cls' in pool_mode:
+                    batch_embeddings = last_hidden_state[:, 0, :]
+
+                if outputs is None:
+                    outputs = np.empty(
+                        (len(unique_texts), batch_embeddings.size(-1)),
+                        dtype=np.float32)
+                outputs[idx] = batch_embeddings.float().cpu().numpy()
+                if logger is not None:
+                    logger.info('{0}: [{1:>2d}/{2}] '
+                                'Total Time: {total_time:.3f} '.format(
+                                    'Extract embeddings',
+                                    batch_idx + 1,
+                                    steps,
+                                    total_time=time.time() - start))
+        new_embeddings = dict(zip(unique_texts, outputs))
+
+    embeddings = [
+        new_embeddings[text] if text in new_embeddings else cache[text]
+        for text in texts
+    ]
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(embeddings).astype(np.float32, copy=False)
+
+
+def extract_fasta_embeddings(model,
+                             fasta,
+                             save_file,
+                             pool_mode='mean',
+                             max_tokens=16384,
+                             batch_size=None,
+                             max_length=1022,
+                             logger=None,
+                             device='cuda'):
+    """Embed every record of a ``FastaFile`` with an ``EsmTransformer``.
+
+    Records are fed in length-sorted batches read from the ``.fai`` index,
+    and pooled embeddings are written into a ``(num_records, dim)`` ``.npy``
+    memmap at ``save_file`` (row ``i`` is ``fasta.ids[i]``), so neither the
+    sequences nor the embeddings have to fit in memory.
+    """
+    batch_converter = BatchTokenizer(model.alphabet)
+    batches = fasta.length_sorted_batches(batch_size=batch_size,
+                                          max_tokens=max_tokens)
+    embeddings = None
+    start = time.time()
+    with torch.no_grad():
+        for batch_idx, batch in enumerate(batches):
+            sequences = [fasta.get(idx)[:max_length] for idx in batch]
+            _, _, tokens = batch_converter([('', seq) for seq in sequences])
+            lengths = torch.tensor([len(seq) for seq in sequences])
+            embeddings_dict = model.compute_embeddings(tokens.to(device),
+                                                       lengths, None)
+            batch_embeddings = embeddings_dict[pool_mode].to('cpu').numpy()
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    save_file,
+                    mode='w+',
+                    dtype=np.float32,
+                    shape=(len(fasta), batch_embeddings.shape[1]))
+            embeddings[batch] = batch_embeddings
+            if logger is not None:
+                logger.info('{0}: [{1:>2d}/{2}] '
+                            'Total Time: {total_time:.3f} '.format(
+                                'Extract embeddings',
+                                batch_idx + 1,
+                                len(batches),
+                                total_time=time.time() - start))
+    if embeddings is not None:
+        embeddings.flush()
     return embeddings
@@ -0,0 +1,311 @@
+"""Streaming proteome annotation: FASTA -> embeddings -> GO predictions.
+
+Every step runs in its own thread and hands batches to the next one through
+a bounded queue::
+
+    read -> tokenize -> embed -> head -> propagate -> write
+
+A full queue blocks its producer (back-pressure), so at most
+``queue_size`` batches wait between two stages and peak memory depends on
+the batch and queue sizes, never on the size of the proteome. Reading
+sorts records by length within windows of ``buffer_size`` records to keep
+padding low. Torch releases the GIL inside its kernels, so the backbone,
+the head and the I/O overlap. Each stage counts its items and the seconds
+it spends working vs. waiting on its neighbours; the one that never waits
+for input is the bottleneck.
+"""
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from deepfold.core.evaluation.cafa import open_text, write_triples
+from deepfold.core.evaluation.predictions import PredictionWriter, sparsify
+from deepfold.data.utils.embedding_store import (H5_SUFFIXES,
+                                                 EmbeddingWriter)
+from deepfold.data.utils.fasta import iter_fasta
+from deepfold.trainer.serving import token_batches
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the stream in the queues
+_DONE = object()
+
+
+def fasta_batches(fasta_file,
+                  max_tokens=16384,
+                  buffer_size=10000,
+                  max_length=1022):
+    """Stream ``(ids, sequences)`` batches of a FASTA file.
+
+    Records are read ``buffer_size`` at a time and grouped by length into
+    batches of at most ``max_tokens`` padded residues. Ids are the first
+    word of the headers.
+    """
+    def batches(records):
+        lengths = [min(len(seq), max_length) for _, seq in records]
+        for batch in token_batches(lengths, max_tokens):
+            yield ([records[i][0] for i in batch],
+                   [records[i][1] for i in batch])
+
+    records = []
+    for header, sequence in iter_fasta(fasta_file):
+        records.append((header.split()[0] if header else header, sequence))
+        if len(records) == buffer_size:
+            yield from batches(records)
+            records = []
+    yield from batches(records)
+
+
+class Stage(object):
+    """One pipeline step running ``fn`` on every batch in a thread.
+
+    ``fn`` maps a batch to the batch of the next stage (``None`` skips it);
+    the size of a batch is the length of its first element.
+    """
+    def __init__(self, name, fn, pipeline):
+        self.name = name
+        self.fn = fn
+        self.pipeline = pipeline
+        self.input = None
+        self.output = None
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.wait_input = 0.0
+        self.wait_output = 0.0
+        self.thread = None
+
+    def _get(self):
+        start = time.perf_counter()
+        while not self.pipeline.stopped.is_set():
+            try:
+                batch = self.input.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            batch = _DONE
+        self.wait_input += time.perf_counter() - start
+        return batch
+
+    def _put(self, batch):
+        start = time.perf_counter()
+        while not self.pipeline.stopped.is_set():
+            try:
+                self.output.put(batch, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.wait_output += time.perf_counter() - start
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        result = self.fn(batch)
+        self.busy += time.perf_counter() - start
+        self.batches += 1
+        self.items += len(batch[0])
+        if result is not None and self.output is not None:
+            self._put(result)
+
+    def run(self):
+        try:
+            if self.input is None:
+                # source: ``fn`` returns an iterator of batches, producing
+                # them is the work of the stage
+                batches = iter(self.fn())
+                while not self.pipeline.stopped.is_set():
+                    start = time.perf_counter()
+                    batch = next(batches, _DONE)
+                    self.busy += time.perf_counter() - start
+                    if batch is _DONE:
+                        break
+                    self.batches += 1
+                    self.items += len(batch[0])
+                    self._put(batch)
+            else:
+                while True:
+                    batch = self._get()
+                    if batch is _DONE:
+                        break
+                    self._process(batch)
+        except BaseException as error:
+            self.pipeline.fail(self.name, error)
+        if self.output is not None:
+            self._put(_DONE)
+
+    def stats(self):
+        return {
+            'items': self.items,
+            'batches': self.batches,
+            'busy_s': round(self.busy, 3),
+            'wait_input_s': round(self.wait_input, 3),
+            'wait_output_s': round(self.wait_output, 3),
+            'items_per_s': round(self.items / self.busy, 1)
+            if self.busy else 0.0
+        }
+
+
+class Pipeline(object):
+    """Stages connected by bounded queues.
+
+    Example:
+        pipeline = Pipeline(queue_size=4)
+        pipeline.add_stage('read', lambda: fasta_batches(fasta_file))
+        pipeline.add_stage('embed', embed_batch)
+        pipeline.run()
+    """
+    def __init__(self, queue_size=4, log_interval=30):
+        self.queue_size = queue_size
+        self.log_interval = log_interval
+        self.stages = []
+        self.stopped = threading.Event()
+        self.error = None
+
+    def add_stage(self, name, fn):
+        stage = Stage(name, fn, self)
+        if self.stages:
+            stage.input = self.stages[-1].output = queue.Queue(
+                self.queue_size)
+        self.stages.append(stage)
+        return stage
+
+    def fail(self, name, error):
+        if self.error is None:
+            logger.error('Stage %s failed: %r' % (name, error))
+            self.error = error
+        self.stopped.set()
+
+    def stats(self):
+        return dict((stage.name, stage.stats()) for stage in self.stages)
+
+    def log_stats(self):
+        for stage in self.stages:
+            logger.info('%-10s %s' % (stage.name, stage.stats()))
+
+    def run(self):
+        """Run all stages to completion; re-raises the first failure."""
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run,
+                                            name=stage.name,
+                                            daemon=True)
+            stage.thread.start()
+        last_log = time.perf_counter()
+        try:
+            for stage in self.stages:
+                while stage.thread.is_alive():
+                    stage.thread.join(timeout=1)
+                    if time.perf_counter() - last_log > self.log_interval:
+                        self.log_stats()
+                        last_log = time.perf_counter()
+        except KeyboardInterrupt as error:
+            self.fail('main', error)
+            raise
+        self.log_stats()
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+
+class PredictionSink(object):
+    """Write stage: sparse predictions directory, and optionally a CAFA
+    file and the embeddings."""
+    def __init__(self,
+                 output_dir,
+                 terms,
+                 top_k,
+                 min_score,
+                 cafa_file=None,
+                 author='DeepFold',
+                 embeddings_file=None):
+        if embeddings_file and not embeddings_file.endswith(H5_SUFFIXES):
+            # NPZ stores are only written on close, all in memory
+            raise ValueError('Embeddings of a pipeline are streamed to an '
+                             '.h5 / .hdf5 store, got %s' % embeddings_file)
+        self.terms = np.asarray(terms, dtype=object)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.writer = PredictionWriter(output_dir, terms, top_k, min_score)
+        self.cafa = None
+        if cafa_file:
+            self.cafa = open_text(cafa_file, 'wt')
+            self.cafa.write('AUTHOR\t%s\nMODEL\t1\n' % author)
+        self.embeddings = None
+        if embeddings_file:
+            self.embeddings = EmbeddingWriter(embeddings_file)
+
+    def __call__(self, batch):
+        ids, scores, embeddings = batch
+        scores = sparsify(scores, self.top_k, self.min_score)
+        self.writer.append(ids, scores)
+        if self.cafa is not None:
+            write_triples(self.cafa, [(ids, self.terms, scores)],
+                          min_score=self.min_score)
+        if self.embeddings is not None:
+            self.embeddings.append(ids, embeddings)
+
+    def close(self):
+        self.writer.close()
+        if self.cafa is not None:
+            self.cafa.write('END\n')
+            self.cafa.close()
+        if self.embeddings is not None:
+            self.embeddings.close()
+
+
+def annotate_fasta(predictor,
+                   fasta_file,
+                   output_dir,
+                   cafa_file=None,
+                   embeddings_file=None,
+                   buffer_size=10000,
+                   queue_size=4,
+                   log_interval=30):
+    """Annotate every protein of ``fasta_file`` with a ``GOPredictor``.
+
+    Predictions are written as a predictions directory (``output_dir``),
+    optionally also as a CAFA file and a bulk embedding store.
+
+    Returns:
+        per stage statistics
+    """
+    sink = PredictionSink(output_dir,
+                          predictor.terms,
+                          predictor.top_k,
+                          predictor.min_score,
+                          cafa_file=cafa_file,
+                          embeddings_file=embeddings_file)
+
+    def tokenize(batch):
+        ids, sequences = batch
+        return (ids, ) + tuple(predictor.tokenize(sequences))
+
+    def embed(batch):
+        ids, tokens, lengths = batch
+        return ids, predictor.embed_tokens(tokens, lengths)
+
+    def head(batch):
+        ids, embeddings = batch
+        return ids, predictor.score(embeddings), embeddings
+
+    def propagate(batch):
+        ids, scores, embeddings = batch
+        return ids, predictor.propagate(scores), embeddings
+
+    pipeline = Pipeline(queue_size=queue_size, log_interval=log_interval)
+    pipeline.add_stage(
+        'read', lambda: fasta_batches(fasta_file,
+                                      max_tokens=predictor.max_tokens,
+                                      buffer_size=buffer_size,
+                                      max_length=predictor.max_length))
+    pipeline.add_stage('tokenize', tokenize)
+    pipeline.add_stage('embed', embed)
+    pipeline.add_stage('head', head)
+    pipeline.add_stage('propagate', propagate)
+    pipeline.add_stage('write', sink)
+    try:
+        return pipeline.run()
+    finally:
+        sink.close()
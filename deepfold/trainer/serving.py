@@ -0,0 +1,589 @@
+"""Long-running GO prediction service.
+
+The prediction head, the label hierarchy and the ontology are loaded once.
+Concurrent requests are coalesced by ``MicroBatcher``: the first queued
+request opens a batch which closes when ``max_batch_size`` items are
+collected or ``max_delay`` seconds have passed, so a lone request waits at
+most ``max_delay`` while a burst is served with full batches. Sequences go
+through two batched stages (ESM embedding, then the head), precomputed
+embeddings straight to the head. Every stage is timed in ``StageMetrics``.
+
+``PredictionServer`` exposes the service over HTTP (TCP or Unix socket)::
+
+    POST /predict   {"fasta": ">P1\\nMKV..."}, {"sequences": {id: seq}} or
+                    {"embeddings": {id: [...]}}, optional "top_k",
+                    "min_score"; returns {"predictions": {id: [[term,
+                    score], ...]}} with the best scores first
+    GET  /metrics   count, mean and p50 / p95 / p99 latency of every stage
+    GET  /health
+"""
+import collections
+import contextlib
+import http.server
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from deepfold.core.evaluation.predictions import (DEFAULT_MIN_SCORE,
+                                                  sparsify)
+from deepfold.data.esm_alphabet import BatchTokenizer
+from deepfold.data.utils.fasta import parse_fasta
+from deepfold.data.utils.ontology import Ontology
+from deepfold.models.esm_model import MLP, EsmTransformer
+from deepfold.models.layers.hierarchy import LabelHierarchy
+from deepfold.models.multimodal_model import ProtGCNModel
+from deepfold.utils.make_graph import build_graph
+from deepfold.utils.model import load_model_checkpoint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERVE_TOP_K = 500
+
+
+def hierarchy_edges(ontology, terms):
+    """``(child, parent)`` label indices of every ``is_a`` ancestor pair
+    within ``terms``, so that propagation is exact even when intermediate
+    terms are not labels."""
+    all_terms, term_index = ontology.get_term_index()
+    labels = np.array([term_index.get(t_id, -1) for t_id in terms])
+    known = np.flatnonzero(labels >= 0)
+    closure = ontology.ancestor_matrix()[labels[known]][:, labels[known]]
+    closure = closure.tocoo()
+    keep = closure.row != closure.col
+    return np.stack([known[closure.row[keep]], known[closure.col[keep]]],
+                    axis=1)
+
+
+def label_hierarchy(ontology, terms):
+    """``LabelHierarchy`` of ``terms`` for true-path propagation."""
+    return LabelHierarchy(hierarchy_edges(ontology, terms), len(terms))
+
+
+def token_batches(lengths, max_tokens=16384):
+    """Indices of ``lengths`` grouped by length into batches whose padded
+    size (``len(batch) * longest``) stays within ``max_tokens``."""
+    order = np.argsort(lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        # sorted ascending: the last sequence of a batch is the longest
+        end = start + 1
+        while end < len(order) and (end - start + 1) * lengths[
+                order[end]] <= max_tokens:
+            end += 1
+        batches.append(order[start:end])
+        start = end
+    return batches
+
+
+class StageMetrics(object):
+    """Latencies (and batch sizes) of the last ``window`` calls of every
+    stage."""
+    def __init__(self, window=10000):
+        self.window = window
+        self._times = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self._sizes = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, batch_size=None):
+        with self._lock:
+            self._times[stage].append(seconds)
+            self._counts[stage] += 1
+            if batch_size is not None:
+                self._sizes[stage].append(batch_size)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            times = dict((stage, np.array(values))
+                         for stage, values in self._times.items())
+            counts = dict(self._counts)
+            sizes = dict((stage, np.mean(values))
+                         for stage, values in self._sizes.items())
+        summary = dict()
+        for stage, values in times.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            summary[stage] = {
+                'count': counts[stage],
+                'mean_ms': float(values.mean() * 1000),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99)
+            }
+            if stage in sizes:
+                summary[stage]['mean_batch_size'] = float(sizes[stage])
+        return summary
+
+
+class _Request(object):
+    def __init__(self, items):
+        self.items = items
+        self.created = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Coalesce concurrent ``submit`` calls into batched calls of ``fn``.
+
+    Args:
+        fn: maps a list of items to a list of results of the same length.
+        max_batch_size: items that close a batch (a single larger request
+            is still run as one batch).
+        max_delay: seconds a batch stays open after its first request.
+        metrics: ``StageMetrics`` receiving the '<name>_wait' (queueing)
+            and '<name>_batch' (``fn``, with batch sizes) times.
+    """
+    def __init__(self,
+                 fn,
+                 max_batch_size=64,
+                 max_delay=0.005,
+                 metrics=None,
+                 name='batch'):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.metrics = metrics or StageMetrics()
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """Run ``fn`` on ``items`` within a batch, blocking until done."""
+        if not len(items):
+            return []
+        request = _Request(items)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _collect(self, first):
+        batch, size = [first], len(first.items)
+        deadline = first.created + self.max_delay
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = self._collect(request)
+            start = time.perf_counter()
+            for request in batch:
+                self.metrics.record(self.name + '_wait',
+                                    start - request.created)
+            items = [item for request in batch for item in request.items]
+            try:
+                results = self.fn(items)
+            except Exception as error:
+                logger.exception('%s failed on %d items' %
+                                 (self.name, len(items)))
+                for request in batch:
+                    request.error = error
+                    request.done.set()
+                continue
+            self.metrics.record(self.name + '_batch',
+                                time.perf_counter() - start,
+                                batch_size=len(items))
+            offset = 0
+            for request in batch:
+                end = offset + len(request.items)
+                request.results = results[offset:end]
+                offset = end
+                request.done.set()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class GOPredictor(object):
+    """Embeddings (or sequences) to propagated sparse GO scores.
+
+    Args:
+        model: prediction head, called as ``model(embeddings, None)`` and
+            returning ``(logits, )`` like the repo's embedding heads.
+        terms: GO id of every output column.
+        hierarchy: ``LabelHierarchy`` over ``terms``; scores are
+            max-propagated to the ancestors when given.
+        embedder: ``EsmTransformer`` embedding FASTA requests (optional).
+        max_tokens: residues per embedding batch, sequences are grouped by
+            length before padding.
+        embed_dim: input size of the head; embeddings of another size are
+            rejected before batching (default: not checked).
+    """
+    def __init__(self,
+                 model,
+                 terms,
+                 hierarchy=None,
+                 embedder=None,
+                 pool_mode='mean',
+                 max_length=1022,
+                 max_tokens=16384,
+                 top_k=DEFAULT_SERVE_TOP_K,
+                 min_score=DEFAULT_MIN_SCORE,
+                 device='cpu',
+                 embed_dim=None,
+                 metrics=None):
+        self.model = model.to(device).eval()
+        self.terms = np.asarray(terms, dtype=object)
+        self.hierarchy = hierarchy
+        self.embedder = embedder
+        self.tokenizer = None
+        if embedder is not None:
+            self.embedder = embedder.to(device).eval()
+            self.tokenizer = BatchTokenizer(embedder.alphabet)
+        self.pool_mode = pool_mode
+        self.max_length = max_length
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.min_score = min_score
+        self.device = device
+        self.embed_dim = embed_dim
+        self.metrics = metrics or StageMetrics()
+
+    def check_embeddings(self, ids, embeddings):
+        """Raise ``ValueError`` unless every embedding is a vector of
+        ``embed_dim`` values."""
+        for protein, embedding in zip(ids, embeddings):
+            if embedding.ndim != 1 or (self.embed_dim is not None and
+                                       embedding.shape[0] != self.embed_dim):
+                raise ValueError(
+                    'Embedding of %s has shape %s, expected (%s,)' %
+                    (protein, embedding.shape, self.embed_dim or 'dim'))
+
+    def tokenize(self, sequences):
+        """Padded ESM tokens and residue counts of a batch."""
+        sequences = [seq[:self.max_length] for seq in sequences]
+        _, _, tokens = self.tokenizer([('', seq) for seq in sequences])
+        return tokens, torch.tensor([len(seq) for seq in sequences])
+
+    @torch.no_grad()
+    def embed_tokens(self, tokens, lengths):
+        """Pooled float32 embeddings of a ``tokenize`` batch."""
+        pooled = self.embedder.compute_embeddings(tokens.to(self.device),
+                                                  lengths,
+                                                  None)[self.pool_mode]
+        return pooled.float().cpu().numpy()
+
+    def embed(self, sequences):
+        """Pooled ``(len(sequences), dim)`` embeddings."""
+        lengths = [min(len(seq), self.max_length) for seq in sequences]
+        embeddings = [None] * len(sequences)
+        for batch in token_batches(lengths, self.max_tokens):
+            tokens, batch_lengths = self.tokenize(
+                [sequences[i] for i in batch])
+            for i, embedding in zip(batch,
+                                    self.embed_tokens(tokens,
+                                                      batch_lengths)):
+                embeddings[i] = embedding
+        return np.stack(embeddings)
+
+    @torch.no_grad()
+    def score(self, embeddings):
+        """Sigmoid scores of the head, as a tensor on ``device``."""
+        inputs = torch.as_tensor(np.asarray(embeddings, dtype=np.float32),
+                                 device=self.device)
+        return torch.sigmoid(self.model(inputs, None)[0].float())
+
+    def propagate(self, scores):
+        """True-path (max) propagated scores as a numpy array."""
+        if self.hierarchy is not None:
+            scores = self.hierarchy.propagate(scores, mode='max')
+        return scores.cpu().numpy()
+
+    def predict(self, embeddings):
+        """Sparse CSR scores of ``(num_proteins, dim)`` embeddings."""
+        with self.metrics.time('head'):
+            scores = self.score(embeddings)
+        with self.metrics.time('propagate'):
+            scores = self.propagate(scores)
+        with self.metrics.time('sparsify'):
+            return sparsify(scores, self.top_k, self.min_score)
+
+
+def load_predictor(checkpoint,
+                   model='mlp',
+                   data_path='',
+                   terms_file='terms.pkl',
+                   namespace='bpo',
+                   go_file='go.obo',
+                   esm_model='',
+                   embed_dim=1280,
+                   device='cpu',
+                   **kwargs):
+    """Build a ``GOPredictor`` from a checkpoint of an embedding head.
+
+    Args:
+        model: 'mlp' (``esm_model.MLP`` over ``terms_file``) or 'protgcn'
+            (``ProtGCNModel`` over the ``build_graph`` labels of
+            ``namespace``).
+        go_file: ontology propagating the scores, relative to ``data_path``
+            (empty: no propagation).
+        esm_model: ESM model embedding sequences (empty: embeddings only).
+        kwargs: other ``GOPredictor`` arguments.
+    """
+    if model == 'protgcn':
+        adj, multi_hot_vector, label_map, label_map_ivs = build_graph(
+            data_path=data_path, namespace=namespace)
+        terms = [label_map_ivs[k] for k in range(len(label_map_ivs))]
+        head = ProtGCNModel(nodes=multi_hot_vector.to(device),
+                            adjmat=adj.to(device),
+                            seq_dim=embed_dim,
+                            node_feats=512,
+                            hidden_dim=512)
+    else:
+        terms = pd.read_pickle(os.path.join(
+            data_path, terms_file))['terms'].values.flatten()
+        head = MLP(input_size=embed_dim, num_labels=len(terms))
+    model_state, _ = load_model_checkpoint(checkpoint, map_location=device)
+    head.load_state_dict(model_state)
+
+    hierarchy = None
+    if go_file:
+        go = Ontology(os.path.join(data_path, go_file), with_rels=False)
+        hierarchy = label_hierarchy(go, terms)
+    embedder = None
+    if esm_model:
+        embedder = EsmTransformer(model_dir=esm_model,
+                                  pool_mode=kwargs.get('pool_mode', 'mean'))
+    return GOPredictor(head,
+                       terms,
+                       hierarchy=hierarchy,
+                       embedder=embedder,
+                       device=device,
+                       embed_dim=embed_dim,
+                       **kwargs)
+
+
+class PredictionService(object):
+    """``GOPredictor`` behind two micro-batched stages."""
+    def __init__(self,
+                 predictor,
+                 max_batch_size=64,
+                 max_delay=0.005,
+                 max_embed_batch_size=16):
+        self.predictor = predictor
+        self.metrics = predictor.metrics
+        self.embed_batcher = MicroBatcher(self._embed,
+                                          max_batch_size=max_embed_batch_size,
+                                          max_delay=max_delay,
+                                          metrics=self.metrics,
+                                          name='embed')
+        self.head_batcher = MicroBatcher(self._predict,
+                                         max_batch_size=max_batch_size,
+                                         max_delay=max_delay,
+                                         metrics=self.metrics,
+                                         name='head')
+
+    def _embed(self, sequences):
+        return list(self.predictor.embed(sequences))
+
+    def _predict(self, embeddings):
+        scores = self.predictor.predict(np.stack(embeddings))
+        return [scores[i] for i in range(scores.shape[0])]
+
+    def predict(self, ids, sequences=None, embeddings=None, top_k=None,
+                min_score=None):
+        """``{id: [(term, score), ...]}``, best scores first."""
+        if embeddings is None and self.predictor.embedder is None:
+            raise ValueError('The service was started without an ESM model, '
+                             'send embeddings instead of sequences')
+        if embeddings is not None:
+            # a bad request must fail alone, not the batch it would join
+            self.predictor.check_embeddings(ids, embeddings)
+        with self.metrics.time('request'):
+            if embeddings is None:
+                embeddings = self.embed_batcher.submit(list(sequences))
+            rows = self.head_batcher.submit(list(embeddings))
+            predictions = dict()
+            for protein, row in zip(ids, rows):
+                order = np.argsort(-row.data, kind='stable')
+                if top_k is not None:
+                    order = order[:top_k]
+                if min_score is not None:
+                    order = order[row.data[order] >= min_score]
+                predictions[protein] = [
+                    (self.predictor.terms[row.indices[j]],
+                     round(float(row.data[j]), 4)) for j in order
+                ]
+            return predictions
+
+    def close(self):
+        self.embed_batcher.close()
+        self.head_batcher.close()
+
+
+def _check_option(payload, name, types, kind):
+    value = payload.get(name)
+    if value is None:
+        return None
+    # bool is an int, but 'top_k': true is a malformed request
+    if (isinstance(value, bool) or not isinstance(value, types)
+            or not 0 <= value < float('inf')):
+        raise ValueError('%s must be a non-negative %s, got %r' %
+                         (name, kind, value))
+    return value
+
+
+def parse_request(payload):
+    """Ids, sequences, embeddings, ``top_k`` and ``min_score`` of a
+    /predict JSON payload; a malformed payload raises ``ValueError``."""
+    if not isinstance(payload, dict):
+        raise ValueError('Expected a JSON object, got %s' %
+                         type(payload).__name__)
+    top_k = _check_option(payload, 'top_k', int, 'integer')
+    min_score = _check_option(payload, 'min_score', (int, float),
+                              'number')
+    if 'embeddings' in payload:
+        if not isinstance(payload['embeddings'], dict):
+            raise ValueError("'embeddings' must map ids to vectors")
+        ids = list(payload['embeddings'])
+        embeddings = []
+        for p_id in ids:
+            try:
+                embedding = np.asarray(payload['embeddings'][p_id],
+                                       dtype=np.float32)
+            except (TypeError, ValueError):
+                embedding = None
+            # JSON null becomes NaN
+            if embedding is None or not np.isfinite(embedding).all():
+                raise ValueError('Embedding of %s is not a vector of '
+                                 'numbers' % p_id)
+            embeddings.append(embedding)
+        return ids, None, embeddings, top_k, min_score
+    if 'fasta' in payload:
+        if not isinstance(payload['fasta'], str):
+            raise ValueError("'fasta' must be a string")
+        records = parse_fasta(payload['fasta'])
+        return ([header.split()[0] for header, _ in records],
+                [seq for _, seq in records], None, top_k, min_score)
+    if 'sequences' in payload:
+        if not isinstance(payload['sequences'], dict):
+            raise ValueError("'sequences' must map ids to sequences")
+        ids = list(payload['sequences'])
+        sequences = []
+        for p_id in ids:
+            if not isinstance(payload['sequences'][p_id], str):
+                raise ValueError('Sequence of %s is not a string' % p_id)
+            # the tokenizer drops whitespace, the lengths must too
+            sequences.append(''.join(payload['sequences'][p_id].split()))
+        return ids, sequences, None, top_k, min_score
+    raise ValueError("Expected 'fasta', 'sequences' or 'embeddings'")
+
+
+class PredictionHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            self._reply(200, self.server.service.metrics.summary())
+        else:
+            self._reply(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': 'Unknown path %s' % self.path})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Type', '').startswith('text/'):
+                payload = {'fasta': body.decode('utf-8')}
+            else:
+                payload = json.loads(body)
+            ids, sequences, embeddings, top_k, min_score = parse_request(
+                payload)
+        except ValueError as error:
+            self._reply(400, {'error': str(error)})
+            return
+        try:
+            predictions = self.server.service.predict(ids,
+                                                      sequences,
+                                                      embeddings,
+                                                      top_k=top_k,
+                                                      min_score=min_score)
+        except ValueError as error:
+            self._reply(400, {'error': str(error)})
+            return
+        except Exception as error:
+            self._reply(500, {'error': str(error)})
+            return
+        self._reply(200, {'predictions': predictions})
+
+
+class PredictionServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server answering with a ``PredictionService``."""
+    daemon_threads = True
+    # concurrent clients queue in the listen backlog (socketserver's is 5)
+    request_queue_size = 1024
+
+    def __init__(self, address, service):
+        self.service = service
+        super().__init__(address, PredictionHandler)
+
+
+class UnixPredictionServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    """``PredictionServer`` listening on a Unix socket."""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, PredictionHandler)
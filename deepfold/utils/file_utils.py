@@ -1,34 +1,26 @@
+import hashlib
 import logging
 import os
 from collections import defaultdict
 from typing import List, Tuple
 
-import h5py
 import numpy as np
 import pandas as pd
 
+from deepfold.data.utils.embedding_store import (EmbeddingStore,
+                                                  EmbeddingWriter)
+from deepfold.data.utils.fasta import read_fasta  # noqa: F401
+
 logger = logging.getLogger(__name__)
 
 
-def read_fasta(filename):
-    seqs = list()
-    info = list()
-    seq = ''
-    inf = ''
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('>'):
-                if seq != '':
-                    seqs.append(seq)
-                    info.append(inf)
-                    seq = ''
-                inf = line[1:]
-            else:
-                seq += line
-        seqs.append(seq)
-        info.append(inf)
-    return info, seqs
+def hash_file(filename, chunk_size=1 << 20):
+    """Return the md5 hex digest of a file, read in chunks."""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
 
 def read_go_annotations(file_in):
@@ -75,16 +67,14 @@ def save_annotations(data_path):
 
 
 def read_embeddings(embeddings_in):
-    """Read embeddings from h5 file generated by bio_embeddings pipeline.
+    """Read embeddings from a bulk store (``save_from_generator``) or an h5
+    / npz file generated by bio_embeddings pipeline.
 
     :param embeddings_in:
-    :return:
+    :return: dict of sequence id to embedding
     """
-    embeddings = dict()
-    with h5py.File(embeddings_in, 'r') as f:
-        for sequence_id, embedding in f.items():
-            embeddings[sequence_id] = np.array(embedding)
-    return embeddings
+    with EmbeddingStore(embeddings_in) as store:
+        return store.to_dict()
 
 
 def load_embedding(data_path, split='train'):
@@ -110,53 +100,47 @@ def load_embedding(data_path, split='train'):
 def save_from_generator(
     emb_path: str,
     the_generator: List[Tuple[str, np.ndarray]],
+    compression: str = None,
 ):
-    if emb_path.endswith('.h5'):
-        with h5py.File(str(emb_path), 'w') as hf:
-            for sequence_id, embedding in the_generator:
-                if emb_path.endswith('.h5'):
-                    # noinspection PyUnboundLocalVariable
-                    hf.create_dataset(sequence_id, data=embedding)
-    elif emb_path.endswith('.npz'):
-        emb_dict = dict()
+    """Stream ``(sequence_id, embedding)`` pairs into a bulk embedding store
+    (.h5 or .npz, see ``deepfold.data.utils.embedding_store``)."""
+    if not emb_path.endswith(('.h5', '.hdf5', '.npz')):
+        raise RuntimeError(
+            f'The output file must end with .npz or .h5,'
+            f"but the path you provided ends with '{emb_path[-10:]}'")
+    logger.info(f'Writing embeddings to {emb_path}')
+    with EmbeddingWriter(emb_path, compression=compression) as writer:
         for sequence_id, embedding in the_generator:
             if embedding is None:
                 # The generator code already showed an error
                 continue
-            emb_dict[sequence_id] = embedding
-
-        if not emb_dict:
-            raise RuntimeError('Embedding dictionary is empty!')
-        logger.info('Total number of embeddings: {}'.format(len(emb_dict)))
-
-        logger.info(f'Writing embeddings to {emb_path}')
-        # With checked that the endswith can only be .npz
-        np.savez(emb_path, **emb_dict)
-    else:
-        raise RuntimeError(
-            f'The output file must end with .npz or .h5,'
-            f"but the path you provided ends with '{emb_path[:-10]}'")
+            writer.add(sequence_id, embedding)
+    if writer.num_rows == 0:
+        raise RuntimeError('Embedding dictionary is empty!')
+    logger.info('Total number of embeddings: {}'.format(writer.num_rows))
 
 
 def write_predictions_cafa(predictions, out_file, model_num):
     """Write prediictions in CAFA format.
 
-    :param predictions: predictions to write
-    :param out_file: output file
+    :param predictions: predictions to write, ``{protein: {term: ri}}`` or
+        anything ``deepfold.core.evaluation.cafa.write_cafa`` accepts
+    :param out_file: output file (.gz / .zst are compressed)
     :param model_num: number of model that is used
     :return:
     """
-    with open(out_file, 'w') as out:
-        out.write(
-            'AUTHOR\tRostlab2\nMODEL\t{}\nKEYWORDS\thomolog, machine learning, natural language processing.'
-            '\n'.format(model_num))
-        for p in predictions.keys():
-            prediction = predictions[p]
-            for pred in prediction.keys():
-                ri = prediction[pred]
-                out.write('{}\t{}\t'.format(p, pred))
-                out.write('{:0.2f}\n'.format(float(ri)))
-        out.write('END')
+    # imported here: the evaluation package imports this module
+    from deepfold.core.evaluation.cafa import write_cafa
+    write_cafa(predictions,
+               out_file,
+               'Rostlab2',
+               model=model_num,
+               keywords=[
+                   'homolog', 'machine learning',
+                   'natural language processing'
+               ],
+               min_score=None,
+               sort=False)
 
 
 def write_predictions(predictions, out_file):
@@ -166,14 +150,11 @@ def write_predictions(predictions, out_file):
     :param out_file: file to write predictions to
     :return:
     """
-    with open(out_file, 'w') as out:
-        out.write('Target ID\tGO Term\tRI\n')
-        for p in predictions.keys():
-            prediction = predictions[p]
-            for pred in prediction:
-                ri = prediction[pred]
-                out.write('{}\t{}\t'.format(p, pred))
-                out.write('{:0.2f}\n'.format(float(ri)))
+    from deepfold.core.evaluation.cafa import write_table
+    write_table(predictions,
+                out_file, ('Target ID', 'GO Term', 'RI'),
+                min_score=None,
+                sort=False)
 
 
 def write_hits(hits, out_file):
@@ -183,13 +164,14 @@ def write_hits(hits, out_file):
     :param out_file:
     :return:
     """
-    with open(out_file, 'w') as out:
+    # hit scores are written as they are (ints stay ints), so they do not
+    # go through the float blocks of ``write_table``
+    from deepfold.core.evaluation.cafa import open_text
+    with open_text(out_file, 'wt') as out:
         out.write('Query\tHit\tRI\n')
-        for q in hits.keys():
-            h = hits[q]
-            for k in h.keys():
-                ri = h[k]
-                out.write('{}\t{}\t{}\n'.format(q, k, ri))
+        for q, h in hits.items():
+            out.writelines('{}\t{}\t{}\n'.format(q, k, ri)
+                           for k, ri in h.items())
 
 
 if __name__ == '__main__':
@@ -1,23 +1,30 @@
+import hashlib
+import logging
 import math
 import os
+import pickle
 import sys
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+from itertools import chain
 
 import pandas as pd
 
 from deepfold.data.utils.ontology import Ontology
+from deepfold.utils.file_utils import hash_file
 
 sys.path.append('../')
 
+logger = logging.getLogger(__name__)
+
+# bump when the cached edge weights change meaning
+GO_IC_CACHE_VERSION = 1
+
 
 # GOA_cnt
 def statistic_terms(train_data_path):
     """get frequency dict from train file."""
     train_data = pd.read_pickle(train_data_path)
-    cnt = Counter()
-    for i, row in train_data.iterrows():
-        for term in row['annotations']:
-            cnt[term] += 1
+    cnt = Counter(chain.from_iterable(train_data['annotations']))
     print('Number of annotated terms:', len(cnt))
     sorted_by_freq_tuples = sorted(cnt.items(), key=lambda x: x[0])
     sorted_by_freq_tuples.sort(key=lambda x: x[1], reverse=True)
@@ -80,10 +87,10 @@ def read_go_children(input_go_obo_file):
 
 def find_all_descendants(input_go_term, children):
     children_set = set()
-    queue = []
+    queue = deque()
     queue.append(input_go_term)
     while queue:
-        node = queue.pop(0)
+        node = queue.popleft()
         if node in children and node not in children_set:
             node_children = children[node]
             queue.extend(node_children)
@@ -91,6 +98,54 @@ def find_all_descendants(input_go_term, children):
     return children_set
 
 
+def invert_children(children):
+    """Turn a parent -> children mapping into child -> parents."""
+    parents = defaultdict(set)
+    for parent, node_children in children.items():
+        for child in node_children:
+            parents[child].add(parent)
+    return parents
+
+
+def find_all_ancestors(input_go_term, parents, memo):
+    """Return ``input_go_term`` together with all of its ancestors.
+
+    Terms are resolved in topological order (parents before children) and
+    every closure is stored in ``memo``, so a whole ontology is covered with
+    one set union per edge instead of one traversal per term.
+    """
+    stack = [input_go_term]
+    while stack:
+        node = stack[-1]
+        if node in memo:
+            stack.pop()
+            continue
+        pending = [p for p in parents.get(node, ()) if p not in memo]
+        if pending:
+            stack.extend(pending)
+            continue
+        ancestors = {node}
+        for p in parents.get(node, ()):
+            ancestors |= memo[p]
+        memo[node] = ancestors
+        stack.pop()
+    return memo[input_go_term]
+
+
+def count_descendant_annotations(go_cnt, parents):
+    """Sum annotation counts of every term over itself and its descendants.
+
+    Each annotated term pushes its count to its (memoized) ancestor closure,
+    which is equivalent to summing over the descendants of every term.
+    """
+    desc_cnt = defaultdict(int)
+    memo = {}
+    for term, cnt in go_cnt.items():
+        for ancestor in find_all_ancestors(term, parents, memo):
+            desc_cnt[ancestor] += cnt
+    return desc_cnt
+
+
 def store_counts_for_GO_terms(freq_dict, alt_id):
     go_cnt = defaultdict()
     for term in freq_dict:
@@ -124,6 +179,13 @@ def calculate_information_contents_of_GO_terms(input_go_cnt_file, children,
                                                alt_id):
     ic_dict = defaultdict()
     go_cnt = store_counts_for_GO_terms(input_go_cnt_file, alt_id)
+    desc_cnt = count_descendant_annotations(go_cnt, invert_children(children))
+
+    def get_freq(term):
+        # the term's own count is included twice, once directly and once as
+        # a member of its descendant set, as in calculate_freq
+        return go_cnt.get(term, 0) + desc_cnt.get(term, 0)
+
     for x in range(0, 3):
         if x == 0:
             root = 'GO:0005575'  # cellular component
@@ -132,10 +194,9 @@ def calculate_information_contents_of_GO_terms(input_go_cnt_file, children,
         elif x == 2:
             root = 'GO:0003674'  # molecular function
         root_descendants = find_all_descendants(root, children)
-        root_freq = calculate_freq(root, root_descendants, go_cnt)
+        root_freq = get_freq(root)
         for term in root_descendants:
-            term_descendants = find_all_descendants(term, children)
-            term_freq = calculate_freq(term, term_descendants, go_cnt)
+            term_freq = get_freq(term)
             term_prob = (term_freq + 1) / (root_freq + 1)
             term_ic = -math.log(term_prob)
             assert (term not in ic_dict)
@@ -146,6 +207,7 @@ def calculate_information_contents_of_GO_terms(input_go_cnt_file, children,
 # make final edge file
 def get_all_go_cnt(edges, go_cnt, all_children, go_ic):
     all_go_cnt = []
+    children_ic = dict()
     for children, parent in edges:
         cnt_every = 0.0
         cnt_chidren = 0.0
@@ -162,10 +224,10 @@ def get_all_go_cnt(edges, go_cnt, all_children, go_ic):
         else:
             cnt_freq = cnt_freq_children / cnt_freq_parent
 
-        if parent in all_children:
-            for x in all_children[parent]:
-                if x in go_ic.keys():
-                    cnt_every += go_ic[x]
+        if parent not in children_ic:
+            children_ic[parent] = sum(
+                go_ic[x] for x in all_children.get(parent, ()) if x in go_ic)
+        cnt_every += children_ic[parent]
 
         if parent in go_ic.keys():
             cnt_every += go_ic[parent]
@@ -178,17 +240,76 @@ def get_all_go_cnt(edges, go_cnt, all_children, go_ic):
     return all_go_cnt
 
 
-def get_go_ic(namespace='bpo', data_path=None):
+def get_go_ic_cache_file(go_file, train_data_file, cache_dir):
+    """Cache location keyed by the obo and annotation file contents."""
+    key = hashlib.md5('{}-{}-{}'.format(
+        GO_IC_CACHE_VERSION, hash_file(go_file),
+        hash_file(train_data_file)).encode()).hexdigest()
+    return os.path.join(cache_dir, 'go_ic_{}.pkl'.format(key))
+
+
+def get_release_dir(go_file, train_data_file):
+    """Directory of the ``ontology_diff`` artifacts of a GO release computed
+    with the annotations of ``train_data_file``."""
+    name = os.path.splitext(os.path.basename(train_data_file))[0]
+    return os.path.join(os.path.splitext(go_file)[0] + '_artifacts', name)
+
+
+def get_release_sources(go_file, train_data_file):
+    """Identity of the files the release artifacts were computed from."""
+    return {
+        'version': GO_IC_CACHE_VERSION,
+        'go_file': hash_file(go_file),
+        'train_data_file': hash_file(train_data_file)
+    }
+
+
+def load_release_edges(go_file, train_data_file, namespace):
+    """Edge weights of ``namespace`` saved by ``ontology_diff`` for these
+    exact files, None when they are missing or stale."""
+    release_dir = get_release_dir(go_file, train_data_file)
+    sources_file = os.path.join(release_dir, 'sources.pkl')
+    if not os.path.exists(sources_file):
+        return None
+    with open(sources_file, 'rb') as f:
+        if pickle.load(f) != get_release_sources(go_file, train_data_file):
+            return None
+    with open(os.path.join(release_dir, 'edges.pkl'), 'rb') as f:
+        edges = pickle.load(f)
+    return [(children, parent, weight)
+            for (children, parent), weight in edges[namespace].items()]
+
+
+def get_go_ic(namespace='bpo', data_path=None, use_cache=True):
     go_file = os.path.join(data_path, 'go_cafa3.obo')
     train_data_file = os.path.join(data_path, namespace,
                                    namespace + '_train_data.pkl')
+    if use_cache:
+        cache_file = get_go_ic_cache_file(go_file, train_data_file,
+                                          os.path.join(data_path, namespace))
+        if os.path.exists(cache_file):
+            logger.info(f'Loading GO edge weights from {cache_file}')
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        # carried over from the previous release by ontology_diff
+        all_go_cnt = load_release_edges(go_file, train_data_file, namespace)
+        if all_go_cnt is not None:
+            logger.info('Loading GO edge weights from %s' %
+                        get_release_dir(go_file, train_data_file))
+            return all_go_cnt
+
     freq_dict = statistic_terms(train_data_file)
     annotated_terms = freq_dict.keys()
-    edges = make_edges(go_file, namespace,False,annotated_terms)
+    edges = make_edges(go_file, namespace, False, annotated_terms)
     all_children, alt_id = read_go_children(go_file)
     go_ic = calculate_information_contents_of_GO_terms(freq_dict, all_children,
                                                        alt_id)
     all_go_cnt = get_all_go_cnt(edges, freq_dict, all_children, go_ic)
+
+    if use_cache:
+        with open(cache_file, 'wb') as f:
+            pickle.dump(all_go_cnt, f)
+        logger.info(f'Saved GO edge weights to {cache_file}')
     return all_go_cnt
 
 
@@ -36,16 +36,29 @@ def load_node_list(all_go_ic):
 
 
 def build_adj(idx, IC, idx_map):
-    adj_new = []
-    for i in range(len(idx_map)):
-        tmp = [0] * (len(idx_map))
-        adj_new.append(tmp)
-
-    for i in range(len(idx)):
-        adj_new[idx[i][0]][idx[i][1]] = IC[i]
-        adj_new[idx[i][1]][idx[i][0]] = IC[i]
-    adj_new = np.array(adj_new)
-    return adj_new
+    """Build the symmetric IC-weighted adjacency directly in COO format.
+
+    Every edge ``(i, j)`` writes its IC to both ``(i, j)`` and ``(j, i)``.
+    When several edges hit the same cell the last one written wins, which
+    matches filling a dense ``N x N`` matrix edge by edge.
+    """
+    num_nodes = len(idx_map)
+    idx = np.asarray(idx, dtype=np.int64).reshape(-1, 2)
+    IC = np.asarray(IC, dtype=np.float64)
+
+    row = np.stack([idx[:, 0], idx[:, 1]], axis=1).reshape(-1)
+    col = np.stack([idx[:, 1], idx[:, 0]], axis=1).reshape(-1)
+    data = np.repeat(IC, 2)
+
+    # keep the last write per cell
+    key = row * num_nodes + col
+    _, first_in_reversed = np.unique(key[::-1], return_index=True)
+    last = len(key) - 1 - first_in_reversed
+
+    adj = sp.coo_matrix((data[last], (row[last], col[last])),
+                        shape=(num_nodes, num_nodes))
+    adj.eliminate_zeros()
+    return adj
 
 
 def normalize(adj):
@@ -63,7 +76,7 @@ def sparse_mx_to_torch_sparse_tensor(sparse_adj):
         np.vstack((sparse_adj.row, sparse_adj.col)).astype(np.int64))
     values = torch.from_numpy(sparse_adj.data)
     shape = torch.Size(sparse_adj.shape)
-    return torch.sparse.LongTensor(indices, values, shape)
+    return torch.sparse_coo_tensor(indices, values, shape)
 
 
 def one_hot_encoding(path, go_index, ldx_map_ivs):
@@ -94,28 +107,24 @@ def one_hot_encoding(path, go_index, ldx_map_ivs):
 
 
 def multi_hot_encoding(label_map, label_map_ivs, go_file):
+    """Sparse ``N x N`` ancestor indicator matrix used as GCN node features.
+
+    Row ``k`` marks the term ``label_map_ivs[k]`` and all of its ancestors
+    that are part of ``label_map``.
+    """
     go_ont = Ontology(go_file)
-    multi_hot = []
-    go = {}
-    for term in label_map.keys():
-        if term not in label_map.keys():
-            continue
-        ancestors = set(go_ont.get_anchestors(term))
-        ancestors_namespace = ancestors.intersection(set(label_map.keys()))
-        tmp = [0] * len(label_map)
-        if len(ancestors_namespace) == 1:
-            index = label_map[term]
-            tmp[index] = 1
-        else:
-            for ancestor in ancestors:
-                index = label_map[ancestor]
-                tmp[index] = 1
-        go[term] = tmp
+    rows = []
+    cols = []
     for k in range(len(label_map_ivs)):
-        tmp_go = label_map_ivs[k]
-        if tmp_go in go.keys():
-            multi_hot.append(go[tmp_go])
-    multi_hot = torch.FloatTensor(multi_hot)
+        term = label_map_ivs[k]
+        for ancestor in go_ont.get_ancestors(term):
+            if ancestor in label_map:
+                rows.append(k)
+                cols.append(label_map[ancestor])
+    indices = torch.from_numpy(np.array([rows, cols], dtype=np.int64))
+    values = torch.ones(len(rows), dtype=torch.float32)
+    shape = torch.Size((len(label_map_ivs), len(label_map)))
+    multi_hot = torch.sparse_coo_tensor(indices, values, shape).coalesce()
     return multi_hot
 
 
@@ -148,7 +157,6 @@ def build_graph(data_path='.data/', namespace='bpo'):
 
     # build symmetric adjacency matrix
     adj = build_adj(idx_2d, IC, idx_map)
-    adj = sp.coo_matrix(adj)
     adj = adj + np.multiply(adj.T, adj.T > adj) - np.multiply(
         adj, (adj.T > adj))
     adj = normalize(adj + sp.eye(adj.shape[0]))
@@ -34,10 +34,10 @@ def adjust_learning_rate(optimizer, epoch, args):
     return lr
 
 
-def load_model_checkpoint(checkpoint_path):
+def load_model_checkpoint(checkpoint_path, map_location='cuda:0'):
     if os.path.isfile(checkpoint_path):
         print("=> loading checkpoint '{}'".format(checkpoint_path))
-        checkpoint = torch.load(checkpoint_path, map_location='cuda:0')
+        checkpoint = torch.load(checkpoint_path, map_location=map_location)
         if isinstance(checkpoint, dict) and 'state_dict' in checkpoint:
             model_state = OrderedDict()
             for k, v in checkpoint['state_dict'].items():
@@ -0,0 +1,138 @@
+import argparse
+import logging
+
+import torch
+import yaml
+
+from deepfold.core.evaluation.predictions import (DEFAULT_MIN_SCORE,
+                                                  DEFAULT_TOP_K)
+from deepfold.trainer.pipeline import annotate_fasta
+from deepfold.trainer.serving import load_predictor
+
+# The first arg parser parses out only the --config argument, this argument is used to
+# load a yaml file containing key-values that override the defaults for the main parser below
+config_parser = parser = argparse.ArgumentParser(description='Pipeline Config',
+                                                 add_help=False)
+parser.add_argument('-c',
+                    '--config',
+                    default='',
+                    type=str,
+                    metavar='FILE',
+                    help='YAML config file specifying default arguments')
+parser = argparse.ArgumentParser(
+    description='Annotate a proteome with GO terms: FASTA -> ESM '
+    'embeddings -> head -> propagation, streamed')
+parser.add_argument('--fasta_file',
+                    required=True,
+                    type=str,
+                    help='proteome FASTA file (plain or .gz)')
+parser.add_argument('--output_dir',
+                    required=True,
+                    type=str,
+                    help='sparse predictions directory')
+parser.add_argument('--cafa_file',
+                    default='',
+                    type=str,
+                    help='also write a CAFA file (.gz / .zst compressed)')
+parser.add_argument('--embeddings_file',
+                    default='',
+                    type=str,
+                    help='also keep the embeddings (.h5 / .hdf5 bulk store)')
+parser.add_argument('--data_path',
+                    default='',
+                    type=str,
+                    help='data dir of dataset')
+parser.add_argument('--model',
+                    default='mlp',
+                    choices=['mlp', 'protgcn'],
+                    help='prediction head on top of the ESM embeddings')
+parser.add_argument('--namespace',
+                    default='bpo',
+                    type=str,
+                    help='label graph of the protgcn model')
+parser.add_argument('--terms_file',
+                    default='terms.pkl',
+                    type=str,
+                    help='terms of the mlp model, relative to data_path')
+parser.add_argument('--resume',
+                    required=True,
+                    type=str,
+                    metavar='PATH',
+                    help='model checkpoint')
+parser.add_argument('--go_file',
+                    default='go.obo',
+                    help='ontology used to propagate the scores, relative '
+                    'to data_path (empty: no propagation)')
+parser.add_argument('--esm_model',
+                    default='esm1b_t33_650M_UR50S',
+                    type=str,
+                    help='ESM model computing the embeddings')
+parser.add_argument('--pool_mode', default='mean', help='embedding method')
+parser.add_argument('--embed_dim', default=1280, type=int)
+parser.add_argument('--device',
+                    default='cuda' if torch.cuda.is_available() else 'cpu',
+                    type=str)
+parser.add_argument('--max_tokens',
+                    default=16384,
+                    type=int,
+                    help='residues per embedding batch')
+parser.add_argument('--buffer_size',
+                    default=10000,
+                    type=int,
+                    help='records sorted by length at a time')
+parser.add_argument('--queue_size',
+                    default=4,
+                    type=int,
+                    help='batches buffered between two stages')
+parser.add_argument('--top-k', default=DEFAULT_TOP_K, type=int)
+parser.add_argument('--min-score', default=DEFAULT_MIN_SCORE, type=float)
+parser.add_argument('--log_interval',
+                    default=30,
+                    type=int,
+                    help='seconds between stage throughput reports')
+
+
+def main(args):
+    predictor = load_predictor(args.resume,
+                               model=args.model,
+                               data_path=args.data_path,
+                               terms_file=args.terms_file,
+                               namespace=args.namespace,
+                               go_file=args.go_file,
+                               esm_model=args.esm_model,
+                               embed_dim=args.embed_dim,
+                               device=args.device,
+                               pool_mode=args.pool_mode,
+                               max_tokens=args.max_tokens,
+                               top_k=args.top_k,
+                               min_score=args.min_score)
+    stats = annotate_fasta(predictor,
+                           args.fasta_file,
+                           args.output_dir,
+                           cafa_file=args.cafa_file or None,
+                           embeddings_file=args.embeddings_file or None,
+                           buffer_size=args.buffer_size,
+                           queue_size=args.queue_size,
+                           log_interval=args.log_interval)
+    bottleneck = max(stats, key=lambda name: stats[name]['busy_s'])
+    logger.info(f'Annotated {stats["write"]["items"]} proteins, '
+                f'bottleneck: {bottleneck}')
+    logger.info(f'Saving predictions to {args.output_dir}')
+
+
+def _parse_args():
+    # Do we have a config file to parse?
+    args_config, remaining = config_parser.parse_known_args()
+    if args_config.config:
+        with open(args_config.config, 'r') as f:
+            cfg = yaml.safe_load(f)
+            parser.set_defaults(**cfg)
+    return parser.parse_args(remaining)
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    logger = logging.getLogger('')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    main(args)
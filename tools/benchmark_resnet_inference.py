@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+
+import torch
+from torch.utils.data import Dataset
+
+from deepfold.utils.registry import TAPETaskSpec, registry
+
+# modeling_resnet registers its heads on the TAPE tasks at import time; no
+# dataset module of this repo registers them, so declare them here first
+for task_name in ('embed', 'masked_language_modeling', 'fluorescence',
+                  'stability', 'remote_homology', 'secondary_structure',
+                  'contact_prediction'):
+    if task_name not in registry.task_name_mapping:
+        registry.register_task_spec(task_name,
+                                    TAPETaskSpec(task_name, Dataset))
+
+from deepfold.models.modeling_resnet import (  # noqa: E402
+    ProteinResNetConfig, ProteinResNetModel)
+
+sys.path.append('../')
+
+parser = argparse.ArgumentParser(
+    description='Benchmark ProteinResNetModel.forward against the fast '
+    'inference path on CPU')
+parser.add_argument('--num_hidden_layers', default=30, type=int)
+parser.add_argument('--hidden_size', default=512, type=int)
+parser.add_argument('-b', '--batch-size', default=8, type=int)
+parser.add_argument('--max_length', default=1024, type=int)
+parser.add_argument('--min_length',
+                    default=256,
+                    type=int,
+                    help='sequence lengths are drawn in [min_length, '
+                    'max_length], the batch is padded to max_length')
+parser.add_argument('--chunk_size',
+                    default=None,
+                    type=int,
+                    help='window size of the chunked inference path')
+parser.add_argument('--repeats', default=3, type=int)
+parser.add_argument('--threads', default=None, type=int)
+parser.add_argument('--seed', default=42, type=int)
+
+
+def timeit(fn, repeats):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    config = ProteinResNetConfig(hidden_size=args.hidden_size,
+                                 num_hidden_layers=args.num_hidden_layers)
+    model = ProteinResNetModel(config).eval()
+
+    lengths = torch.randint(args.min_length, args.max_length + 1,
+                            (args.batch_size, ))
+    input_ids = torch.randint(1, config.vocab_size,
+                              (args.batch_size, args.max_length))
+    input_mask = (torch.arange(args.max_length).unsqueeze(0) <
+                  lengths.unsqueeze(1)).long()
+    input_ids = input_ids * input_mask
+
+    with torch.no_grad():
+        reference = model(input_ids, input_mask)[0]
+    fast = model.inference(input_ids, input_mask, chunk_size=args.chunk_size)[0]
+    max_diff = ((reference - fast) * input_mask.unsqueeze(2)).abs().max()
+
+    def run_forward():
+        with torch.no_grad():
+            model(input_ids, input_mask)
+
+    def run_inference():
+        model.inference(input_ids, input_mask, chunk_size=args.chunk_size)
+
+    forward_time = timeit(run_forward, args.repeats)
+    inference_time = timeit(run_inference, args.repeats)
+    print('batch %d x %d, %d layers, hidden %d, chunk_size %s' %
+          (args.batch_size, args.max_length, args.num_hidden_layers,
+           args.hidden_size, args.chunk_size))
+    print('forward:   %.3fs / batch' % forward_time)
+    print('inference: %.3fs / batch (x%.2f)' %
+          (inference_time, forward_time / inference_time))
+    print('max abs diff on real residues: %.2e' % max_diff)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -5,12 +5,13 @@ import logging
 import os
 import sys
 
-import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 
-from deepfold.core.metrics.custom_metrics import evaluate_annotations
-from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
+from deepfold.core.evaluation.predictions import load_model_preds
+from deepfold.core.evaluation.propagation import TruePathPropagator
+from deepfold.core.evaluation.runner import evaluate_all
+from deepfold.data.utils.data_utils import NAMESPACES
 from deepfold.data.utils.ontology import Ontology
 
 sys.path.append('../')
@@ -43,74 +44,26 @@ parser.add_argument('--ontology-obo-file',
                     default='data/go.obo',
                     help='Ontology file')
 parser.add_argument('--output_dir', '-o', default='./', help='output dir')
+parser.add_argument('--predictions',
+                    nargs='+',
+                    required=True,
+                    help='Sparse predictions directories written by the '
+                    'inference tools, one model each')
+parser.add_argument('--model-names',
+                    nargs='*',
+                    default=None,
+                    help='Name of every --predictions model in the results '
+                    '(default: the directory names)')
+parser.add_argument('--num-workers',
+                    '-nw',
+                    default=None,
+                    type=int,
+                    help='Processes evaluating the (model, namespace) pairs, '
+                    '0 evaluates in the main process')
 
 alphas = {NAMESPACES['mf']: 0, NAMESPACES['bp']: 0, NAMESPACES['cc']: 0}
 
 
-def get_model_preds(test_df, terms):
-    model_preds = []
-    for i, row in enumerate(test_df.itertuples()):
-        annots_dict = {}
-        for j, score in enumerate(row.preds):
-            go_id = terms[j]
-            annots_dict[go_id] = score
-        model_preds.append(annots_dict)
-
-    return model_preds
-
-
-def evaluate_model_prediction(labels, terms, model_preds, go_rels, ont):
-    fmax = 0.0
-    tmax = 0.0
-    smin = 1000.0
-    precisions = []
-    recalls = []
-    # go set
-    go_set = go_rels.get_namespace_terms(NAMESPACES[ont])
-    go_set.remove(FUNC_DICT[ont])
-    # labels
-    labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), labels))
-    for t in range(0, 101, 10):
-        threshold = t / 100.0
-        preds = []
-        for i, _ in enumerate(model_preds):
-            annots = set()
-            pred_score = model_preds[i]
-            pred_label = terms[pred_score > threshold]
-            annots = set(pred_label)
-
-            new_annots = set()
-            for go_id in annots:
-                new_annots |= go_rels.get_anchestors(go_id)
-            preds.append(new_annots)
-
-        # Filter classes
-        preds = list(
-            map(lambda x: set(filter(lambda y: y in go_set, x)), preds))
-
-        fscore, prec, rec, s, _, _, _, _ = evaluate_annotations(
-            go_rels, labels, preds)
-
-        precisions.append(prec)
-        recalls.append(rec)
-        logger.info(f'Fscore: {fscore}, S: {s}, threshold: {threshold}')
-        if fmax < fscore:
-            fmax = fscore
-            tmax = threshold
-        if smin > s:
-            smin = s
-
-    logger.info(f'Fmax: {fmax:0.3f}, Smin: {smin:0.3f}, threshold: {tmax}')
-    precisions = np.array(precisions)
-    recalls = np.array(recalls)
-    sorted_index = np.argsort(recalls)
-    recalls = recalls[sorted_index]
-    precisions = precisions[sorted_index]
-    aupr = np.trapz(precisions, recalls)
-    logger.info(f'AUPR: {aupr:0.3f}')
-    return precisions, recalls, aupr
-
-
 def plot_diamond_aupr(precisions, recalls, aupr, ont, save_path):
     plt.figure()
     plt.plot(recalls,
@@ -133,7 +86,24 @@ def main(train_data_file,
          terms_file,
          go_obo_file,
          output_dir=None,
-         onts=('bp', 'mf', 'cc')):
+         onts=('bp', 'mf', 'cc'),
+         predictions_paths=(),
+         num_workers=None,
+         model_names=None):
+
+    if not predictions_paths:
+        raise ValueError('No predictions directories to evaluate')
+    if model_names is None:
+        model_names = [
+            os.path.basename(os.path.normpath(path))
+            for path in predictions_paths
+        ]
+    if len(model_names) != len(predictions_paths):
+        raise ValueError('Got %d model names for %d predictions' %
+                         (len(model_names), len(predictions_paths)))
+    if len(set(model_names)) != len(model_names):
+        raise ValueError('Duplicate model names %s, set --model-names' %
+                         model_names)
 
     go_rels = Ontology(go_obo_file, with_rels=True)
     terms_df = pd.read_pickle(terms_file)
@@ -148,20 +118,24 @@ def main(train_data_file,
     test_annotations = list(map(lambda x: set(x), test_annotations))
     go_rels.calculate_ic(annotations + test_annotations)
 
-    ics = {}
-    for term in terms:
-        ics[term] = go_rels.get_ic(term)
-
-    prot_index = {}
-    for i, row in enumerate(train_df.itertuples()):
-        prot_index[row.proteins] = i
-
-    model_preds = list(test_df.preds)
-    for ont in onts:
-        logger.info(f'Evaluate the {ont} protein family')
-        precisions, recalls, aupr = evaluate_model_prediction(
-            test_annotations, terms, model_preds, go_rels, ont)
-        plot_diamond_aupr(precisions, recalls, aupr, ont, output_dir)
+    # propagate once, every namespace and threshold reads the same matrix
+    propagator = TruePathPropagator(go_rels, terms)
+    models = dict(zip(model_names, predictions_paths))
+    predictions = dict(
+        (model, (propagator.terms,
+                 propagator(load_model_preds(test_df, terms, path))))
+        for model, path in models.items())
+    results, curves = evaluate_all(go_rels,
+                                   test_annotations,
+                                   predictions,
+                                   onts=onts,
+                                   num_workers=num_workers)
+    results.to_csv(os.path.join(output_dir, 'results.csv'), index=False)
+    for row in results.itertuples():
+        precisions, recalls = curves[(row.model, row.namespace)]
+        name = (row.namespace if len(models) == 1 else
+                f'{row.model}_{row.namespace}')
+        plot_diamond_aupr(precisions, recalls, row.aupr, name, output_dir)
 
 
 if __name__ == '__main__':
@@ -172,4 +146,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     main(args.train_data_file, args.test_data_file, args.terms_file,
-         args.ontology_obo_file, args.output_dir)
+         args.ontology_obo_file, args.output_dir,
+         predictions_paths=args.predictions,
+         num_workers=args.num_workers,
+         model_names=args.model_names)
@@ -7,8 +7,10 @@ import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 
-from deepfold.core.metrics.custom_metrics import evaluate_annotations
-from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
+from deepfold.core.evaluation.propagation import (TruePathPropagator,
+                                                  dicts_to_csr)
+from deepfold.core.evaluation.runner import evaluate_all
+from deepfold.data.utils.homology_search import KmerIndex, hits_to_dict
 from deepfold.data.utils.ontology import Ontology
 
 sys.path.append('../')
@@ -36,6 +38,16 @@ parser.add_argument('--ontology-obo-file',
                     default='data/go.obo',
                     help='Ontology file')
 parser.add_argument('--output_dir', '-o', default='./', help='output dir')
+parser.add_argument('--num-workers',
+                    '-nw',
+                    default=None,
+                    type=int,
+                    help='Processes evaluating the namespaces, 0 evaluates '
+                    'in the main process')
+parser.add_argument('--kmer-search',
+                    action='store_true',
+                    help='Search the test sequences in-process with a k-mer '
+                    'index instead of reading the Diamond output')
 
 
 def get_diamond_scores(diamond_scores_file):
@@ -102,66 +114,6 @@ def get_diamond_preds(train_df, test_df, diamond_scores):
     return diamond_preds
 
 
-def evaluate_diamond(test_df, blast_preds, go_rels, ont):
-    fmax = 0.0
-    tmax = 0.0
-    smin = 1000.0
-
-    precisions = []
-    recalls = []
-
-    # test_annotations
-    test_annotations = test_df['prop_annotations'].values
-    test_annotations = list(map(lambda x: set(x), test_annotations))
-
-    # go set
-    go_set = go_rels.get_namespace_terms(NAMESPACES[ont])
-    go_set.remove(FUNC_DICT[ont])
-
-    # labels
-    labels = test_annotations
-    labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), labels))
-
-    for t in range(0, 101, 10):
-        threshold = t / 100.0
-        preds = []
-        for i, row in enumerate(test_df.itertuples()):
-            annots = set()
-            for go_id, score in blast_preds[i].items():
-                if score >= threshold:
-                    annots.add(go_id)
-
-            new_annots = set()
-            for go_id in annots:
-                new_annots |= go_rels.get_anchestors(go_id)
-            preds.append(new_annots)
-
-        # Filter classes
-        preds = list(
-            map(lambda x: set(filter(lambda y: y in go_set, x)), preds))
-
-        fscore, prec, rec, s, _, _, _, _ = evaluate_annotations(
-            go_rels, labels, preds)
-        precisions.append(prec)
-        recalls.append(rec)
-        logger.info(f'Fscore: {fscore}, S: {s}, threshold: {threshold}')
-        if fmax < fscore:
-            fmax = fscore
-            tmax = threshold
-        if smin > s:
-            smin = s
-
-    logger.info(f'Fmax: {fmax:0.3f}, Smin: {smin:0.3f}, threshold: {tmax}')
-    precisions = np.array(precisions)
-    recalls = np.array(recalls)
-    sorted_index = np.argsort(recalls)
-    recalls = recalls[sorted_index]
-    precisions = precisions[sorted_index]
-    aupr = np.trapz(precisions, recalls)
-    logger.info(f'AUPR: {aupr:0.3f}')
-    return precisions, recalls, aupr
-
-
 def plot_diamond_aupr(precisions, recalls, aupr, ont, save_path):
     plt.figure()
     plt.plot(recalls,
@@ -183,7 +135,9 @@ def main(train_data_file,
          diamond_scores_file,
          go_obo_file,
          output_dir=None,
-         onts=('bp', 'mf', 'cc')):
+         onts=('bp', 'mf', 'cc'),
+         kmer_search=False,
+         num_workers=None):
 
     go_rels = Ontology(go_obo_file, with_rels=True)
 
@@ -196,16 +150,30 @@ def main(train_data_file,
     test_annotations = list(map(lambda x: set(x), test_annotations))
     go_rels.calculate_ic(annotations + test_annotations)
 
-    diamond_scores = get_diamond_scores(diamond_scores_file)
+    if kmer_search:
+        index = KmerIndex(train_df['sequences'], train_df['proteins'])
+        diamond_scores = hits_to_dict(
+            index.search(test_df['sequences'], test_df['proteins']))
+    else:
+        diamond_scores = get_diamond_scores(diamond_scores_file)
     blast_preds = get_diamond_preds(train_df, test_df, diamond_scores)
-    for ont in onts:
-        logger.info(f'Evaluate the {ont} protein family')
-        go_set = go_rels.get_namespace_terms(NAMESPACES[ont])
-        go_set.remove(FUNC_DICT[ont])
-
-        precisions, recalls, aupr = evaluate_diamond(test_df, blast_preds,
-                                                     go_rels, ont)
-        plot_diamond_aupr(precisions, recalls, aupr, ont, output_dir)
+    # propagate once, every namespace and threshold reads the same matrix
+    terms, blast_scores = dicts_to_csr(blast_preds)
+    propagator = TruePathPropagator(go_rels, terms)
+    blast_scores = propagator(blast_scores)
+    # thresholds are inclusive: a transferred score equal to it counts
+    predictions = {'diamond': (propagator.terms, blast_scores)}
+    results, curves = evaluate_all(go_rels,
+                                   test_annotations,
+                                   predictions,
+                                   onts=onts,
+                                   inclusive=True,
+                                   num_workers=num_workers)
+    results.to_csv(output_dir + 'results.csv', index=False)
+    for row in results.itertuples():
+        precisions, recalls = curves[(row.model, row.namespace)]
+        plot_diamond_aupr(precisions, recalls, row.aupr, row.namespace,
+                          output_dir)
 
 
 if __name__ == '__main__':
@@ -216,4 +184,6 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     main(args.train_data_file, args.test_data_file, args.diamond_scores_file,
-         args.ontology_obo_file, args.output_dir)
+         args.ontology_obo_file, args.output_dir,
+         kmer_search=args.kmer_search,
+         num_workers=args.num_workers)
@@ -9,6 +9,9 @@ import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 
+from deepfold.core.evaluation.predictions import load_model_preds
+from deepfold.core.evaluation.propagation import (TruePathPropagator,
+                                                  annotation_sets)
 from deepfold.core.metrics.custom_metrics import evaluate_annotations
 from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
 from deepfold.data.utils.ontology import Ontology
@@ -43,22 +46,14 @@ parser.add_argument('--ontology-obo-file',
                     default='data/go.obo',
                     help='Ontology file')
 parser.add_argument('--output_dir', '-o', default='./', help='output dir')
+parser.add_argument('--predictions',
+                    required=True,
+                    help='Sparse predictions directory written by the '
+                    'inference tools (<data_path>/..._predictions)')
 
 alphas = {NAMESPACES['mf']: 0, NAMESPACES['bp']: 0, NAMESPACES['cc']: 0}
 
 
-def get_model_preds(test_df, terms):
-    model_preds = []
-    for i, row in enumerate(test_df.itertuples()):
-        annots_dict = {}
-        for j, score in enumerate(row.preds):
-            go_id = terms[j]
-            annots_dict[go_id] = score
-        model_preds.append(annots_dict)
-
-    return model_preds
-
-
 def evaluate_model_prediction(labels, terms, model_preds, go_rels, ont):
     fmax = 0.0
     tmax = 0.0
@@ -70,23 +65,12 @@ def evaluate_model_prediction(labels, terms, model_preds, go_rels, ont):
     go_set.remove(FUNC_DICT[ont])
     # labels
     labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), labels))
+    # model_preds are propagated (TruePathPropagator), keep the namespace
+    columns = np.flatnonzero(np.isin(terms, list(go_set)))
+    terms, model_preds = terms[columns], model_preds[:, columns]
     for t in range(0, 101, 10):
         threshold = t / 100.0
-        preds = []
-        for i, _ in enumerate(model_preds):
-            annots = set()
-            pred_score = model_preds[i]
-            pred_label = terms[pred_score > threshold]
-            annots = set(pred_label)
-
-            new_annots = set()
-            for go_id in annots:
-                new_annots |= go_rels.get_anchestors(go_id)
-            preds.append(new_annots)
-
-        # Filter classes
-        preds = list(
-            map(lambda x: set(filter(lambda y: y in go_set, x)), preds))
+        preds = annotation_sets(model_preds, terms, threshold)
 
         fscore, prec, rec, s, _, _, _, _ = evaluate_annotations(
             go_rels, labels, preds)
@@ -133,7 +117,8 @@ def main(train_data_file,
          terms_file,
          go_obo_file,
          output_dir=None,
-         onts=('bp', 'mf', 'cc')):
+         onts=('bp', 'mf', 'cc'),
+         predictions_path=None):
 
     go_rels = Ontology(go_obo_file, with_rels=True)
     terms_df = pd.read_pickle(terms_file)
@@ -156,11 +141,14 @@ def main(train_data_file,
     for i, row in enumerate(train_df.itertuples()):
         prot_index[row.proteins] = i
 
-    model_preds = list(test_df.preds)
+    model_preds = load_model_preds(test_df, terms, predictions_path)
+    # propagate once, every namespace and threshold reads the same matrix
+    propagator = TruePathPropagator(go_rels, terms)
+    model_preds = propagator(model_preds)
     for ont in onts:
         logger.info(f'Evaluate the {ont} protein family')
         precisions, recalls, aupr = evaluate_model_prediction(
-            test_annotations, terms, model_preds, go_rels, ont)
+            test_annotations, propagator.terms, model_preds, go_rels, ont)
         plot_diamond_aupr(precisions, recalls, aupr, ont, output_dir)
 
 
@@ -172,4 +160,5 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     main(args.train_data_file, args.test_data_file, args.terms_file,
-         args.ontology_obo_file, args.output_dir)
+         args.ontology_obo_file, args.output_dir,
+         predictions_path=args.predictions)
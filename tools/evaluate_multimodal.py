@@ -10,6 +10,9 @@ import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 
+from deepfold.core.evaluation.predictions import load_model_preds
+from deepfold.core.evaluation.propagation import (TruePathPropagator,
+                                                  annotation_sets)
 from deepfold.core.metrics.custom_metrics import evaluate_annotations
 from deepfold.data.utils.data_utils import FUNC_DICT, NAMESPACES
 from deepfold.data.utils.ontology import Ontology
@@ -37,21 +40,13 @@ parser.add_argument('--ontology-obo-file',
                     help='Ontology file')
 parser.add_argument('--namespace', default='', type=str, help='cco, mfo, bpo')
 parser.add_argument('--output_dir', '-o', default='./', help='output dir')
+parser.add_argument('--predictions',
+                    required=True,
+                    help='Sparse predictions directory written by the '
+                    'inference tools (<data_path>/..._predictions)')
 parser.add_argument('--ont', default='bp', help='bp, mf, cc')
 
 
-def get_model_preds(test_df, terms):
-    model_preds = []
-    for i, row in enumerate(test_df.itertuples()):
-        annots_dict = {}
-        for j, score in enumerate(row.preds):
-            go_id = terms[j]
-            annots_dict[go_id] = score
-        model_preds.append(annots_dict)
-
-    return model_preds
-
-
 def evaluate_model_prediction(labels, terms, model_preds, go_rels, ont,
                               logger):
     fmax = 0.0
@@ -64,23 +59,12 @@ def evaluate_model_prediction(labels, terms, model_preds, go_rels, ont,
     go_set.remove(FUNC_DICT[ont])
     # labels
     labels = list(map(lambda x: set(filter(lambda y: y in go_set, x)), labels))
+    # model_preds are propagated (TruePathPropagator), keep the namespace
+    columns = np.flatnonzero(np.isin(terms, list(go_set)))
+    terms, model_preds = terms[columns], model_preds[:, columns]
     for t in range(0, 101, 10):
         threshold = t / 100.0
-        preds = []
-        for i, _ in enumerate(model_preds):
-            annots = set()
-            pred_score = model_preds[i]
-            pred_label = terms[pred_score > threshold]
-            annots = set(pred_label)
-
-            new_annots = set()
-            for go_id in annots:
-                new_annots |= go_rels.get_anchestors(go_id)
-            preds.append(new_annots)
-
-        # Filter classes
-        preds = list(
-            map(lambda x: set(filter(lambda y: y in go_set and y in terms, x)), preds))
+        preds = annotation_sets(model_preds, terms, threshold)
 
         fscore, prec, rec, s, _, _, _, _ = evaluate_annotations(
             go_rels, labels, preds)
@@ -126,7 +110,8 @@ def main(train_data_file,
          test_data_file,
          go_obo_file,
          output_dir=None,
-         ont='bp'):
+         ont='bp',
+         predictions_path=None):
 
     go_rels = Ontology(go_obo_file, with_rels=True)
     _, _, label_map, label_map_ivs = build_graph(data_path=args.data_path,
@@ -151,7 +136,10 @@ def main(train_data_file,
     for i, row in enumerate(train_df.itertuples()):
         prot_index[row.proteins] = i
 
-    model_preds = list(test_df.preds)
+    model_preds = load_model_preds(test_df, terms, predictions_path)
+    # only the label terms are scored, the added ancestors are dropped
+    model_preds = TruePathPropagator(go_rels, terms)(model_preds)
+    model_preds = model_preds[:, :len(terms)]
 
     logger.info(f'Evaluate the {ont} protein family')
     precisions, recalls, aupr = evaluate_model_prediction(
@@ -166,4 +154,4 @@ if __name__ == '__main__':
     logger.addHandler(streamhandler)
     args = parser.parse_args()
     main(args.train_data_file, args.test_data_file, args.ontology_obo_file,
-         args.output_dir, args.ont)
+         args.output_dir, args.ont, predictions_path=args.predictions)
@@ -10,8 +10,10 @@ import torch.backends.cudnn as cudnn
 from torch.utils.data import DataLoader
 
 from deepfold.data.esm_dataset import EsmDataset
+from deepfold.data.utils.fasta import FastaFile
 from deepfold.models.esm_model import EsmTransformer
-from deepfold.trainer.embeds import extract_esm_embedds
+from deepfold.trainer.embeds import (extract_esm_embedds,
+                                     extract_fasta_embeddings)
 
 sys.path.append('../')
 
@@ -48,6 +50,15 @@ parser.add_argument('-b',
                     type=int,
                     metavar='N',
                     help='mini-batch size (default: 256) per gpu')
+parser.add_argument('--fasta_file',
+                    default=None,
+                    type=str,
+                    help='embed all records of a (multi-GB) fasta file '
+                    'instead of the dataset split')
+parser.add_argument('--max_tokens',
+                    default=16384,
+                    type=int,
+                    help='residues per length-sorted fasta batch')
 
 
 def compute_kernel_bias(vecs):
@@ -62,8 +73,30 @@ def compute_kernel_bias(vecs):
     return W, -mu
 
 
+def embed_fasta(args, model_name):
+    fasta = FastaFile(args.fasta_file)
+    save_file = os.path.splitext(
+        args.fasta_file)[0] + '_' + model_name + '_' + args.pool_mode + '.npy'
+    model = EsmTransformer(model_dir=model_name, pool_mode=args.pool_mode)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = model.to(device).eval()
+    extract_fasta_embeddings(model,
+                             fasta,
+                             save_file,
+                             pool_mode=args.pool_mode,
+                             max_tokens=args.max_tokens,
+                             logger=logger,
+                             device=device)
+    # row i of the embeddings belongs to fasta.ids[i]
+    pd.DataFrame({'proteins': fasta.ids}).to_pickle(
+        os.path.splitext(save_file)[0] + '_ids.pkl')
+    print('Embeddings saved to :', save_file)
+
+
 def main(args):
     model_name = 'esm1b_t33_650M_UR50S'
+    if args.fasta_file is not None:
+        return embed_fasta(args, model_name)
     if args.split == 'train':
         data_file = os.path.join(args.data_path, 'cco/cco_train_data.pkl')
         file_name = 'cco/cco_train_data.pkl'
@@ -3,14 +3,14 @@ import logging
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 import torch
 import torch.backends.cudnn as cudnn
-from torch.utils.data import DataLoader
 from transformers import AutoModelForSequenceClassification
 
 from deepfold.data.ontotextual_dataset import OntoTextDataset
-from deepfold.trainer.embeds import extract_sentence_embedds
+from deepfold.trainer.embeds import extract_text_embeddings
 
 sys.path.append('../')
 
@@ -35,12 +35,6 @@ parser.add_argument('--model',
                     help='model architecture: (default: bert)')
 parser.add_argument('--pool_mode', default='mean', help='embedding method')
 parser.add_argument('--fintune', default=True, type=bool, help='fintune model')
-parser.add_argument('-j',
-                    '--workers',
-                    type=int,
-                    default=4,
-                    metavar='N',
-                    help='how many training processes to use (default: 1)')
 parser.add_argument('-b',
                     '--batch-size',
                     default=256,
@@ -51,6 +45,12 @@ parser.add_argument('--embedding_file_name',
                     default='',
                     type=str,
                     help='embedding_file_name to be saved')
+parser.add_argument('--previous_embedding_file',
+                    default=None,
+                    type=str,
+                    help='embeddings of a previous GO release computed with '
+                    'the same model and pool_mode, unchanged definitions are '
+                    'reused')
 
 
 def main(args):
@@ -60,36 +60,42 @@ def main(args):
                               obo_file=args.obo_file,
                               max_length=512)
 
-    # dataloders
-    data_loader = DataLoader(dataset,
-                             batch_size=args.batch_size,
-                             shuffle=False,
-                             num_workers=args.workers,
-                             pin_memory=True)
     # model
     model_name = args.pretrain_model_dir
-    data_file = os.path.join(args.data_path, 'GotermText.csv')
-    assert os.path.exists(data_file)
     save_path = os.path.join(
         args.data_path,
         'onto_embeddings_' + args.pool_mode + '_' + args.embedding_file_name)
-    print('Pretrained model %s, pool_mode: %s,  file path: %s' %
-          (model_name, args.pool_mode, data_file))
+    print('Pretrained model %s, pool_mode: %s' %
+          (model_name, args.pool_mode))
     print('Embeddings save path: ', save_path)
     # model
     model = AutoModelForSequenceClassification.from_pretrained(model_name,
                                                                num_labels=3)
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     model = model.to(device)
+    model.eval()
+
+    cache = None
+    if args.previous_embedding_file is not None:
+        previous_df = pd.read_pickle(args.previous_embedding_file)
+        cache = dict(
+            zip(previous_df['deftext'],
+                previous_df['embeddings'].apply(np.asarray)))
+
+    df = pd.DataFrame(dataset.data,
+                      columns=['term', 'name', 'namespace', 'deftext'])
     # run predict
-    embeddings = extract_sentence_embedds(model,
-                                          data_loader,
-                                          pool_mode=args.pool_mode,
-                                          logger=logger,
-                                          device=device)
+    embeddings = extract_text_embeddings(model,
+                                         dataset.tokenizer,
+                                         df['deftext'].tolist(),
+                                         pool_mode=args.pool_mode,
+                                         batch_size=args.batch_size,
+                                         max_length=dataset.max_length,
+                                         cache=cache,
+                                         logger=logger,
+                                         device=device)
     print(embeddings.shape)
 
-    df = pd.read_csv(data_file)
     df['embeddings'] = embeddings.tolist()
     df.to_pickle(save_path)
 
@@ -10,6 +10,8 @@ import torch.utils.data
 import torch.utils.data.distributed
 import yaml
 
+from deepfold.core.evaluation.predictions import (DEFAULT_TOP_K,
+                                                   save_predictions)
 from deepfold.data.dataset_factory import get_dataloaders
 from deepfold.models.model_factory import get_model
 from deepfold.trainer.training import predict
@@ -71,6 +73,10 @@ parser.add_argument('--output-dir',
                     default='./work_dirs',
                     type=str,
                     help='output directory for model and log')
+parser.add_argument('--top-k',
+                    default=DEFAULT_TOP_K,
+                    type=int,
+                    help='number of best scoring terms saved per protein')
 
 
 def main(args):
@@ -104,12 +110,15 @@ def main(args):
     test_data_path = os.path.join(args.data_path, 'test_data.pkl')
     test_df = pd.read_pickle(test_data_path)
 
-    preds, test_labels = predictions
-    test_df['labels'] = list(test_labels)
-    test_df['preds'] = list(preds)
-    df_path = os.path.join(args.data_path, args.model + '_predictions.pkl')
-    logger.info('Saveing predictions %s' % df_path)
-    test_df.to_pickle(df_path)
+    preds, _ = predictions
+    terms = test_loader.dataset.terms
+    pred_path = os.path.join(args.data_path, args.model + '_predictions')
+    save_predictions(pred_path,
+                     test_df['proteins'],
+                     terms,
+                     preds,
+                     top_k=args.top_k)
+    logger.info(f'Saving predictions to {pred_path}')
 
 
 def _parse_args():
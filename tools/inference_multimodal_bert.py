@@ -12,6 +12,8 @@ import torch.utils.data.distributed
 import yaml
 from torch.utils.data import DataLoader
 
+from deepfold.core.evaluation.predictions import (DEFAULT_TOP_K,
+                                                   save_predictions)
 from deepfold.data.multimodal_dataset import MultiModalDataset
 from deepfold.models.multimodal_model import ProtPubMedBert
 from deepfold.trainer.training import predict
@@ -71,6 +73,10 @@ parser.add_argument('--output-dir',
                     default='./work_dirs',
                     type=str,
                     help='output directory for model and log')
+parser.add_argument('--top-k',
+                    default=DEFAULT_TOP_K,
+                    type=int,
+                    help='number of best scoring terms saved per protein')
 
 
 def main(args):
@@ -110,12 +116,15 @@ def main(args):
                                   args.namespace + '_test_data.pkl')
     test_df = pd.read_pickle(test_data_path)
 
-    preds, test_labels = predictions
-    test_df['labels'] = list(test_labels)
-    test_df['preds'] = list(preds)
-    df_path = os.path.join(args.data_path, args.namespace + '_predictions.pkl')
-    test_df.to_pickle(df_path)
-    logger.info(f'Saving results to {df_path}')
+    preds, _ = predictions
+    terms = test_dataset.terms
+    pred_path = os.path.join(args.data_path, args.namespace + '_predictions')
+    save_predictions(pred_path,
+                     test_df['proteins'],
+                     terms,
+                     preds,
+                     top_k=args.top_k)
+    logger.info(f'Saving predictions to {pred_path}')
 
 
 def _parse_args():
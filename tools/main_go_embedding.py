@@ -2,12 +2,11 @@ import sys
 
 import torch
 import torch.optim as optim
-from torch.utils.data import DataLoader
 
 sys.path.append('../')
 
-from deepfold.data.goterm_dataset import OntoDataset
-from deepfold.models.go_embedder import GoEmbedder
+from deepfold.data.anc2vec_dataset import OntoDataset
+from deepfold.models.anc2vec_model import GoEmbedder
 from deepfold.utils.token_utils import save_token_embeddings
 
 if __name__ == '__main__':
@@ -15,19 +14,20 @@ if __name__ == '__main__':
     hidden_dim = 256
     batch_size = 1024
     num_epoch = 10
+    # sampled softmax for the term and neighbor heads, None for full softmax
+    num_negatives = 1024
 
     dataset = OntoDataset(
         data_dir='/home/niejianzheng/xbiome/datasets/protein',
         obo_file='/home/niejianzheng/xbiome/datasets/protein/go.obo')
 
     vocab = dataset.vocab
-    data_loader = DataLoader(dataset,
-                             batch_size=batch_size,
-                             collate_fn=dataset.collate_fn,
-                             shuffle=True)
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = GoEmbedder(len(vocab), embedding_dim, dropout=0.1)
+    model = GoEmbedder(len(vocab),
+                       embedding_dim,
+                       dropout=0.1,
+                       num_negatives=num_negatives)
     model.to(device)
     # 使用Adam优化器
     optimizer = optim.Adam(model.parameters(), lr=0.001)
@@ -35,17 +35,19 @@ if __name__ == '__main__':
     total_losses = []
     for epoch in range(num_epoch):
         total_loss = 0
-        for idx, batch in enumerate(data_loader):
+        for idx, batch in enumerate(
+                dataset.iter_batches(batch_size, shuffle=True, seed=epoch)):
             batch = {key: val.to(device) for key, val in batch.items()}
             optimizer.zero_grad()
             loss_term, loss_neighbor, loss_namespace = model(**batch)
             loss = loss_term + loss_neighbor + loss_namespace
             loss.backward()
             optimizer.step()
+            total_loss += loss.item()
             print(
                 'TermLoss: %f, NeighborLoss: %f, NamespaceLoss:%f , Loss : %f '
                 % (loss_term, loss_neighbor, loss_namespace, loss))
         total_losses.append(total_loss)
         # 保存词向量（model.embeddings）
-        save_token_embeddings(vocab, model.embeddings.weight.data,
+        save_token_embeddings(vocab, model.embedding.weight.data,
                               'goterm.vec')
@@ -1,10 +1,11 @@
 import logging
 import os
 import sys
-from collections import Counter
 
 import click as ck
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
 from deepfold.data.utils.ontology import Ontology
 from deepfold.utils.file_utils import read_fasta
@@ -13,6 +14,81 @@ sys.path.append('../')
 
 logging.basicConfig(level=logging.INFO)
 
+NAMESPACE_SPLITS = {
+    'bpo': 'biological_process',
+    'mfo': 'molecular_function',
+    'cco': 'cellular_component'
+}
+
+
+def load_annotations(annotations_file):
+    """(protein, GO id) pairs of a tab separated annotation file."""
+    return pd.read_csv(annotations_file,
+                       sep='\t',
+                       header=None,
+                       usecols=[0, 1],
+                       names=['proteins', 'terms'],
+                       dtype=str)
+
+
+def load_annotated_proteins(sequences_file, annotations_file, go):
+    """Proteins of the fasta file that have annotations, in fasta order.
+
+    Returns:
+        DataFrame with proteins, sequences and annotations (sets of GO ids)
+        and the CSR ``(proteins, terms)`` matrix of propagated annotations
+        over ``go.get_term_index()``.
+    """
+    pairs = load_annotations(annotations_file)
+    annots = pairs.groupby('proteins', sort=False)['terms'].agg(set)
+
+    info, seqs = read_fasta(sequences_file)
+    prot_ids = pd.Index([prot_info.split()[0] for prot_info in info])
+    # duplicated fasta records are kept once
+    keep = prot_ids.isin(annots.index) & ~prot_ids.duplicated()
+    proteins = prot_ids[keep]
+    df = pd.DataFrame({
+        'proteins': list(proteins),
+        'sequences': [seq for seq, k in zip(seqs, keep) if k],
+        'annotations': list(annots.loc[proteins]),
+    })
+
+    terms, term_index = go.get_term_index()
+    rows = pd.Index(proteins).get_indexer(pairs['proteins'])
+    cols = pairs['terms'].map(term_index).fillna(-1).to_numpy(np.int64)
+    valid = (rows >= 0) & (cols >= 0)
+    direct = sp.csr_matrix(
+        (np.ones(valid.sum(), dtype=np.float32), (rows[valid], cols[valid])),
+        shape=(len(proteins), len(terms)))
+    prop = direct.dot(go.ancestor_matrix()).tocsr()
+    prop.data[:] = 1.0
+    return df, prop
+
+
+def csr_to_term_sets(matrix, terms):
+    return [
+        set(terms[matrix.indices[start:end]])
+        for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])
+    ]
+
+
+def save_namespace_splits(df, prop, terms, namespaces, split, output_path):
+    """Save ``<ns>/<ns>_<split>_data.pkl`` for bpo, mfo and cco."""
+    for ns, namespace in NAMESPACE_SPLITS.items():
+        columns = np.flatnonzero(namespaces == namespace)
+        sub = prop[:, columns].tocsr()
+        rows = np.flatnonzero(np.diff(sub.indptr) > 0)
+        sub = sub[rows]
+        ns_df = pd.DataFrame({
+            'proteins': df['proteins'].values[rows],
+            'sequences': df['sequences'].values[rows],
+            'prop_annotations': csr_to_term_sets(sub, terms[columns]),
+        })
+        os.makedirs(os.path.join(output_path, ns), exist_ok=True)
+        ns_file = os.path.join(output_path, ns, f'{ns}_{split}_data.pkl')
+        logging.info(f'Saving {len(ns_df)} {ns} {split} proteins to {ns_file}')
+        ns_df.to_pickle(ns_file)
+
 
 @ck.command()
 @ck.option('--data_path',
@@ -59,9 +135,16 @@ logging.basicConfig(level=logging.INFO)
            '-op',
            default='./data',
            help='data root path to save all output files')
+@ck.option('--namespace-splits/--no-namespace-splits',
+           default=True,
+           help='Also save the bpo/mfo/cco train/test splits of '
+           'prepare_cafa3_data_seperate.py to <output_path>/<ns>/, and the '
+           'selected terms of each namespace as <ns>_terms.pkl (read by '
+           'EsmDataset(terms_name=...))')
 def main(data_path, output_path, go_file, train_sequences_file,
          train_annotations_file, test_sequences_file, test_annotations_file,
-         out_terms_file, train_data_file, test_data_file, min_count):
+         out_terms_file, train_data_file, test_data_file, min_count,
+         namespace_splits):
     logging.info('Loading GO')
     go_file = os.path.join(data_path, go_file)
     train_sequences_file = os.path.join(data_path, train_sequences_file)
@@ -73,109 +156,45 @@ def main(data_path, output_path, go_file, train_sequences_file,
     test_data_file = os.path.join(output_path, test_data_file)
 
     go = Ontology(go_file, with_rels=True)
+    terms, _ = go.get_term_index()
+    namespaces = go.get_namespace_array()
 
-    logging.info('Loading training annotations')
-    train_annots = {}
-    with open(train_annotations_file, 'r') as f:
-        for line in f.readlines():
-            it = line.strip().split('\t')
-            prot_id = it[0]
-            if prot_id not in train_annots:
-                train_annots[prot_id] = set()
-            go_id = it[1]
-            train_annots[prot_id].add(go_id)
-
-    logging.info('Loading training sequences')
-    info, seqs = read_fasta(train_sequences_file)
-    proteins = []
-    sequences = []
-    annotations = []
-    for prot_info, sequence in zip(info, seqs):
-        prot_id = prot_info.split()[0]
-        if prot_id in train_annots:
-            proteins.append(prot_id)
-            sequences.append(sequence)
-            annotations.append(train_annots[prot_id])
-
-    prop_annotations = []
-    cnt = Counter()
-    for annots in annotations:
-        # Propagate annotations
-        annots_set = set()
-        for go_id in annots:
-            annots_set |= go.get_anchestors(go_id)
-        prop_annotations.append(annots_set)
-        for go_id in annots_set:
-            cnt[go_id] += 1
-
-    df = pd.DataFrame({
-        'proteins': proteins,
-        'sequences': sequences,
-        'annotations': annotations,
-        'prop_annotations': prop_annotations,
-    })
+    logging.info('Loading training annotations and sequences')
+    df, train_prop = load_annotated_proteins(train_sequences_file,
+                                             train_annotations_file, go)
+    df['prop_annotations'] = csr_to_term_sets(train_prop, terms)
     logging.info(f'Train proteins: {len(df)}')
     logging.info(f'Saving training data to {train_data_file}')
     df.to_pickle(train_data_file)
+    if namespace_splits:
+        save_namespace_splits(df, train_prop, terms, namespaces, 'train',
+                              output_path)
 
     # Filter terms with annotations more than min_count
-    res = {}
-    for key, val in cnt.items():
-        if val >= min_count:
-            ont = key.split(':')[0]
-            if ont not in res:
-                res[ont] = []
-            res[ont].append(key)
-    terms = []
-    for key, val in res.items():
-        terms += val
-
-    logging.info(f'Number of terms {len(terms)}')
-    logging.info(f'Saving terms to {out_terms_file}')
-
-    df = pd.DataFrame({'terms': terms})
-    df.to_pickle(out_terms_file)
-
-    logging.info('Loading testing annotations')
-    test_annots = {}
-    with open(test_annotations_file, 'r') as f:
-        for line in f.readlines():
-            it = line.strip().split('\t')
-            prot_id = it[0]
-            if prot_id not in test_annots:
-                test_annots[prot_id] = set()
-            go_id = it[1]
-            test_annots[prot_id].add(go_id)
-
-    logging.info('Loading testing sequences')
-    info, seqs = read_fasta(test_sequences_file)
-    proteins = []
-    sequences = []
-    annotations = []
-    for prot_info, sequence in zip(info, seqs):
-        prot_id = prot_info.split()[0]
-        if prot_id in test_annots:
-            proteins.append(prot_id)
-            sequences.append(sequence)
-            annotations.append(test_annots[prot_id])
-
-    prop_annotations = []
-    for annots in annotations:
-        # Propagate annotations
-        annots_set = set()
-        for go_id in annots:
-            annots_set |= go.get_anchestors(go_id)
-        prop_annotations.append(annots_set)
+    cnt = np.asarray(train_prop.sum(axis=0)).ravel()
+    selected = np.flatnonzero(cnt >= min_count)
 
-    df = pd.DataFrame({
-        'proteins': proteins,
-        'sequences': sequences,
-        'annotations': annotations,
-        'prop_annotations': prop_annotations,
-    })
+    logging.info(f'Number of terms {len(selected)}')
+    logging.info(f'Saving terms to {out_terms_file}')
+    pd.DataFrame({'terms': list(terms[selected])}).to_pickle(out_terms_file)
+    if namespace_splits:
+        # not written by prepare_cafa3_data_seperate.py, the per-namespace
+        # datasets load their label index from it
+        for ns, namespace in NAMESPACE_SPLITS.items():
+            ns_terms = terms[selected[namespaces[selected] == namespace]]
+            ns_terms_file = os.path.join(output_path, ns, f'{ns}_terms.pkl')
+            pd.DataFrame({'terms': list(ns_terms)}).to_pickle(ns_terms_file)
+
+    logging.info('Loading testing annotations and sequences')
+    df, test_prop = load_annotated_proteins(test_sequences_file,
+                                            test_annotations_file, go)
+    df['prop_annotations'] = csr_to_term_sets(test_prop, terms)
     logging.info(f'Test proteins {len(df)}')
     logging.info(f'Saving testing data to {test_data_file}')
     df.to_pickle(test_data_file)
+    if namespace_splits:
+        save_namespace_splits(df, test_prop, terms, namespaces, 'test',
+                              output_path)
 
 
 if __name__ == '__main__':
@@ -9,6 +9,8 @@ sys.path.append('../')
 
 
 def seperate(data_file, go_file):
+    """Split an existing dataset by namespace. prepare_cafa3_data.py now
+    writes these splits directly."""
     df = pd.read_pickle(data_file)
     ont = Ontology(go_file, with_rels=True)
     bpo_proteins = []
@@ -31,11 +33,12 @@ def seperate(data_file, go_file):
         mfo_annotation = []
         cco_annotation = []
         for term in annotation:
-            if ont.get_namespace(term) == 'biological_process':
+            namespace = ont.get_namespace(term)
+            if namespace == 'biological_process':
                 bpo_annotation.append(term)
-            elif ont.get_namespace(term) == 'molecular_function':
+            elif namespace == 'molecular_function':
                 mfo_annotation.append(term)
-            elif ont.get_namespace(term) == 'cellular_component':
+            elif namespace == 'cellular_component':
                 cco_annotation.append(term)
         if len(bpo_annotation) > 0:
             bpo_proteins.append(protien)
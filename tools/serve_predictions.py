@@ -0,0 +1,128 @@
+import argparse
+import logging
+
+import torch
+import yaml
+
+from deepfold.trainer.serving import (DEFAULT_SERVE_TOP_K, PredictionServer,
+                                      PredictionService, UnixPredictionServer,
+                                      load_predictor)
+
+# The first arg parser parses out only the --config argument, this argument is used to
+# load a yaml file containing key-values that override the defaults for the main parser below
+config_parser = parser = argparse.ArgumentParser(description='Serving Config',
+                                                 add_help=False)
+parser.add_argument('-c',
+                    '--config',
+                    default='',
+                    type=str,
+                    metavar='FILE',
+                    help='YAML config file specifying default arguments')
+parser = argparse.ArgumentParser(
+    description='Serve GO predictions of an embedding based model')
+parser.add_argument('--data_path',
+                    default='',
+                    type=str,
+                    help='data dir of dataset')
+parser.add_argument('--model',
+                    default='mlp',
+                    choices=['mlp', 'protgcn'],
+                    help='prediction head on top of the ESM embeddings')
+parser.add_argument('--namespace',
+                    default='bpo',
+                    type=str,
+                    help='label graph of the protgcn model')
+parser.add_argument('--terms_file',
+                    default='terms.pkl',
+                    type=str,
+                    help='terms of the mlp model, relative to data_path')
+parser.add_argument('--resume',
+                    required=True,
+                    type=str,
+                    metavar='PATH',
+                    help='model checkpoint')
+parser.add_argument('--go_file',
+                    default='go.obo',
+                    help='ontology used to propagate the scores, relative '
+                    'to data_path (empty: no propagation)')
+parser.add_argument('--esm_model',
+                    default='',
+                    type=str,
+                    help='ESM model embedding FASTA requests (empty: only '
+                    'precomputed embeddings are accepted)')
+parser.add_argument('--pool_mode', default='mean', help='embedding method')
+parser.add_argument('--embed_dim', default=1280, type=int)
+parser.add_argument('--device', default='cpu', type=str)
+parser.add_argument('--num_threads',
+                    default=None,
+                    type=int,
+                    help='torch intra-op threads')
+parser.add_argument('--max_batch_size', default=64, type=int)
+parser.add_argument('--max_embed_batch_size', default=16, type=int)
+parser.add_argument('--max_delay_ms',
+                    default=5.0,
+                    type=float,
+                    help='latency deadline of a micro-batch')
+parser.add_argument('--max_tokens',
+                    default=16384,
+                    type=int,
+                    help='residues per embedding batch')
+parser.add_argument('--top-k', default=DEFAULT_SERVE_TOP_K, type=int)
+parser.add_argument('--host', default='127.0.0.1', type=str)
+parser.add_argument('--port', default=8000, type=int)
+parser.add_argument('--unix_socket',
+                    default='',
+                    type=str,
+                    help='listen on this Unix socket instead of TCP')
+
+
+def main(args):
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    predictor = load_predictor(args.resume,
+                               model=args.model,
+                               data_path=args.data_path,
+                               terms_file=args.terms_file,
+                               namespace=args.namespace,
+                               go_file=args.go_file,
+                               esm_model=args.esm_model,
+                               embed_dim=args.embed_dim,
+                               device=args.device,
+                               pool_mode=args.pool_mode,
+                               max_tokens=args.max_tokens,
+                               top_k=args.top_k)
+    service = PredictionService(predictor,
+                                max_batch_size=args.max_batch_size,
+                                max_delay=args.max_delay_ms / 1000,
+                                max_embed_batch_size=args.max_embed_batch_size)
+    if args.unix_socket:
+        server = UnixPredictionServer(args.unix_socket, service)
+        logger.info(f'Serving predictions on {args.unix_socket}')
+    else:
+        server = PredictionServer((args.host, args.port), service)
+        logger.info(f'Serving predictions on {args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def _parse_args():
+    # Do we have a config file to parse?
+    args_config, remaining = config_parser.parse_known_args()
+    if args_config.config:
+        with open(args_config.config, 'r') as f:
+            cfg = yaml.safe_load(f)
+            parser.set_defaults(**cfg)
+    return parser.parse_args(remaining)
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    logger = logging.getLogger('')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    main(args)